@@ -0,0 +1,152 @@
+import uuid
+
+import h5py
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def h5_file():
+    """
+    An empty in-memory h5py.File
+    """
+    f = h5py.File("in_memory.h5", "w", driver="core", backing_store=False)
+    yield f
+    f.close()
+
+
+@pytest.fixture
+def synthetic_nwb(tmp_path):
+    """
+    A function that writes a small NWB file with h5py and returns its path.
+    See write_synthetic_nwb for the options.
+    """
+    def write(**kwargs):
+        path = str(tmp_path / f"synthetic_{uuid.uuid4().hex[:8]}.nwb")
+        write_synthetic_nwb(path, **kwargs)
+        return path
+    return write
+
+
+def write_synthetic_nwb(
+    path: str,
+    *,
+    spike_times: list,
+    unit_columns: dict = {},
+    traces: np.ndarray = None,
+    sampling_frequency: float = 30000.0,
+    timestamps: np.ndarray = None,
+    electrode_columns: dict = {},
+    group_names: list = None,
+    write_group_name: bool = True,
+):
+    """
+    Write a minimal NWB 2.6 file (readable by pynwb and by nwb_io.h5_nwb_reader)
+    with a units table and an ElectricalSeries /acquisition/es.
+
+    spike_times is a list of per-unit spike time arrays (written as given,
+    sorted or not). unit_columns are extra units table columns ({name:
+    values}, one value per unit). traces is the (frames x channels) int16
+    data of the ElectricalSeries, with either a rate (sampling_frequency) or
+    explicit timestamps. The electrodes table has location and group
+    columns, a group_name column unless write_group_name is False, and
+    electrode_columns ({name: values}). group_names are the per-channel
+    electrode group names, by default all "group0".
+    """
+    if traces is None:
+        traces = np.zeros((100, 2), dtype=np.int16)
+    num_channels = traces.shape[1]
+    if group_names is None:
+        group_names = ["group0"] * num_channels
+    with h5py.File(path, "w") as f:
+        _set_type(f, "core", "NWBFile")
+        f.attrs["nwb_version"] = "2.6.0"
+        for name in ["analysis", "processing", "stimulus/presentation", "stimulus/templates"]:
+            f.create_group(name)
+        f.create_dataset("file_create_date", data=["2020-01-01T00:00:00+00:00"], dtype=h5py.string_dtype())
+        for name, value in [
+            ("identifier", "synthetic"),
+            ("session_description", "synthetic"),
+            ("session_start_time", "2020-01-01T00:00:00+00:00"),
+            ("timestamps_reference_time", "2020-01-01T00:00:00+00:00"),
+        ]:
+            f.create_dataset(name, data=value, dtype=h5py.string_dtype())
+
+        device = f.create_group("general/devices/device")
+        _set_type(device, "core", "Device")
+        ephys = f["general"].create_group("extracellular_ephys")
+        electrode_group_refs = {}
+        for group_name in sorted(set(group_names)):
+            electrode_group = ephys.create_group(group_name)
+            _set_type(electrode_group, "core", "ElectrodeGroup")
+            electrode_group.attrs["description"] = "synthetic"
+            electrode_group.attrs["location"] = "synthetic"
+            electrode_group["device"] = h5py.SoftLink(device.name)
+            electrode_group_refs[group_name] = electrode_group.ref
+        electrodes = ephys.create_group("electrodes")
+        electrodes_columns = {
+            "location": np.array(["CA1"] * num_channels, dtype=object),
+            "group": np.array([electrode_group_refs[g] for g in group_names], dtype=h5py.ref_dtype),
+        }
+        if write_group_name:
+            electrodes_columns["group_name"] = np.array(group_names, dtype=object)
+        _write_table(electrodes, "hdmf-common", "DynamicTable", np.arange(num_channels), {
+            **electrodes_columns,
+            **electrode_columns,
+        })
+
+        es = f.create_group("acquisition/es")
+        _set_type(es, "core", "ElectricalSeries")
+        es.attrs["description"] = "synthetic"
+        es.attrs["comments"] = "no comments"
+        data = es.create_dataset("data", data=traces)
+        data.attrs["conversion"] = 1e-6
+        data.attrs["offset"] = 0.0
+        data.attrs["resolution"] = -1.0
+        data.attrs["unit"] = "volts"
+        region = es.create_dataset("electrodes", data=np.arange(num_channels))
+        _set_type(region, "hdmf-common", "DynamicTableRegion")
+        region.attrs["description"] = "all electrodes"
+        region.attrs["table"] = electrodes.ref
+        if timestamps is None:
+            starting_time = es.create_dataset("starting_time", data=0.0)
+            starting_time.attrs["rate"] = sampling_frequency
+            starting_time.attrs["unit"] = "seconds"
+        else:
+            ts = es.create_dataset("timestamps", data=np.asarray(timestamps, dtype=np.float64))
+            ts.attrs["interval"] = 1
+            ts.attrs["unit"] = "seconds"
+
+        units = f.create_group("units")
+        spike_times_index = np.cumsum([len(st) for st in spike_times])
+        _write_table(units, "core", "Units", np.arange(len(spike_times)), {
+            "spike_times": np.concatenate([np.asarray(st, dtype=np.float64) for st in spike_times] + [np.zeros((0,))]),
+            **unit_columns,
+        }, indices={"spike_times": spike_times_index})
+
+
+def _set_type(obj, namespace: str, neurodata_type: str):
+    obj.attrs["namespace"] = namespace
+    obj.attrs["neurodata_type"] = neurodata_type
+    obj.attrs["object_id"] = str(uuid.uuid4())
+
+
+def _write_table(group, namespace: str, neurodata_type: str, ids: np.ndarray, columns: dict, indices: dict = {}):
+    _set_type(group, namespace, neurodata_type)
+    group.attrs["description"] = "synthetic"
+    group.attrs["colnames"] = np.array(list(columns.keys()), dtype=h5py.string_dtype())
+    id_dataset = group.create_dataset("id", data=np.asarray(ids, dtype=np.int64))
+    _set_type(id_dataset, "hdmf-common", "ElementIdentifiers")
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype.kind in ("U", "O") and h5py.check_ref_dtype(values.dtype) is None:
+            dataset = group.create_dataset(name, data=values.astype(object), dtype=h5py.string_dtype())
+        else:
+            dataset = group.create_dataset(name, data=values)
+        _set_type(dataset, "hdmf-common", "VectorData")
+        dataset.attrs["description"] = name
+        if name in indices:
+            index = group.create_dataset(f"{name}_index", data=np.asarray(indices[name], dtype=np.uint64))
+            _set_type(index, "hdmf-common", "VectorIndex")
+            index.attrs["description"] = f"Index for VectorData '{name}'"
+            index.attrs["target"] = dataset.ref
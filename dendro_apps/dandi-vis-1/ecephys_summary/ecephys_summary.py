@@ -1,5 +1,10 @@
 #!/usr/bin/env python
 
+import os
+import re
+import json
+import hashlib
+from typing import List, Optional
 from dendro.sdk import ProcessorBase, InputFile, OutputFile
 from dendro.sdk import BaseModel, Field
 import numpy as np
@@ -8,8 +13,16 @@ import numpy as np
 class EcephysSummaryContext(BaseModel):
     input: InputFile = Field(description="Input recording as SI .json file")
     output: OutputFile = Field(description="Output .nh5 file")
-    n_jobs: int = Field(default=4, description="Number of jobs to use for writing .dat file")
+    n_jobs: int = Field(default=4, description="Number of jobs to use for writing .dat file and for reducing batches")
     chunk_duration: str = Field(default="1s", description="Chunk duration for writing .dat file")
+    write_dat_file: bool = Field(default=False, description="Write the recording to an intermediate float32 .dat file before computing the summary (otherwise the summary is computed in a single streaming pass over the input recording)")
+    num_levels: int = Field(default=3, description="Number of levels in the min/max pyramid")
+    downsample_factor: int = Field(default=5, description="Ratio between the bin sizes of consecutive levels of the min/max pyramid")
+    stats: List[str] = Field(default=["min", "max"], description="Per-bin statistics to compute, any of min, max, rms, mean_abs")
+    quantize: bool = Field(default=False, description="Store min/max as int16 with a per-channel scale and offset (value = stored * scale + offset) estimated from a sampling pass over the recording, rather than casting the traces to int16 directly")
+    decimated_sampling_frequencies: List[float] = Field(default=[], description="Approximate sampling frequencies (Hz) of anti-aliased, decimated copies of the traces to include, e.g. [1000, 100]")
+    max_memory: str = Field(default="2G", description="Approximate memory budget of all jobs at once, e.g. 500M, 2G, 2GB or 2GiB, including the decoded-chunk cache of each job's copy of the recording and the batches in flight; determines the batch size")
+    checkpoint_dir: str = Field(default="", description="Directory for the intermediate output .h5 file, .dat file and progress file from which an interrupted job resumes (use one directory per job); by default the working directory, which does not survive a restart of the job in a fresh container")
 
 
 class EcephysSummaryProcessor(ProcessorBase):
@@ -31,91 +44,802 @@ class EcephysSummaryProcessor(ProcessorBase):
         recording1 = si.load_extractor('recording.json')
         assert isinstance(recording1, si.BaseRecording), "Recording is not a BaseRecording"
 
-        print('Writing recording to .dat file...')
-        si.BinaryRecordingExtractor.write_recording(
-            recording=recording1,
-            file_paths=['recording.dat'],
-            dtype='float32',
-            n_jobs=context.n_jobs,
-            chunk_duration=context.chunk_duration,
-            mp_context='spawn'
-        )
-        print('Loading recording from .dat file...')
-        recording = si.BinaryRecordingExtractor(
-            file_paths=['recording.dat'],
-            sampling_frequency=recording1.get_sampling_frequency(),
-            channel_ids=recording1.get_channel_ids(),
-            num_channels=recording1.get_num_channels(),
-            dtype='float32'
-        )
+        # Progress is recorded in a sidecar file so that a restarted job with
+        # the same input skips the .dat write and the completed batches.
+        checkpoint_dir = context.checkpoint_dir
+        if checkpoint_dir:
+            os.makedirs(checkpoint_dir, exist_ok=True)
+        dat_path = os.path.join(checkpoint_dir, 'recording.dat')
+        output_h5_path = os.path.join(checkpoint_dir, 'output.h5')
+        progress_path = output_h5_path + '.progress.json'
+        with open('recording.json', 'rb') as fr:
+            recording_hash = hashlib.sha1(fr.read()).hexdigest()
+        progress = _load_progress(progress_path)
+        if progress.get('recording_hash') != recording_hash:
+            progress = {'recording_hash': recording_hash}
 
-        print('Setting channel locations...')
-        recording.set_channel_locations(recording1.get_channel_locations())
+        if context.write_dat_file:
+            if progress.get('dat_file_complete', False) and os.path.exists(dat_path):
+                print('Using existing .dat file')
+            else:
+                print('Writing recording to .dat file...')
+                si.BinaryRecordingExtractor.write_recording(
+                    recording=recording1,
+                    file_paths=[dat_path],
+                    dtype='float32',
+                    n_jobs=context.n_jobs,
+                    chunk_duration=context.chunk_duration,
+                    mp_context='spawn'
+                )
+                progress['dat_file_complete'] = True
+                _save_progress(progress_path, progress)
+            print('Loading recording from .dat file...')
+            recording = si.BinaryRecordingExtractor(
+                file_paths=[dat_path],
+                sampling_frequency=recording1.get_sampling_frequency(),
+                channel_ids=recording1.get_channel_ids(),
+                num_channels=recording1.get_num_channels(),
+                dtype='float32'
+            )
+
+            print('Setting channel locations...')
+            recording.set_channel_locations(recording1.get_channel_locations())
+        else:
+            # read the input recording directly, batch by batch, in its own dtype
+            recording = recording1
+
+        assert context.num_levels >= 1, "num_levels must be at least 1"
+        assert context.downsample_factor >= 2, "downsample_factor must be at least 2"
+        assert len(context.stats) > 0, "At least one statistic must be computed"
+        for stat in context.stats:
+            assert stat in _STAT_DTYPES, f"Unsupported statistic: {stat}"
+        stats = list(context.stats)
+        decimation_factors = []
+        for decimated_sampling_frequency in context.decimated_sampling_frequencies:
+            decimation_factor = int(round(recording.get_sampling_frequency() / decimated_sampling_frequency))
+            assert decimation_factor >= 2, f"Decimated sampling frequency is too high: {decimated_sampling_frequency}"
+            decimation_factors.append(decimation_factor)
+        num_levels = context.num_levels
+        downsample_factor = context.downsample_factor
 
         num_frames = int(recording.get_num_frames())
         bin_size_sec = 1 / 5
         bin_size_frames = int(bin_size_sec * recording.get_sampling_frequency())
-        num_bins = int(num_frames / bin_size_frames)
+        # the last bin of each level may be partial
+        num_bins = int(np.ceil(num_frames / bin_size_frames))
         M = int(recording.get_num_channels())
 
-        print('Creating output .h5 file...')
-        with h5py.File("output.h5", "w") as f:
-            f.attrs["type"] = "ecephys_summary"
-            f.attrs["format_version"] = 1
-            f.attrs["num_frames"] = num_frames
-            f.attrs["sampling_frequency"] = float(recording.get_sampling_frequency())
-            f.attrs["num_channels"] = int(recording.get_num_channels())
-            # attributes must be homogeneous types
-            f.attrs["channel_ids"] = _format_ids([id for id in recording.get_channel_ids()])
-            f.create_dataset("channel_locations", data=recording.get_channel_locations().astype(np.float32))
-            p_min = f.create_dataset("/binned_arrays/min", data=np.zeros((num_bins, M), dtype=np.int16))
-            p_max = f.create_dataset("/binned_arrays/max", data=np.zeros((num_bins, M), dtype=np.int16))
-            p_min_ds5 = f.create_dataset("/binned_arrays/min_ds5", data=np.zeros((int(num_bins / 5), M), dtype=np.int16))
-            p_max_ds5 = f.create_dataset("/binned_arrays/max_ds5", data=np.zeros((int(num_bins / 5), M), dtype=np.int16))
-            p_min_ds25 = f.create_dataset("/binned_arrays/min_ds25", data=np.zeros((int(num_bins / 25), M), dtype=np.int16))
-            p_max_ds25 = f.create_dataset("/binned_arrays/max_ds25", data=np.zeros((int(num_bins / 25), M), dtype=np.int16))
-            for p in [p_min, p_max]:
-                p.attrs["bin_size_sec"] = bin_size_sec
-                p.attrs["bin_size_frames"] = bin_size_frames
-                p.attrs["num_bins"] = num_bins
-            for p in [p_min_ds5, p_max_ds5]:
-                p.attrs["bin_size_sec"] = bin_size_sec * 5
-                p.attrs["bin_size_frames"] = bin_size_frames * 5
-                p.attrs["num_bins"] = int(num_bins / 5)
-            for p in [p_min_ds25, p_max_ds25]:
-                p.attrs["bin_size_sec"] = bin_size_sec * 25
-                p.attrs["bin_size_frames"] = bin_size_frames * 25
-                p.attrs["num_bins"] = int(num_bins / 25)
-            batches = []
-            num_bins_per_batch = 25 * 50  # should be a multiple of 25
-            i = 0
-            while i < num_bins:
-                bin_start = i
-                bin_end = min(i + num_bins_per_batch, num_bins)
-                batches.append({'bin_start': bin_start, 'bin_end': bin_end})
-                i += num_bins_per_batch
-            for ib in range(len(batches)):
-                print(f'Processing batch {ib + 1} of {len(batches)}')
-                bin_start = batches[ib]['bin_start']
-                bin_end = batches[ib]['bin_end']
-                num_bins_in_batch = bin_end - bin_start
-                X = recording.get_traces(start_frame=bin_start * bin_size_frames, end_frame=bin_end * bin_size_frames)
-                X_reshaped = X.reshape((num_bins_in_batch, bin_size_frames, M)).astype(np.int16)
-                p_min[bin_start:bin_end, :] = np.min(X_reshaped, axis=1)
-                p_max[bin_start:bin_end, :] = np.max(X_reshaped, axis=1)
-                X_ds5 = X_reshaped.reshape((int(num_bins_in_batch / 5), 5, bin_size_frames, M))
-                p_min_ds5[int(bin_start / 5):int(bin_end / 5), :] = np.min(X_ds5, axis=(1, 2))
-                p_max_ds5[int(bin_start / 5):int(bin_end / 5), :] = np.max(X_ds5, axis=(1, 2))
-                X_ds25 = X_reshaped.reshape((int(num_bins_in_batch / 25), 25, bin_size_frames, M))
-                p_min_ds25[int(bin_start / 25):int(bin_end / 25), :] = np.min(X_ds25, axis=(1, 2))
-                p_max_ds25[int(bin_start / 25):int(bin_end / 25), :] = np.max(X_ds25, axis=(1, 2))
+        max_bins_per_batch = _get_max_bins_per_batch(
+            recording=recording,
+            max_memory=_parse_memory_size(context.max_memory),
+            n_jobs=context.n_jobs,
+            bin_size_frames=bin_size_frames,
+            stats=stats,
+            decimation_factors=decimation_factors
+        )
+
+        # The finer levels are reduced batch by batch, so the batch size must
+        # be a multiple of the coarsest of these. The remaining (coarser)
+        # levels are reduced from the level below after the pass over the
+        # recording.
+        num_batch_levels = 1
+        while num_batch_levels < num_levels and downsample_factor ** num_batch_levels <= max_bins_per_batch:
+            num_batch_levels += 1
+        batch_factor = downsample_factor ** (num_batch_levels - 1)
+        num_bins_per_batch = batch_factor * (max_bins_per_batch // batch_factor)
+        print(f'Using batches of {num_bins_per_batch} bins ({num_bins_per_batch * bin_size_sec:g} sec)')
+
+        if context.quantize:
+            print('Estimating quantization scale and offset...')
+            quantization = _estimate_quantization(recording)
+        else:
+            quantization = None
+
+        batches = []
+        i = 0
+        while i < num_bins:
+            bin_start = i
+            bin_end = min(i + num_bins_per_batch, num_bins)
+            batches.append({'bin_start': bin_start, 'bin_end': bin_end})
+            i += num_bins_per_batch
+
+        # completed batches can only be reused if they were computed with
+        # the same layout
+        summary_params = {
+            'write_dat_file': context.write_dat_file,
+            'num_frames': num_frames,
+            'num_channels': M,
+            'bin_size_frames': bin_size_frames,
+            'num_levels': num_levels,
+            'downsample_factor': downsample_factor,
+            'stats': stats,
+            'quantize': context.quantize,
+            'decimation_factors': decimation_factors,
+            'num_bins_per_batch': num_bins_per_batch
+        }
+        f = None
+        if progress.get('summary_params') == summary_params and os.path.exists(output_h5_path):
+            try:
+                f = h5py.File(output_h5_path, "r+")
+                p_levels = _get_binned_arrays(f, stats, num_levels, downsample_factor)
+                p_decimated = _get_decimated_traces(f, decimation_factors)
+                print(f'Resuming from {len(progress["completed_batches"])} completed batches')
+            except (OSError, KeyError):
+                print('Unable to resume from existing output .h5 file')
+                if f is not None:
+                    f.close()
+                f = None
+        create_output = f is None
+        if create_output:
+            print('Creating output .h5 file...')
+            progress['summary_params'] = summary_params
+            progress['completed_batches'] = []
+            _save_progress(progress_path, progress)
+            f = h5py.File(output_h5_path, "w")
+        try:
+            if create_output:
+                f.attrs["type"] = "ecephys_summary"
+                f.attrs["format_version"] = 1
+                f.attrs["num_frames"] = num_frames
+                f.attrs["sampling_frequency"] = float(recording.get_sampling_frequency())
+                f.attrs["num_channels"] = int(recording.get_num_channels())
+                # attributes must be homogeneous types
+                f.attrs["channel_ids"] = _format_ids([id for id in recording.get_channel_ids()])
+                f.create_dataset("channel_locations", data=recording.get_channel_locations().astype(np.float32))
+                p_levels = _create_binned_arrays(
+                    f,
+                    num_bins=num_bins,
+                    num_channels=M,
+                    bin_size_sec=bin_size_sec,
+                    bin_size_frames=bin_size_frames,
+                    stats=stats,
+                    num_levels=num_levels,
+                    downsample_factor=downsample_factor,
+                    quantization=quantization
+                )
+                p_decimated = _create_decimated_traces(
+                    f,
+                    num_frames=num_frames,
+                    num_channels=M,
+                    sampling_frequency=recording.get_sampling_frequency(),
+                    decimation_factors=decimation_factors,
+                    quantization=quantization
+                )
+
+            completed_batches = set(tuple(b) for b in progress['completed_batches'])
+            remaining_batches = [
+                batch for batch in batches
+                if (batch['bin_start'], batch['bin_end']) not in completed_batches
+            ]
+            reduced_batches = _iterate_reduced_batches(
+                recording=recording,
+                batches=remaining_batches,
+                bin_size_frames=bin_size_frames,
+                stats=stats,
+                num_levels=num_batch_levels,
+                downsample_factor=downsample_factor,
+                quantization=quantization,
+                decimation_factors=decimation_factors,
+                n_jobs=context.n_jobs
+            )
+            for batch, (reduced, decimated) in reduced_batches:
+                _write_reduced_batch(
+                    p_levels=p_levels,
+                    p_decimated=p_decimated,
+                    bin_start=batch['bin_start'],
+                    reduced=reduced,
+                    decimated=decimated,
+                    bin_size_frames=bin_size_frames,
+                    downsample_factor=downsample_factor,
+                    decimation_factors=decimation_factors
+                )
+                # the batch is only marked complete once its data is on disk
+                f.flush()
+                progress['completed_batches'].append([batch['bin_start'], batch['bin_end']])
+                _save_progress(progress_path, progress)
+                print(f'Processed batch {len(progress["completed_batches"])} of {len(batches)}')
+            _reduce_remaining_levels(
+                p_levels=p_levels,
+                stats=stats,
+                num_frames=num_frames,
+                bin_size_frames=bin_size_frames,
+                num_batch_levels=num_batch_levels,
+                downsample_factor=downsample_factor,
+                quantization=quantization
+            )
+        finally:
+            f.close()
 
         print('Converting .h5 to .nh5...')
-        h5_to_nh5("output.h5", "output.nh5")
+        h5_to_nh5(output_h5_path, "output.nh5")
         print('Uploading .nh5...')
         context.output.upload("output.nh5")
 
 
+def _parse_memory_size(memory: str):
+    # e.g. "500M", "2G", "2GB", "2g" (decimal) or "2GiB", "2Gi" (binary) ->
+    # number of bytes
+    m = re.fullmatch(r"\s*([0-9]*\.?[0-9]+)\s*(?:([kKmMgGtT])(i?)[bB]?|[bB])?\s*", memory)
+    if m is None:
+        raise ValueError(f"Invalid memory size: {memory!r}; expected e.g. 500M, 2G, 2GB or 2GiB")
+    value, unit, binary = m.groups()
+    if unit is None:
+        return float(value)
+    exponent = 'kmgt'.index(unit.lower()) + 1
+    return float(value) * (1024 if binary else 1000) ** exponent
+
+
+def _get_max_bins_per_batch(
+    recording,
+    max_memory: float,
+    n_jobs: int,
+    bin_size_frames: int,
+    stats: list,
+    decimation_factors: list
+):
+    """
+    The largest number of bins per batch for which the estimated memory
+    used by all processes stays within max_memory bytes. Each job holds:
+
+    - the traces of its batch in the source dtype, plus about as much again
+      for intermediate copies made while reading, including the margin read
+      on both sides for the decimation filters
+    - the float64 decimated traces of its batch and their int16 copies
+    - the decoded-chunk cache of its copy of the recording (chunk_cache_size
+      of NwbRecordingExtractor), which the main process also has when the
+      batches are reduced in worker processes
+
+    With n_jobs > 1, the main process also holds the results of up to
+    2 * n_jobs batches in flight (see _iterate_reduced_batches).
+    """
+    M = int(recording.get_num_channels())
+    itemsize = np.dtype(recording.get_dtype()).itemsize
+    num_jobs = max(1, n_jobs)
+    num_processes = num_jobs + 1 if n_jobs > 1 else 1
+    num_in_flight = 2 * n_jobs if n_jobs > 1 else 0
+    margin = max([len(_get_decimation_filter(q)) // 2 for q in decimation_factors], default=0)
+    fixed_bytes_per_job = 2 * 2 * margin * M * itemsize
+    fixed_bytes = num_jobs * fixed_bytes_per_job + num_processes * _get_chunk_cache_size(recording)
+    # the decimated samples of a bin, rounded up
+    decimated_samples_per_bin = sum(-(-bin_size_frames // q) for q in decimation_factors)
+    bytes_per_bin = 2 * bin_size_frames * M * itemsize + decimated_samples_per_bin * M * (8 + 2)
+    # the levels of a batch together have at most twice the bins of the first
+    result_bytes_per_bin = 2 * M * sum(np.dtype(_STAT_DTYPES[stat]).itemsize for stat in stats) + decimated_samples_per_bin * M * 2
+    available_bytes = max_memory - fixed_bytes
+    max_bins_per_batch = int(available_bytes // (num_jobs * bytes_per_bin + num_in_flight * result_bytes_per_bin))
+    if max_bins_per_batch < 1:
+        print(f'Warning: max_memory is too small for {num_jobs} jobs (about {fixed_bytes / 1e6:g} MB are used besides the batches)')
+        max_bins_per_batch = 1
+    return max_bins_per_batch
+
+
+def _get_chunk_cache_size(recording):
+    # chunk_cache_size of the recording and of the recordings it is derived
+    # from (e.g. for a preprocessed NwbRecordingExtractor)
+    from spikeinterface.core.base import BaseExtractor
+
+    size = int(recording._kwargs.get('chunk_cache_size', 0) or 0)
+    for value in recording._kwargs.values():
+        parents = value if isinstance(value, (list, tuple)) else [value]
+        for parent in parents:
+            if isinstance(parent, BaseExtractor):
+                size += _get_chunk_cache_size(parent)
+    return size
+
+
+def _get_chunk_shape(num_bins: int, num_channels: int, itemsize: int, target_chunk_bytes: int = 2**20):
+    # time-chunked with all channels in each chunk, about target_chunk_bytes
+    # per chunk, so that a time window touches as few chunks as possible
+    if num_bins == 0 or num_channels == 0:
+        return None
+    num_bins_per_chunk = max(1, target_chunk_bytes // (num_channels * itemsize))
+    return (min(num_bins, num_bins_per_chunk), num_channels)
+
+
+def _create_binned_arrays(
+    f,
+    num_bins: int,
+    num_channels: int,
+    bin_size_sec: float,
+    bin_size_frames: int,
+    stats: list,
+    num_levels: int,
+    downsample_factor: int,
+    quantization: Optional[dict]
+):
+    """
+    Create the /binned_arrays datasets and return them as
+    [{stat: dataset}, ...], one entry per pyramid level. With quantization,
+    the min/max datasets get per-channel scale and offset attributes.
+    """
+    binned_arrays_group = f.create_group("binned_arrays")
+    binned_arrays_group.attrs["stats"] = stats
+    binned_arrays_group.attrs["num_levels"] = num_levels
+    binned_arrays_group.attrs["downsample_factor"] = downsample_factor
+    p_levels = []
+    for level in range(num_levels):
+        factor = downsample_factor ** level
+        num_bins_in_level = int(np.ceil(num_bins / factor))
+        p_level = {}
+        for stat in stats:
+            dtype = np.dtype(_STAT_DTYPES[stat])
+            # created empty (read back as zeros until written), without
+            # allocating the full array in memory
+            p = binned_arrays_group.create_dataset(
+                _binned_array_name(stat, level, downsample_factor),
+                shape=(num_bins_in_level, num_channels),
+                dtype=dtype,
+                chunks=_get_chunk_shape(num_bins_in_level, num_channels, dtype.itemsize),
+                fillvalue=0
+            )
+            p.attrs["bin_size_sec"] = bin_size_sec * factor
+            p.attrs["bin_size_frames"] = bin_size_frames * factor
+            p.attrs["num_bins"] = num_bins_in_level
+            if quantization is not None and stat in ['min', 'max']:
+                p.attrs["scale"] = np.asarray(quantization['scale'], dtype=np.float64)
+                p.attrs["offset"] = np.asarray(quantization['offset'], dtype=np.float64)
+            p_level[stat] = p
+        p_levels.append(p_level)
+    return p_levels
+
+
+def _get_binned_arrays(f, stats: list, num_levels: int, downsample_factor: int):
+    # the datasets of an existing file, in the layout of _create_binned_arrays
+    binned_arrays_group = f["binned_arrays"]
+    return [
+        {stat: binned_arrays_group[_binned_array_name(stat, level, downsample_factor)] for stat in stats}
+        for level in range(num_levels)
+    ]
+
+
+def _create_decimated_traces(
+    f,
+    num_frames: int,
+    num_channels: int,
+    sampling_frequency: float,
+    decimation_factors: list,
+    quantization: Optional[dict]
+):
+    """
+    Create the /decimated_traces datasets, one per decimation factor, and
+    return them in the order of decimation_factors.
+    """
+    decimated_traces_group = f.create_group("decimated_traces")
+    decimated_traces_group.attrs["decimation_factors"] = decimation_factors
+    p_decimated = []
+    for decimation_factor in decimation_factors:
+        num_samples = int(np.ceil(num_frames / decimation_factor))
+        p = decimated_traces_group.create_dataset(
+            f'traces_ds{decimation_factor}',
+            shape=(num_samples, num_channels),
+            dtype=np.int16,
+            chunks=_get_chunk_shape(num_samples, num_channels, np.dtype(np.int16).itemsize),
+            fillvalue=0
+        )
+        p.attrs["sampling_frequency"] = float(sampling_frequency / decimation_factor)
+        p.attrs["decimation_factor"] = decimation_factor
+        p.attrs["num_samples"] = num_samples
+        if quantization is not None:
+            p.attrs["scale"] = np.asarray(quantization['scale'], dtype=np.float64)
+            p.attrs["offset"] = np.asarray(quantization['offset'], dtype=np.float64)
+        p_decimated.append(p)
+    return p_decimated
+
+
+def _get_decimated_traces(f, decimation_factors: list):
+    # the datasets of an existing file, in the layout of _create_decimated_traces
+    decimated_traces_group = f["decimated_traces"]
+    return [decimated_traces_group[f'traces_ds{decimation_factor}'] for decimation_factor in decimation_factors]
+
+
+def _load_progress(path: str):
+    if not os.path.exists(path):
+        return {}
+    try:
+        with open(path, 'r') as fr:
+            return json.load(fr)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_progress(path: str, progress: dict):
+    # write to a temporary file first so that an interrupted write does not
+    # leave a truncated progress file behind
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as fw:
+        json.dump(progress, fw)
+    os.replace(tmp_path, path)
+
+
+# min and max are stored in the int16 units of the traces; rms and
+# mean_abs are averages and keep their fractional part
+_STAT_DTYPES = {
+    'min': np.int16,
+    'max': np.int16,
+    'rms': np.float32,
+    'mean_abs': np.float32
+}
+
+
+def _binned_array_name(stat: str, level: int, downsample_factor: int):
+    # <stat> for the finest level, <stat>_ds<factor> for the others
+    if level == 0:
+        return stat
+    return f'{stat}_ds{downsample_factor ** level}'
+
+
+def _get_bin_counts(num_frames: int, bin_size_frames: int):
+    # number of frames in each bin; the last bin may be partial
+    num_bins = int(np.ceil(num_frames / bin_size_frames))
+    counts = np.full((num_bins,), bin_size_frames, dtype=np.int64)
+    if num_bins > 0:
+        counts[-1] = num_frames - (num_bins - 1) * bin_size_frames
+    return counts
+
+
+def _sum_bins(X: np.ndarray, bin_size_frames: int, func, max_block_size: int = 2**22):
+    """
+    Sum func(X) within bins of bin_size_frames along the first axis. The
+    sums are accumulated in float64, a block of whole bins at a time so that
+    the float64 temporary stays small.
+    """
+    num_bins = int(np.ceil(X.shape[0] / bin_size_frames))
+    num_bins_per_block = max(1, max_block_size // max(1, bin_size_frames * X.shape[1]))
+    ret = np.zeros((num_bins, X.shape[1]), dtype=np.float64)
+    for b1 in range(0, num_bins, num_bins_per_block):
+        b2 = min(b1 + num_bins_per_block, num_bins)
+        Y = func(X[b1 * bin_size_frames:b2 * bin_size_frames].astype(np.float64))
+        ret[b1:b2] = np.add.reduceat(Y, np.arange(0, Y.shape[0], bin_size_frames), axis=0)
+    return ret
+
+
+def _traces_to_accumulators(X: np.ndarray, bin_size_frames: int, stats: list):
+    """
+    Reduce traces to per-bin accumulators from which the requested stats
+    can be derived, and from which coarser bins can be accumulated:
+    min/max in the source dtype, float64 sums of squares and of absolute
+    values, and the number of frames in each bin.
+    """
+    bin_starts = np.arange(0, X.shape[0], bin_size_frames)
+    accumulators = {'count': np.diff(np.append(bin_starts, X.shape[0]))}
+    # min/max are reduced in the source dtype and only converted once
+    # finalized. This gives the same result as converting the traces first
+    # only because _quantize rounds and clips (both non-decreasing); a plain
+    # astype(np.int16) wraps out-of-range values and would not.
+    if 'min' in stats:
+        accumulators['min'] = np.minimum.reduceat(X, bin_starts, axis=0)
+    if 'max' in stats:
+        accumulators['max'] = np.maximum.reduceat(X, bin_starts, axis=0)
+    if 'rms' in stats:
+        accumulators['sum_squares'] = _sum_bins(X, bin_size_frames, np.square)
+    if 'mean_abs' in stats:
+        accumulators['sum_abs'] = _sum_bins(X, bin_size_frames, np.abs)
+    return accumulators
+
+
+def _coarsen_accumulators(accumulators: dict, block_size: int):
+    """
+    Combine accumulators along the first axis in blocks of block_size. The
+    last block is partial if the length is not a multiple of block_size.
+    """
+    block_starts = np.arange(0, accumulators['count'].shape[0], block_size)
+    ret = {}
+    for key, value in accumulators.items():
+        if key == 'min':
+            ret[key] = np.minimum.reduceat(value, block_starts, axis=0)
+        elif key == 'max':
+            ret[key] = np.maximum.reduceat(value, block_starts, axis=0)
+        else:
+            ret[key] = np.add.reduceat(value, block_starts, axis=0)
+    return ret
+
+
+def _accumulators_to_binned_values(accumulators: dict, stats: list, quantization: Optional[dict]):
+    count = accumulators['count'][:, None]
+    ret = {}
+    for stat in stats:
+        if stat in ['min', 'max']:
+            ret[stat] = _quantize(accumulators[stat], quantization)
+        elif stat == 'rms':
+            ret[stat] = np.sqrt(accumulators['sum_squares'] / count).astype(_STAT_DTYPES[stat])
+        elif stat == 'mean_abs':
+            ret[stat] = (accumulators['sum_abs'] / count).astype(_STAT_DTYPES[stat])
+        else:
+            raise ValueError(f"Unsupported statistic: {stat}")
+    return ret
+
+
+def _binned_values_to_accumulators(binned_values: dict, counts: np.ndarray, quantization: Optional[dict]):
+    # inverse of _accumulators_to_binned_values, given the bin counts
+    count = counts[:, None].astype(np.float64)
+    accumulators = {'count': counts}
+    for stat, value in binned_values.items():
+        if stat in ['min', 'max']:
+            accumulators[stat] = _dequantize(value, quantization)
+        elif stat == 'rms':
+            accumulators['sum_squares'] = np.square(value.astype(np.float64)) * count
+        elif stat == 'mean_abs':
+            accumulators['sum_abs'] = value.astype(np.float64) * count
+        else:
+            raise ValueError(f"Unsupported statistic: {stat}")
+    return accumulators
+
+
+def _estimate_quantization(recording, num_snippets: int = 50, snippet_duration_sec: float = 1, headroom: float = 2):
+    """
+    Estimate the per-channel scale and offset (value = stored * scale +
+    offset) for storing min/max as int16. Integer traces that already fit
+    in int16 are stored as they are. Otherwise the range of each channel is
+    sampled from num_snippets evenly spaced snippets; the offset is the
+    center of that range and the scale maps headroom times its half-width
+    to the int16 range, since the snippets can miss the extremes. Values
+    outside the range are clipped when quantized.
+    """
+    M = int(recording.get_num_channels())
+    dtype = np.dtype(recording.get_dtype())
+    if np.issubdtype(dtype, np.integer) and np.iinfo(dtype).min >= -32768 and np.iinfo(dtype).max <= 32767:
+        return {'scale': np.ones((M,)), 'offset': np.zeros((M,))}
+    num_frames = int(recording.get_num_frames())
+    snippet_frames = min(num_frames, max(1, int(snippet_duration_sec * recording.get_sampling_frequency())))
+    snippet_starts = np.unique(np.linspace(0, num_frames - snippet_frames, num_snippets).astype(np.int64))
+    channel_min = np.full((M,), np.inf)
+    channel_max = np.full((M,), -np.inf)
+    for start in snippet_starts:
+        X = recording.get_traces(start_frame=int(start), end_frame=int(start) + snippet_frames)
+        channel_min = np.minimum(channel_min, np.min(X, axis=0))
+        channel_max = np.maximum(channel_max, np.max(X, axis=0))
+    offset = (channel_min + channel_max) / 2
+    half_range = (channel_max - channel_min) / 2 * headroom
+    # constant channels would otherwise get a scale of zero
+    scale = np.where(half_range > 0, half_range / 32767, 1)
+    return {'scale': scale, 'offset': offset}
+
+
+def _quantize(value: np.ndarray, quantization: Optional[dict]):
+    # to int16, rounded and clipped rather than truncated and wrapped;
+    # without quantization the values stay in the units of the traces (the
+    # decimated traces are float even for int16 recordings)
+    if quantization is None:
+        return np.clip(np.round(value), -32768, 32767).astype(np.int16)
+    q = np.round((value - quantization['offset']) / quantization['scale'])
+    return np.clip(q, -32768, 32767).astype(np.int16)
+
+
+def _dequantize(value: np.ndarray, quantization: Optional[dict]):
+    if quantization is None:
+        return value
+    return value * quantization['scale'] + quantization['offset']
+
+
+def _get_decimation_filter(decimation_factor: int, num_taps_per_factor: int = 16):
+    """
+    Windowed-sinc (Hamming) low-pass FIR filter for decimating by
+    decimation_factor. The cutoff is at 0.8 of the decimated Nyquist
+    frequency and the transition band ends at about the decimated Nyquist
+    frequency, so that aliasing is attenuated by about 50 dB.
+    """
+    num_taps = num_taps_per_factor * decimation_factor + 1
+    n = np.arange(num_taps) - num_taps // 2
+    cutoff = 0.8 * 0.5 / decimation_factor
+    h = 2 * cutoff * np.sinc(2 * cutoff * n) * np.hamming(num_taps)
+    return h / np.sum(h)
+
+
+def _decimate(X_read: np.ndarray, read_start: int, frame_start: int, frame_end: int, num_frames: int, decimation_factor: int):
+    """
+    Low-pass filter and decimate the traces, returning the decimated samples
+    k with k * decimation_factor in [frame_start, frame_end). X_read holds
+    the frames starting at read_start and must extend half the filter
+    length beyond [frame_start, frame_end), except where that is beyond the
+    recording, in which case the first/last frame is repeated. Only the
+    output samples are computed, one filter tap at a time, so the float64
+    temporaries have the size of the decimated output.
+    """
+    h = _get_decimation_filter(decimation_factor)
+    half = len(h) // 2
+    k1 = -(-frame_start // decimation_factor)
+    k2 = -(-frame_end // decimation_factor)
+    num_samples = k2 - k1
+    if num_samples == 0:
+        return np.zeros((0, X_read.shape[1]), dtype=np.float64)
+    # pad at the ends of the recording only
+    pad_before = max(0, half - k1 * decimation_factor)
+    pad_after = max(0, (k2 - 1) * decimation_factor + half + 1 - num_frames)
+    assert read_start <= max(0, k1 * decimation_factor - half)
+    if pad_before > 0 or pad_after > 0:
+        X_read = np.pad(X_read, ((pad_before, pad_after), (0, 0)), mode='edge')
+    # index in X_read of the first frame under the filter for sample k1
+    i0 = k1 * decimation_factor - half - read_start + pad_before
+    ret = np.zeros((num_samples, X_read.shape[1]), dtype=np.float64)
+    for j in range(len(h)):
+        i1 = i0 + j
+        ret += h[j] * X_read[i1:i1 + (num_samples - 1) * decimation_factor + 1:decimation_factor]
+    return ret
+
+
+def _reduce_batch(
+    recording,
+    bin_start: int,
+    bin_end: int,
+    bin_size_frames: int,
+    stats: list,
+    num_levels: int,
+    downsample_factor: int,
+    quantization: Optional[dict],
+    decimation_factors: list
+):
+    """
+    Return (levels, decimated) for the bins [bin_start, bin_end).
+
+    levels is [{stat: values}, ...] for each of the first num_levels levels.
+    The first level is reduced from the traces and each subsequent level
+    from the level before it. decimated holds the samples of each decimated
+    copy of the traces that fall in the batch. The traces are read once,
+    with enough margin on both sides for the decimation filters.
+    """
+    num_frames = int(recording.get_num_frames())
+    frame_start = bin_start * bin_size_frames
+    frame_end = min(bin_end * bin_size_frames, num_frames)
+    margin = max([len(_get_decimation_filter(q)) // 2 for q in decimation_factors], default=0)
+    read_start = max(0, frame_start - margin)
+    read_end = min(num_frames, frame_end + margin)
+    X_read = recording.get_traces(start_frame=read_start, end_frame=read_end)
+    X = X_read[frame_start - read_start:frame_end - read_start]
+    accumulators = _traces_to_accumulators(X, bin_size_frames, stats)
+    del X
+    levels = [_accumulators_to_binned_values(accumulators, stats, quantization)]
+    for _ in range(1, num_levels):
+        accumulators = _coarsen_accumulators(accumulators, downsample_factor)
+        levels.append(_accumulators_to_binned_values(accumulators, stats, quantization))
+    decimated = [
+        _quantize(_decimate(X_read, read_start, frame_start, frame_end, num_frames, q), quantization)
+        for q in decimation_factors
+    ]
+    return levels, decimated
+
+
+def _write_reduced_batch(
+    p_levels: list,
+    p_decimated: list,
+    bin_start: int,
+    reduced: list,
+    decimated: list,
+    bin_size_frames: int,
+    downsample_factor: int,
+    decimation_factors: list
+):
+    # write the output of _reduce_batch for the batch starting at bin_start
+    for level, level_values in enumerate(reduced):
+        # bin_start is a multiple of every factor computed in the batch
+        i1 = bin_start // downsample_factor ** level
+        for stat, values in level_values.items():
+            p_levels[level][stat][i1:i1 + values.shape[0], :] = values
+    for p, decimation_factor, traces in zip(p_decimated, decimation_factors, decimated):
+        # sample k of a decimated copy is centered on frame k * decimation_factor
+        k1 = -(-bin_start * bin_size_frames // decimation_factor)
+        p[k1:k1 + traces.shape[0], :] = traces
+
+
+def _reduce_remaining_levels(
+    p_levels: list,
+    stats: list,
+    num_frames: int,
+    bin_size_frames: int,
+    num_batch_levels: int,
+    downsample_factor: int,
+    quantization: Optional[dict]
+):
+    """
+    Fill the levels of p_levels from num_batch_levels on, each from the
+    level below, once the first num_batch_levels levels have been written.
+    The level below is small enough to be reduced in one go.
+    """
+    for level in range(num_batch_levels, len(p_levels)):
+        print(f'Computing level {level} of the pyramid')
+        accumulators = _binned_values_to_accumulators(
+            {stat: p_levels[level - 1][stat][()] for stat in stats},
+            _get_bin_counts(num_frames, bin_size_frames * downsample_factor ** (level - 1)),
+            quantization
+        )
+        level_values = _accumulators_to_binned_values(
+            _coarsen_accumulators(accumulators, downsample_factor),
+            stats,
+            quantization
+        )
+        for stat in stats:
+            p_levels[level][stat][:, :] = level_values[stat]
+
+
+def _iterate_reduced_batches(
+    recording,
+    batches: list,
+    bin_size_frames: int,
+    stats: list,
+    num_levels: int,
+    downsample_factor: int,
+    quantization: Optional[dict],
+    decimation_factors: list,
+    n_jobs: int
+):
+    """
+    Yield (batch, reduced) for each batch, in the order of batches. With
+    n_jobs > 1 the batches are reduced in a pool of worker processes, each
+    of which loads its own copy of the recording and reads its own frame
+    ranges. At most 2 * n_jobs batches are in flight at a time so that the
+    memory used by results waiting to be written stays bounded.
+    """
+    if n_jobs <= 1 or len(batches) <= 1:
+        for batch in batches:
+            yield batch, _reduce_batch(recording, batch['bin_start'], batch['bin_end'], bin_size_frames, stats, num_levels, downsample_factor, quantization, decimation_factors)
+        return
+
+    from collections import deque
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+
+    max_in_flight = 2 * n_jobs
+    with ProcessPoolExecutor(
+        max_workers=n_jobs,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_reduce_batch_worker,
+        initargs=(recording.to_dict(),)
+    ) as executor:
+        pending: deque = deque()
+        next_batch_index = 0
+        while next_batch_index < len(batches) or len(pending) > 0:
+            while next_batch_index < len(batches) and len(pending) < max_in_flight:
+                batch = batches[next_batch_index]
+                future = executor.submit(
+                    _reduce_batch_worker,
+                    batch['bin_start'],
+                    batch['bin_end'],
+                    bin_size_frames,
+                    stats,
+                    num_levels,
+                    downsample_factor,
+                    quantization,
+                    decimation_factors
+                )
+                pending.append((batch, future))
+                next_batch_index += 1
+            # results are yielded in batch order, independent of completion order
+            batch, future = pending.popleft()
+            yield batch, future.result()
+
+
+_worker_recording = None
+
+
+def _init_reduce_batch_worker(recording_dict: dict):
+    global _worker_recording
+    import spikeinterface as si
+    _worker_recording = si.load_extractor(recording_dict)
+
+
+def _reduce_batch_worker(
+    bin_start: int,
+    bin_end: int,
+    bin_size_frames: int,
+    stats: list,
+    num_levels: int,
+    downsample_factor: int,
+    quantization: Optional[dict],
+    decimation_factors: list
+):
+    assert _worker_recording is not None, "Worker recording was not initialized"
+    return _reduce_batch(
+        _worker_recording,
+        bin_start,
+        bin_end,
+        bin_size_frames,
+        stats,
+        num_levels,
+        downsample_factor,
+        quantization,
+        decimation_factors
+    )
+
+
 def _format_ids(ids: list):
     # hdf5 attributes need to be homogeneous types
     all_are_ints = True
@@ -0,0 +1,338 @@
+import h5py
+import numpy as np
+import pytest
+
+from .ecephys_summary import (
+    _binned_array_name,
+    _create_binned_arrays,
+    _create_decimated_traces,
+    _decimate,
+    _dequantize,
+    _get_decimation_filter,
+    _get_max_bins_per_batch,
+    _iterate_reduced_batches,
+    _parse_memory_size,
+    _quantize,
+    _reduce_batch,
+    _reduce_remaining_levels,
+    _write_reduced_batch,
+)
+
+
+@pytest.mark.parametrize("memory,expected", [
+    ("2G", 2e9),
+    ("2GB", 2e9),
+    ("2g", 2e9),
+    ("2gb", 2e9),
+    ("500M", 500e6),
+    ("1.5 T", 1.5e12),
+    ("64k", 64e3),
+    ("2GiB", 2 * 1024**3),
+    ("2Gi", 2 * 1024**3),
+    ("512MiB", 512 * 1024**2),
+    ("1000", 1000),
+    ("1000B", 1000),
+])
+def test_parse_memory_size(memory, expected):
+    assert _parse_memory_size(memory) == expected
+
+
+@pytest.mark.parametrize("memory", ["", "G", "2X", "2 GB extra", "-1G", "2iB"])
+def test_parse_memory_size_invalid(memory):
+    with pytest.raises(ValueError, match="Invalid memory size"):
+        _parse_memory_size(memory)
+
+
+def test_max_bins_per_batch(synthetic_nwb):
+    import spikeinterface as si
+    from spike_sorting_summary.NwbExtractors import NwbRecordingExtractor
+
+    recording = si.NumpyRecording([np.zeros((100, 4), dtype=np.int16)], sampling_frequency=30000)
+    # the traces and a copy of them
+    bytes_per_bin = 2 * 6000 * 4 * 2
+    kwargs = dict(bin_size_frames=6000, stats=['min', 'max'], decimation_factors=[])
+    assert _get_max_bins_per_batch(recording, max_memory=10 * bytes_per_bin, n_jobs=1, **kwargs) == 10
+    assert _get_max_bins_per_batch(recording, max_memory=10 * bytes_per_bin, n_jobs=2, **kwargs) < 5
+
+    # the chunk cache of the recording a channel slice is derived from, in
+    # each of 2 workers and in the main process
+    path = synthetic_nwb(spike_times=[], traces=np.zeros((100, 4), dtype=np.int16))
+    recording = NwbRecordingExtractor(path, chunk_cache_size=10**6).channel_slice(channel_ids=[0, 1, 2, 3])
+    # the results of 4 batches in flight: min and max for the first level
+    # and at most as many again for the coarser levels
+    result_bytes_per_bin = 2 * 4 * 2 * 2
+    max_memory = 3 * 10**6 + 2 * 10 * bytes_per_bin + 4 * 10 * result_bytes_per_bin
+    assert _get_max_bins_per_batch(recording, max_memory=max_memory, n_jobs=2, **kwargs) == 10
+    assert _get_max_bins_per_batch(recording, max_memory=max_memory - 1, n_jobs=2, **kwargs) == 9
+    # at least one bin, even if the budget is too small
+    assert _get_max_bins_per_batch(recording, max_memory=10**6, n_jobs=2, **kwargs) == 1
+
+
+def test_quantize_rounds_and_clips():
+    quantization = {'scale': np.array([0.5, 2.0]), 'offset': np.array([0.0, 100.0])}
+    value = np.array([[1.2, 101.1], [1e9, -1e9]])
+    q = _quantize(value, quantization)
+    assert q.dtype == np.int16
+    assert q.tolist() == [[2, 1], [32767, -32768]]
+    # without quantization the values are clipped rather than wrapped, and
+    # rounded rather than truncated
+    assert _quantize(np.array([40000, -40000, 7]), None).tolist() == [32767, -32768, 7]
+    assert _quantize(np.array([4.9999, -4.9999, 1.4, -1.6]), None).tolist() == [5, -5, 1, -2]
+
+
+def test_decimated_int16_traces_are_rounded():
+    import spikeinterface as si
+
+    # the filter output for constant traces is within rounding error of the
+    # constant, on either side of it
+    X = np.full((3000, 2), [5, -7], dtype=np.int16)
+    recording = si.NumpyRecording([X], sampling_frequency=30000)
+    _, decimated = _reduce_batch(
+        recording, 0, 3, bin_size_frames=1000, stats=['min'], num_levels=1, downsample_factor=5,
+        quantization=None, decimation_factors=[3, 30]
+    )
+    for traces in decimated:
+        assert traces.dtype == np.int16
+        assert np.all(traces == [5, -7])
+
+
+def test_dequantize_with_attrs_read_back_from_file(h5_file):
+    # a large offset relative to the scale, as for float traces with a DC
+    # offset, needs more precision than float32 attributes have
+    quantization = {'scale': np.array([1e-3, 0.37]), 'offset': np.array([1e6 + 0.1234, -52.7])}
+    rng = np.random.default_rng(0)
+    values = quantization['offset'] + rng.uniform(-30000, 30000, size=(25, 2)) * quantization['scale']
+    p_levels = _create_binned_arrays(
+        h5_file, num_bins=25, num_channels=2, bin_size_sec=0.2, bin_size_frames=6000,
+        stats=['min', 'max'], num_levels=2, downsample_factor=5, quantization=quantization
+    )
+    p_decimated = _create_decimated_traces(
+        h5_file, num_frames=25 * 6000, num_channels=2, sampling_frequency=30000,
+        decimation_factors=[6000], quantization=quantization
+    )
+    for p in [p_levels[0]['min'], p_decimated[0]]:
+        p[:, :] = _quantize(values, quantization)
+    for p in [h5_file['binned_arrays/min'], h5_file['decimated_traces/traces_ds6000']]:
+        assert p.attrs['scale'].dtype == np.float64
+        assert p.attrs['offset'].dtype == np.float64
+        file_quantization = {'scale': p.attrs['scale'], 'offset': p.attrs['offset']}
+        error = np.abs(_dequantize(p[()], file_quantization) - values)
+        assert np.all(error <= quantization['scale'] / 2 * (1 + 1e-6))
+
+
+def _decimate_reference(X, decimation_factor):
+    # filter the whole recording (edge-padded) and keep every
+    # decimation_factor-th sample
+    h = _get_decimation_filter(decimation_factor)
+    half = len(h) // 2
+    X_padded = np.pad(X.astype(np.float64), ((half, half), (0, 0)), mode='edge')
+    filtered = np.stack([np.convolve(X_padded[:, m], h[::-1], mode='valid') for m in range(X.shape[1])], axis=1)
+    return filtered[::decimation_factor]
+
+
+@pytest.mark.parametrize("decimation_factor", [3, 30])
+def test_decimate_in_batches_matches_filtering_the_whole_recording(decimation_factor):
+    X = np.random.default_rng(1).integers(-1000, 1000, size=(5000, 3)).astype(np.int16)
+    num_frames = X.shape[0]
+    half = len(_get_decimation_filter(decimation_factor)) // 2
+    expected = _decimate_reference(X, decimation_factor)
+    # batch boundaries that are not multiples of the decimation factor
+    boundaries = [0, 7, 1000, 1001, 2999, 5000]
+    parts = []
+    for frame_start, frame_end in zip(boundaries[:-1], boundaries[1:]):
+        read_start = max(0, frame_start - half)
+        read_end = min(num_frames, frame_end + half)
+        parts.append(_decimate(X[read_start:read_end], read_start, frame_start, frame_end, num_frames, decimation_factor))
+    decimated = np.concatenate(parts)
+    assert decimated.shape == (int(np.ceil(num_frames / decimation_factor)), 3)
+    np.testing.assert_allclose(decimated, expected, atol=1e-6)
+
+
+def test_decimate_attenuates_aliasing():
+    fs = 30000
+    decimation_factor = 30
+    t = np.arange(3 * fs) / fs
+    # 50 Hz is in the passband; 2300 Hz would alias to 300 Hz at 1 kHz
+    X = np.stack([np.sin(2 * np.pi * 50 * t) + np.sin(2 * np.pi * 2300 * t)], axis=1)
+    decimated = _decimate(X, 0, 0, len(t), len(t), decimation_factor)
+    ideal = np.sin(2 * np.pi * 50 * t[::decimation_factor])
+    inner = slice(20, -20)
+    assert np.max(np.abs(decimated[inner, 0] - ideal[inner])) < 0.01
+
+
+def _brute_force_level(X, bin_size_frames, stats):
+    # each stat computed directly from the traces of each bin
+    ret = {stat: [] for stat in stats}
+    for i1 in range(0, X.shape[0], bin_size_frames):
+        x = X[i1:i1 + bin_size_frames].astype(np.float64)
+        values = {
+            'min': np.min(x, axis=0),
+            'max': np.max(x, axis=0),
+            'rms': np.sqrt(np.mean(x ** 2, axis=0)),
+            'mean_abs': np.mean(np.abs(x), axis=0)
+        }
+        for stat in stats:
+            ret[stat].append(values[stat])
+    return {stat: np.array(v) for stat, v in ret.items()}
+
+
+@pytest.mark.parametrize("n_jobs", [1, 2])
+def test_pyramid_matches_brute_force(h5_file, n_jobs):
+    import spikeinterface as si
+
+    stats = ['min', 'max', 'rms', 'mean_abs']
+    bin_size_frames = 10
+    num_levels = 4
+    downsample_factor = 3
+    # 48 bins, the last of them partial; batches of 9 bins (the first 2
+    # levels are reduced in the batches) do not divide the number of bins
+    # or the bin sizes of levels 2 and 3, which are reduced afterwards
+    num_batch_levels = 2
+    num_bins_per_batch = 9
+    num_frames = 47 * bin_size_frames + 3
+    X = np.random.default_rng(2).integers(-3000, 3000, size=(num_frames, 3)).astype(np.int16)
+    recording = si.NumpyRecording([X], sampling_frequency=1000)
+    num_bins = int(np.ceil(num_frames / bin_size_frames))
+    batches = [
+        {'bin_start': i, 'bin_end': min(i + num_bins_per_batch, num_bins)}
+        for i in range(0, num_bins, num_bins_per_batch)
+    ]
+
+    p_levels = _create_binned_arrays(
+        h5_file, num_bins=num_bins, num_channels=3, bin_size_sec=0.01, bin_size_frames=bin_size_frames,
+        stats=stats, num_levels=num_levels, downsample_factor=downsample_factor, quantization=None
+    )
+    reduced_batches = _iterate_reduced_batches(
+        recording=recording, batches=batches, bin_size_frames=bin_size_frames, stats=stats,
+        num_levels=num_batch_levels, downsample_factor=downsample_factor, quantization=None,
+        decimation_factors=[], n_jobs=n_jobs
+    )
+    for batch, (reduced, decimated) in reduced_batches:
+        _write_reduced_batch(
+            p_levels=p_levels, p_decimated=[], bin_start=batch['bin_start'], reduced=reduced, decimated=decimated,
+            bin_size_frames=bin_size_frames, downsample_factor=downsample_factor, decimation_factors=[]
+        )
+    _reduce_remaining_levels(
+        p_levels=p_levels, stats=stats, num_frames=num_frames, bin_size_frames=bin_size_frames,
+        num_batch_levels=num_batch_levels, downsample_factor=downsample_factor, quantization=None
+    )
+
+    for level in range(num_levels):
+        level_bin_size_frames = bin_size_frames * downsample_factor ** level
+        expected = _brute_force_level(X, level_bin_size_frames, stats)
+        for stat in stats:
+            actual = h5_file['binned_arrays'][_binned_array_name(stat, level, downsample_factor)][()]
+            assert actual.shape == (int(np.ceil(num_frames / level_bin_size_frames)), 3)
+            if stat in ['min', 'max']:
+                np.testing.assert_array_equal(actual, expected[stat], err_msg=f'{stat} level {level}')
+            else:
+                # the levels reduced afterwards start from the float32 values
+                # of the level below
+                np.testing.assert_allclose(actual, expected[stat], rtol=1e-5, err_msg=f'{stat} level {level}')
+
+
+class _FakeInputFile:
+    def __init__(self, path):
+        self.path = path
+
+    def download(self, dest_file_path):
+        import shutil
+        shutil.copy(self.path, dest_file_path)
+
+
+class _FakeOutputFile:
+    def upload(self, local_file_path):
+        pass
+
+
+@pytest.fixture
+def run_summary(tmp_path, monkeypatch):
+    """
+    Run the processor on a small int16 binary recording, in a working
+    directory under tmp_path, and return the path of output.h5.
+    reduced_batches lists the batches reduced by each call.
+    """
+    import spikeinterface as si
+    from . import ecephys_summary
+
+    X = np.random.default_rng(3).integers(-3000, 3000, size=(30000 * 4 + 123, 4)).astype(np.int16)
+    input_dir = tmp_path / "input"
+    input_dir.mkdir()
+    X.tofile(input_dir / "traces.dat")
+    recording = si.BinaryRecordingExtractor(
+        file_paths=[str(input_dir / "traces.dat")], sampling_frequency=30000, num_channels=4, dtype="int16"
+    )
+    recording.set_channel_locations(np.arange(8).reshape(4, 2).astype(float))
+    recording.dump_to_json(input_dir / "recording.json")
+    monkeypatch.chdir(tmp_path)
+
+    reduced_batches = []
+    iterate_reduced_batches = ecephys_summary._iterate_reduced_batches
+
+    def run(checkpoint_dir, interrupt_after=None, **kwargs):
+        calls = []
+        reduced_batches.append(calls)
+
+        def iterate(**iterate_kwargs):
+            for batch, reduced in iterate_reduced_batches(**iterate_kwargs):
+                if len(calls) == interrupt_after:
+                    raise KeyboardInterrupt("interrupted")
+                calls.append((batch['bin_start'], batch['bin_end']))
+                yield batch, reduced
+
+        monkeypatch.setattr(ecephys_summary, "_iterate_reduced_batches", iterate)
+        # 21 bins of 6000 frames; the memory budget makes batches of 5 bins
+        params = dict(
+            n_jobs=1, max_memory="560k", stats=["min", "max", "rms"], quantize=True,
+            decimated_sampling_frequencies=[1000]
+        )
+        params.update(kwargs)
+        context = ecephys_summary.EcephysSummaryContext.model_construct(
+            input=_FakeInputFile(input_dir / "recording.json"),
+            output=_FakeOutputFile(),
+            checkpoint_dir=str(tmp_path / checkpoint_dir),
+            **params
+        )
+        ecephys_summary.EcephysSummaryProcessor.run(context)
+        return tmp_path / checkpoint_dir / "output.h5"
+
+    run.reduced_batches = reduced_batches
+    return run
+
+
+def _assert_same_h5(path1, path2):
+    with h5py.File(path1, "r") as f1, h5py.File(path2, "r") as f2:
+        names1 = []
+        f1.visit(names1.append)
+        names2 = []
+        f2.visit(names2.append)
+        assert names1 == names2
+        for name in [None] + names1:
+            obj1 = f1 if name is None else f1[name]
+            obj2 = f2 if name is None else f2[name]
+            assert sorted(obj1.attrs.keys()) == sorted(obj2.attrs.keys())
+            for key in obj1.attrs.keys():
+                np.testing.assert_array_equal(obj1.attrs[key], obj2.attrs[key], err_msg=f'{name} {key}')
+            if isinstance(obj1, h5py.Dataset):
+                np.testing.assert_array_equal(obj1[()], obj2[()], err_msg=name)
+
+
+def test_resume_after_interruption(run_summary):
+    expected = run_summary("uninterrupted")
+    assert run_summary.reduced_batches[0] == [(0, 5), (5, 10), (10, 15), (15, 20), (20, 21)]
+    with pytest.raises(KeyboardInterrupt):
+        run_summary("checkpoint", interrupt_after=2)
+    actual = run_summary("checkpoint")
+    # only the batches that were not completed are reduced again
+    assert run_summary.reduced_batches[2] == [(10, 15), (15, 20), (20, 21)]
+    _assert_same_h5(actual, expected)
+
+
+def test_restart_when_summary_params_change(run_summary):
+    expected = run_summary("uninterrupted", stats=["min", "max"])
+    with pytest.raises(KeyboardInterrupt):
+        run_summary("checkpoint", interrupt_after=2)
+    actual = run_summary("checkpoint", stats=["min", "max"])
+    # the completed batches were computed with other stats and are not reused
+    assert run_summary.reduced_batches[2] == run_summary.reduced_batches[0]
+    _assert_same_h5(actual, expected)
@@ -0,0 +1,361 @@
+import os
+import hashlib
+import tempfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, Union
+
+
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_CACHE_DIR = os.environ.get(
+    "DANDI_VIS_BLOCK_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "dandi-vis", "blocks")
+)
+DEFAULT_MAX_CACHE_SIZE = int(float(os.environ.get("DANDI_VIS_BLOCK_CACHE_MAX_SIZE_GB", "20")) * 1e9)
+
+
+class BlockCache:
+    """
+    A persistent, content-addressed cache of file blocks on local disk.
+
+    Blocks are stored as individual files named by the hash of their key, so
+    the cache can be shared by several processes (and several processor runs)
+    on the same machine. Writes are atomic (write to a temporary file, then
+    rename). The modification time of a block file is refreshed on every hit
+    and the least recently used blocks are evicted once the total size
+    exceeds max_size.
+
+    Parameters
+    ----------
+    cache_dir : str or None
+        Directory of the cache, default: $DANDI_VIS_BLOCK_CACHE_DIR or ~/.cache/dandi-vis/blocks
+    max_size : int or None
+        Maximum total size in bytes, default: $DANDI_VIS_BLOCK_CACHE_MAX_SIZE_GB (20 GB)
+    """
+    def __init__(self, cache_dir: Optional[str] = None, max_size: Optional[int] = None):
+        self.cache_dir = cache_dir if cache_dir is not None else DEFAULT_CACHE_DIR
+        self.max_size = max_size if max_size is not None else DEFAULT_MAX_CACHE_SIZE
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._total_size = self._compute_total_size()
+
+    def get(self, key: str) -> Union[bytes, None]:
+        path = self._path_for_key(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            # evicted by another process in the meantime
+            pass
+        return data
+
+    def contains(self, key: str) -> bool:
+        return os.path.exists(self._path_for_key(key))
+
+    def put(self, key: str, data: bytes):
+        path = self._path_for_key(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        self._total_size += len(data)
+        if self._total_size > self.max_size:
+            self._evict()
+
+    def _path_for_key(self, key: str):
+        h = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, h[:2], h)
+
+    def _list_blocks(self):
+        ret = []
+        for d in os.scandir(self.cache_dir):
+            if not d.is_dir():
+                continue
+            for e in os.scandir(d.path):
+                if e.name.endswith(".tmp"):
+                    continue
+                try:
+                    st = e.stat()
+                except FileNotFoundError:
+                    continue
+                ret.append((st.st_mtime, st.st_size, e.path))
+        return ret
+
+    def _compute_total_size(self):
+        return sum(size for _, size, _ in self._list_blocks())
+
+    def _evict(self):
+        # other processes may share the directory, so rescan rather than
+        # trusting our own running total
+        blocks = sorted(self._list_blocks())
+        total_size = sum(size for _, size, _ in blocks)
+        target_size = int(self.max_size * 0.9)
+        for _, size, path in blocks:
+            if total_size <= target_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total_size -= size
+        self._total_size = total_size
+
+
+class CachedRemoteFile:
+    """
+    A read-only, seekable file-like object for a remote file served over HTTP
+    with support for range requests, backed by a BlockCache. It can be passed
+    to h5py.File in place of remfile.File.
+
+    Blocks are keyed by the ETag and size reported by the server, the block
+    size and the byte range, so a cached block is never served for changed
+    content, and neither presigned URLs (which change on every request or
+    job) nor redirects invalidate the cache. If the server does not report
+    an ETag, the URL is used in its place.
+
+    Parameters
+    ----------
+    url : str or callable
+        URL of the remote file, or a function returning a URL for it (e.g.
+        InputFile.get_url). The function is called again for a new URL when
+        a request is denied (403), as happens once a presigned URL expires.
+    cache : BlockCache or None
+        The block cache to use, default: a BlockCache with default settings
+    block_size : int
+        Size of the cached blocks in bytes
+    memory_cache_num_blocks : int
+        Number of recently used blocks also kept in memory
+    num_concurrent_requests : int
+        If > 1, large reads (and prefetch calls) are split into range requests
+        of at most max_blocks_per_request blocks that are issued concurrently
+        over a pool of this many keep-alive connections
+    max_blocks_per_request : int
+        Maximum number of blocks per range request when num_concurrent_requests > 1
+    """
+    def __init__(
+        self,
+        url: Union[str, Callable[[], str]],
+        cache: Optional[BlockCache] = None,
+        block_size: int = DEFAULT_BLOCK_SIZE,
+        memory_cache_num_blocks: int = 64,
+        num_concurrent_requests: int = 1,
+        max_blocks_per_request: int = 4,
+    ):
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self._get_url = url if callable(url) else None
+        self.url = url() if callable(url) else url
+        self.cache = cache if cache is not None else BlockCache()
+        self.block_size = block_size
+        self._memory_cache_num_blocks = memory_cache_num_blocks
+        self._memory_cache: "OrderedDict[int, bytes]" = OrderedDict()
+        self._num_concurrent_requests = max(num_concurrent_requests, 1)
+        self._max_blocks_per_request = max_blocks_per_request
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self._num_concurrent_requests)
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._position = 0
+        self._closed = False
+        self._resolved_url, self.size, self.etag = self._resolve()
+        if self.etag is not None:
+            self._key_prefix = f"etag:{self.etag}|{self.size}|{self.block_size}"
+        else:
+            self._key_prefix = f"{self.url}|{self.size}|{self.block_size}"
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            size = self.size - self._position
+        start = self._position
+        end = min(start + size, self.size)
+        if end <= start:
+            return b""
+        data = self._read_range(start, end)
+        self._position = end
+        return data
+
+    def readinto(self, b) -> int:
+        data = self.read(len(b))
+        n = len(data)
+        memoryview(b)[:n] = data
+        return n
+
+    def seek(self, offset: int, whence: int = 0) -> int:
+        if whence == 0:
+            self._position = offset
+        elif whence == 1:
+            self._position += offset
+        elif whence == 2:
+            self._position = self.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        return self._position
+
+    def tell(self) -> int:
+        return self._position
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def writable(self):
+        return False
+
+    def prefetch(self, byte_ranges: list):
+        """
+        Make sure that the given (offset, size) byte ranges are in the cache,
+        fetching the missing blocks concurrently. Readers that know which
+        ranges they are about to read (e.g. the HDF5 chunks of a trace
+        window) can call this so that the subsequent sequential reads by
+        h5py are served from the cache.
+        """
+        block_indices = set()
+        for offset, size in byte_ranges:
+            if size <= 0:
+                continue
+            block_indices.update(range(offset // self.block_size, (offset + size - 1) // self.block_size + 1))
+        missing = [
+            i for i in sorted(block_indices)
+            if i not in self._memory_cache and not self.cache.contains(self._block_key(i))
+        ]
+        self._fetch_blocks(missing)
+
+    def close(self):
+        self._closed = True
+        self._memory_cache.clear()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+        self._session.close()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def _read_range(self, start: int, end: int) -> bytes:
+        i1 = start // self.block_size
+        i2 = (end - 1) // self.block_size + 1
+        blocks = self._get_blocks(list(range(i1, i2)))
+        data = b"".join(blocks[i] for i in range(i1, i2))
+        offset = i1 * self.block_size
+        return data[start - offset:end - offset]
+
+    def _get_blocks(self, block_indices: list) -> dict:
+        ret = {}
+        missing = []
+        for i in block_indices:
+            data = self._memory_cache.get(i)
+            if data is not None:
+                self._memory_cache.move_to_end(i)
+            else:
+                data = self.cache.get(self._block_key(i))
+                if data is not None:
+                    self._remember(i, data)
+            if data is not None:
+                ret[i] = data
+            else:
+                missing.append(i)
+        ret.update(self._fetch_blocks(missing))
+        return ret
+
+    def _fetch_blocks(self, block_indices: list) -> dict:
+        # fetch runs of consecutive blocks with one request each (split into
+        # smaller requests when they can be issued concurrently)
+        max_run_length = self._max_blocks_per_request if self._num_concurrent_requests > 1 else None
+        runs: list = []
+        for i in block_indices:
+            if runs and runs[-1][1] == i and (max_run_length is None or runs[-1][1] - runs[-1][0] < max_run_length):
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+
+        def fetch_run(run):
+            j1, j2 = run
+            return self._fetch(j1 * self.block_size, min(j2 * self.block_size, self.size))
+        if len(runs) > 1 and self._num_concurrent_requests > 1:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self._num_concurrent_requests)
+            datas = list(self._executor.map(fetch_run, runs))
+        else:
+            datas = [fetch_run(run) for run in runs]
+        ret = {}
+        for (j1, j2), data in zip(runs, datas):
+            for i in range(j1, j2):
+                block = data[(i - j1) * self.block_size:(i - j1 + 1) * self.block_size]
+                self.cache.put(self._block_key(i), block)
+                self._remember(i, block)
+                ret[i] = block
+        return ret
+
+    def _remember(self, i: int, data: bytes):
+        self._memory_cache[i] = data
+        self._memory_cache.move_to_end(i)
+        while len(self._memory_cache) > self._memory_cache_num_blocks:
+            self._memory_cache.popitem(last=False)
+
+    def _block_key(self, i: int):
+        return f"{self._key_prefix}|{i * self.block_size}-{min((i + 1) * self.block_size, self.size)}"
+
+    def _fetch(self, start: int, end: int) -> bytes:
+        headers = {"Range": f"bytes={start}-{end - 1}"}
+        r = self._session.get(self._resolved_url, headers=headers, timeout=60)
+        if r.status_code == 403 and (self._get_url is not None or self._resolved_url != self.url):
+            # the presigned (redirect) URL has probably expired
+            self._renew_url()
+            r = self._session.get(self._resolved_url, headers=headers, timeout=60)
+        if r.status_code != 206:
+            raise Exception(f"Failed to fetch bytes {start}-{end - 1} of {self.url}: {r.status_code} {r.reason}")
+        data = r.content
+        if len(data) != end - start:
+            raise Exception(f"Unexpected number of bytes for range {start}-{end - 1} of {self.url}: {len(data)}")
+        return data
+
+    def _renew_url(self):
+        if self._get_url is not None:
+            self.url = self._get_url()
+        resolved_url, size, etag = self._resolve()
+        if size != self.size or etag != self.etag:
+            raise Exception(f"Remote file changed while reading {self.url}: size {size}, ETag {etag}")
+        self._resolved_url = resolved_url
+
+    def _resolve(self):
+        # follow redirects once (e.g. DANDI asset -> presigned S3 URL) and get size and ETag
+        r = self._session.get(self.url, headers={"Range": "bytes=0-0"}, allow_redirects=True, timeout=60)
+        if r.status_code != 206:
+            raise Exception(f"Server does not support range requests for {self.url}: {r.status_code} {r.reason}")
+        content_range = r.headers.get("Content-Range", "")
+        if "/" not in content_range or content_range.endswith("/*"):
+            raise Exception(f"Unable to determine size of {self.url}")
+        size = int(content_range.split("/")[-1])
+        etag = r.headers.get("ETag", None)
+        return r.url, size, etag
+
+
+_default_block_cache: Optional[BlockCache] = None
+
+
+def get_default_block_cache() -> BlockCache:
+    """
+    The BlockCache shared by all extractors and processors in this process
+    """
+    global _default_block_cache
+    if _default_block_cache is None:
+        _default_block_cache = BlockCache()
+    return _default_block_cache
+
+
+def open_cached_remote_file(url: Union[str, Callable[[], str]], block_size: int = DEFAULT_BLOCK_SIZE, num_concurrent_requests: int = 1) -> CachedRemoteFile:
+    return CachedRemoteFile(
+        url, cache=get_default_block_cache(), block_size=block_size, num_concurrent_requests=num_concurrent_requests
+    )
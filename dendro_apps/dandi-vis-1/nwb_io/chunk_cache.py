@@ -0,0 +1,123 @@
+from collections import OrderedDict
+from typing import Callable, Optional, Union
+import numpy as np
+
+
+class ChunkCachedDatasetReader:
+    """
+    Reads (time x channel) windows from a chunked 2D HDF5 dataset.
+
+    Requests are expanded to chunk boundaries so that every compressed chunk
+    is fetched and decoded at most once, and the decoded chunks are kept in a
+    bounded LRU cache. Requests that straddle a chunk boundary, or overlap a
+    previous request (e.g. the margins used by filtering), are then served
+    from memory for the part that was already decoded.
+
+    Parameters
+    ----------
+    dataset : h5py.Dataset
+        The chunked 2D dataset
+    max_cache_size : int
+        Maximum total size in bytes of the decoded chunks kept in memory
+    prefetch : callable or None
+        prefetch(byte_ranges) of the underlying remote file (see
+        CachedRemoteFile.prefetch). If given, the (offset, size) file ranges
+        of all chunks missing for a request are passed to it before h5py
+        reads them one by one, so that they can be downloaded concurrently.
+    """
+    def __init__(self, dataset, max_cache_size: int, prefetch: Optional[Callable] = None):
+        assert dataset.chunks is not None, "Dataset is not chunked"
+        assert len(dataset.shape) == 2, "Dataset must be 2D"
+        self._dataset = dataset
+        self._num_frames, self._num_channels = dataset.shape
+        self._chunk_num_frames, self._chunk_num_channels = dataset.chunks
+        self._dtype = dataset.dtype
+        self._max_cache_size = max_cache_size
+        self._cache: "OrderedDict[tuple, np.ndarray]" = OrderedDict()
+        self._cache_size = 0
+        self._prefetch = prefetch
+
+    def read(self, start_frame: int, end_frame: int, channel_indices: Union[slice, np.ndarray, list]) -> np.ndarray:
+        if isinstance(channel_indices, slice):
+            channels = np.arange(self._num_channels)[channel_indices]
+        else:
+            channels = np.asarray(channel_indices, dtype=np.int64)
+        # like h5py slicing, a request past the end of the dataset is truncated
+        end_frame = min(end_frame, self._num_frames)
+        traces = np.empty((max(end_frame - start_frame, 0), len(channels)), dtype=self._dtype)
+        if end_frame <= start_frame or len(channels) == 0:
+            return traces
+        ct = self._chunk_num_frames
+        cc = self._chunk_num_channels
+        r1 = start_frame // ct
+        r2 = (end_frame - 1) // ct
+        channel_chunks = channels // cc
+        if self._prefetch is not None:
+            self._prefetch_missing_chunks(r1, r2, np.unique(channel_chunks))
+        for c in np.unique(channel_chunks):
+            # output columns served by this channel chunk (channel order may be arbitrary)
+            out_cols = np.nonzero(channel_chunks == c)[0]
+            local_cols = channels[out_cols] - c * cc
+            r = r1
+            while r <= r2:
+                block = self._get_cached((r, c))
+                if block is not None:
+                    f1 = r * ct
+                    self._copy_overlap(traces, start_frame, end_frame, block, f1, out_cols, local_cols)
+                    r += 1
+                    continue
+                # read the run of consecutive missing chunks in one aligned request
+                rr = r
+                while rr + 1 <= r2 and (rr + 1, c) not in self._cache:
+                    rr += 1
+                f1 = r * ct
+                f2 = min((rr + 1) * ct, self._num_frames)
+                data = self._dataset[f1:f2, c * cc:min((c + 1) * cc, self._num_channels)]
+                self._copy_overlap(traces, start_frame, end_frame, data, f1, out_cols, local_cols)
+                for k in range(r, rr + 1):
+                    self._put_cached((k, c), data[(k - r) * ct:(k - r + 1) * ct])
+                r = rr + 1
+        return traces
+
+    def _prefetch_missing_chunks(self, r1: int, r2: int, channel_chunk_indices: np.ndarray):
+        byte_ranges = []
+        for c in channel_chunk_indices:
+            for r in range(r1, r2 + 1):
+                if r * self._chunk_num_frames >= self._num_frames:
+                    break
+                if (r, c) in self._cache:
+                    continue
+                info = self._dataset.id.get_chunk_info_by_coord(
+                    (r * self._chunk_num_frames, int(c) * self._chunk_num_channels)
+                )
+                # unallocated chunks (fill value) have no file offset
+                if info.byte_offset is not None:
+                    byte_ranges.append((info.byte_offset, info.size))
+        if len(byte_ranges) > 0:
+            self._prefetch(byte_ranges)
+
+    @staticmethod
+    def _copy_overlap(traces, start_frame, end_frame, block, block_start_frame, out_cols, local_cols):
+        o1 = max(start_frame, block_start_frame)
+        o2 = min(end_frame, block_start_frame + block.shape[0])
+        if o2 > o1:
+            traces[o1 - start_frame:o2 - start_frame, out_cols] = (
+                block[o1 - block_start_frame:o2 - block_start_frame][:, local_cols]
+            )
+
+    def _get_cached(self, key):
+        block = self._cache.get(key)
+        if block is not None:
+            self._cache.move_to_end(key)
+        return block
+
+    def _put_cached(self, key, block: np.ndarray):
+        if block.nbytes > self._max_cache_size:
+            return
+        # copy so that the cache does not keep the whole request alive
+        block = block.copy()
+        self._cache[key] = block
+        self._cache_size += block.nbytes
+        while self._cache_size > self._max_cache_size:
+            _, evicted = self._cache.popitem(last=False)
+            self._cache_size -= evicted.nbytes
@@ -0,0 +1,99 @@
+import hashlib
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+
+class _RangeRequestHandler(BaseHTTPRequestHandler):
+    """
+    A stand-in for DANDI/S3 range requests:
+
+    /files/<name>: serves server.files[name], honoring the Range header
+    /redirect/<name>: redirects to a presigned-like URL /signed/<generation>/<name>
+    /signed/<generation>/<name>: like /files/<name>, but 403 once the
+        generation is no longer server.generation (an expired URL)
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        server = self.server
+        if server.latency > 0:
+            time.sleep(server.latency)
+        path = self.path
+        m = re.fullmatch(r"/redirect/(.+)", path)
+        if m is not None:
+            self._respond(302, b"", {"Location": f"/signed/{server.generation}/{m.group(1)}"})
+            return
+        m = re.fullmatch(r"/signed/(\d+)/(.+)", path)
+        if m is not None:
+            if int(m.group(1)) != server.generation:
+                self._respond(403, b"expired")
+                return
+            name = m.group(2)
+        else:
+            m = re.fullmatch(r"/files/(.+)", path)
+            if m is None:
+                self._respond(404, b"not found")
+                return
+            name = m.group(1)
+        data = server.files.get(name)
+        if data is None:
+            self._respond(404, b"not found")
+            return
+        headers = {"ETag": '"' + hashlib.md5(data).hexdigest() + '"'}
+        range_header = self.headers.get("Range")
+        if range_header is None:
+            self._respond(200, data, headers)
+            return
+        m = re.fullmatch(r"bytes=(\d+)-(\d+)", range_header)
+        assert m is not None, range_header
+        start, end = int(m.group(1)), min(int(m.group(2)), len(data) - 1)
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+        with server.lock:
+            server.range_requests.append((path, start, end + 1))
+        self._respond(206, data[start:end + 1], headers)
+
+    def _respond(self, status: int, body: bytes, headers: dict = {}):
+        with self.server.lock:
+            self.server.statuses.append((self.path, status))
+        self.send_response(status)
+        for k, v in headers.items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def range_server():
+    """
+    A local HTTP server with range request support (see
+    _RangeRequestHandler). Add files with server.files[name] = data and use
+    server.url(name) or server.url(name, redirect=True), or
+    server.signed_url(name) for a presigned-like URL of the current
+    generation.
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _RangeRequestHandler)
+    server.daemon_threads = True
+    server.files = {}
+    server.generation = 0
+    server.latency = 0.0
+    server.lock = threading.Lock()
+    server.range_requests = []
+    server.statuses = []
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    server.url = lambda name, redirect=False: f"{base_url}/{'redirect' if redirect else 'files'}/{name}"
+    server.signed_url = lambda name: f"{base_url}/signed/{server.generation}/{name}"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,135 @@
+from typing import Callable, Union, Optional, List
+import numpy as np
+
+
+def open_nwb_h5(file_path: Union[str, Callable[[], str]], stream_mode: Optional[str] = None):
+    """
+    Open an NWB file with h5py, without building the pynwb object graph.
+
+    Parameters
+    ----------
+    file_path : str or callable
+        Local path or URL of the NWB file. For stream_mode="cached" it may
+        also be a function returning a URL (e.g. InputFile.get_url), which is
+        called again for a new URL once a presigned URL has expired.
+    stream_mode : "cached", "remfile", "ros3" or None
+        How to read a remote file. If None, the file is assumed to be local.
+
+    Returns
+    -------
+    h5py.File
+    """
+    import h5py
+
+    if stream_mode == "cached":
+        from .block_cache import open_cached_remote_file
+        return h5py.File(open_cached_remote_file(file_path if callable(file_path) else str(file_path)), "r")
+    elif stream_mode == "remfile":
+        import remfile
+        return h5py.File(remfile.File(str(file_path)), "r")
+    elif stream_mode == "ros3":
+        return h5py.File(str(file_path), "r", driver="ros3")
+    elif stream_mode is None:
+        return h5py.File(str(file_path), "r")
+    else:
+        raise ValueError(f"Unsupported stream mode for h5py-direct reading: {stream_mode}")
+
+
+def get_h5_object(h5file, path: str):
+    """
+    Resolve an NWB path such as '/units' or
+    '/processing/behavior/Position/SpatialSeriesLED1' to the corresponding
+    h5py group or dataset. The HDF5 layout of an NWB file mirrors these paths.
+    """
+    path_parts = [p for p in path.split("/") if p]
+    obj = h5file
+    for part in path_parts:
+        if part not in obj:
+            raise KeyError(f"{part} not found in {obj.name} when resolving {path}")
+        obj = obj[part]
+    return obj
+
+
+def get_table_colnames(table_group) -> List[str]:
+    """
+    The column names of a DynamicTable group (e.g. /units)
+    """
+    return [_decode(c) for c in table_group.attrs.get("colnames", [])]
+
+
+def get_table_ids(table_group) -> np.ndarray:
+    return table_group["id"][:]
+
+
+def read_table_column(table_group, column: str) -> Union[np.ndarray, list]:
+    """
+    Read a DynamicTable column. Ragged columns (those with a <column>_index
+    dataset) are returned as a list of arrays, one per row; other columns are
+    returned as an array. Byte strings are decoded.
+    """
+    data = table_group[column]
+    values = data[:]
+    if values.dtype.kind in ("S", "O"):
+        values = np.array([_decode(v) for v in values], dtype=object)
+    index_name = f"{column}_index"
+    if index_name not in table_group:
+        return values
+    index = table_group[index_name][:]
+    starts = np.concatenate([[0], index[:-1]])
+    return [values[i1:i2] for i1, i2 in zip(starts, index)]
+
+
+def read_timeseries_timestamps(timeseries_group, num_samples: Optional[int] = None) -> np.ndarray:
+    """
+    Timestamps of a TimeSeries group, either stored explicitly or derived
+    from starting_time and its rate attribute.
+    """
+    if "timestamps" in timeseries_group:
+        return timeseries_group["timestamps"][:]
+    starting_time = timeseries_group["starting_time"]
+    rate = float(starting_time.attrs["rate"])
+    if num_samples is None:
+        num_samples = timeseries_group["data"].shape[0]
+    return float(starting_time[()]) + np.arange(num_samples) / rate
+
+
+def find_electrical_series(h5file, electrical_series_name: Optional[str] = None):
+    """
+    h5py counterpart of retrieve_electrical_series: find an ElectricalSeries
+    group by name anywhere in the file, or the only one in /acquisition.
+    """
+    if electrical_series_name is not None:
+        found = []
+
+        def visitor(name, obj):
+            if _is_neurodata_type(obj, "ElectricalSeries") and name.split("/")[-1] == electrical_series_name:
+                found.append(obj)
+        h5file.visititems(visitor)
+        if len(found) == 0:
+            raise ValueError(f"{electrical_series_name} not found in the NWBFile. ")
+        return found[0]
+    acquisition = h5file["acquisition"] if "acquisition" in h5file else {}
+    electrical_series_list = [
+        acquisition[k] for k in acquisition.keys() if _is_neurodata_type(acquisition[k], "ElectricalSeries")
+    ]
+    if len(electrical_series_list) > 1:
+        raise ValueError(
+            f"More than one acquisition found! You must specify 'electrical_series_name'. \n"
+            f"Options in current file are: {[e.name.split('/')[-1] for e in electrical_series_list]}"
+        )
+    if len(electrical_series_list) == 0:
+        raise ValueError("No acquisitions found in the .nwb file.")
+    return electrical_series_list[0]
+
+
+def _is_neurodata_type(obj, neurodata_type: str):
+    import h5py
+
+    # subtypes of ElectricalSeries (e.g. from extensions) are not detected
+    return isinstance(obj, h5py.Group) and _decode(obj.attrs.get("neurodata_type", "")) == neurodata_type
+
+
+def _decode(v):
+    if isinstance(v, bytes):
+        return v.decode("utf-8")
+    return v
@@ -0,0 +1,96 @@
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Union
+import numpy as np
+
+
+class ReadAheadTraceReader:
+    """
+    Prefetches trace windows in a background thread for consumers that read
+    a recording front to back in equally sized windows (e.g. a .dat writer
+    or a summary processor with n_jobs=1).
+
+    After serving the window [start, end), the next num_chunks_ahead windows
+    of the same size and channels are scheduled for reading, so that network
+    latency overlaps with the consumer's processing of the current window.
+    A request that matches a prefetched window is a hit; any other request
+    is a miss, is read synchronously, and drops the stale prefetches.
+
+    Parameters
+    ----------
+    read_traces : callable
+        read_traces(start_frame, end_frame, channel_indices) -> np.ndarray
+    num_frames : int
+        Total number of frames
+    num_chunks_ahead : int
+        Number of windows to keep prefetched (bounds the memory used)
+    """
+    def __init__(self, read_traces: Callable, num_frames: int, num_chunks_ahead: int = 2):
+        self._read_traces = read_traces
+        self._num_frames = num_frames
+        self._num_chunks_ahead = num_chunks_ahead
+        # reads are serialized; the underlying readers are not thread-safe
+        self._read_lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._pending: "OrderedDict[tuple, object]" = OrderedDict()
+        self.num_hits = 0
+        self.num_misses = 0
+
+    def get_traces(self, start_frame: int, end_frame: int, channel_indices: Union[slice, np.ndarray, list]) -> np.ndarray:
+        key = (start_frame, end_frame, _channels_key(channel_indices))
+        future = self._pending.pop(key, None)
+        if future is not None:
+            self.num_hits += 1
+            traces = future.result()
+        else:
+            self.num_misses += 1
+            self._drop_pending()
+            traces = self._read(start_frame, end_frame, channel_indices)
+        self._schedule(end_frame, end_frame - start_frame, channel_indices)
+        return traces
+
+    def get_stats(self) -> dict:
+        return {"num_hits": self.num_hits, "num_misses": self.num_misses}
+
+    def close(self):
+        """
+        Drop the pending prefetches and shut down the background thread
+        """
+        self._drop_pending()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def __del__(self):
+        # the reader may be garbage collected before close() was called
+        executor = getattr(self, "_executor", None)
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _read(self, start_frame, end_frame, channel_indices):
+        with self._read_lock:
+            return self._read_traces(start_frame, end_frame, channel_indices)
+
+    def _schedule(self, start_frame: int, window_size: int, channel_indices):
+        if window_size <= 0:
+            return
+        for k in range(self._num_chunks_ahead):
+            s = start_frame + k * window_size
+            if s >= self._num_frames:
+                break
+            e = min(s + window_size, self._num_frames)
+            key = (s, e, _channels_key(channel_indices))
+            if key not in self._pending:
+                self._pending[key] = self._executor.submit(self._read, s, e, channel_indices)
+
+    def _drop_pending(self):
+        for future in self._pending.values():
+            future.cancel()  # type: ignore
+        self._pending.clear()
+
+
+def _channels_key(channel_indices):
+    if channel_indices is None:
+        return None
+    if isinstance(channel_indices, slice):
+        return ("slice", channel_indices.start, channel_indices.stop, channel_indices.step)
+    return ("indices", np.asarray(channel_indices, dtype=np.int64).tobytes())
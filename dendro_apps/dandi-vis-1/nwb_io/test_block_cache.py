@@ -0,0 +1,165 @@
+import os
+
+import numpy as np
+
+from .block_cache import BlockCache, CachedRemoteFile
+
+
+def _random_bytes(num_bytes: int, seed: int = 0) -> bytes:
+    return np.random.default_rng(seed).integers(0, 256, size=num_bytes, dtype=np.uint8).tobytes()
+
+
+def _block_range_requests(server):
+    # range requests other than the 1-byte requests made when resolving
+    return [r for r in server.range_requests if r[2] - r[1] > 1]
+
+
+def test_reads_match_and_hit_the_persistent_cache(range_server, tmp_path):
+    data = _random_bytes(10_000)
+    range_server.files["a.nwb"] = data
+    cache = BlockCache(cache_dir=str(tmp_path), max_size=10**9)
+    f = CachedRemoteFile(range_server.url("a.nwb"), cache=cache, block_size=1000)
+    for start, end in [(0, 10), (2500, 4700), (9990, 10_000), (0, 10_000)]:
+        f.seek(start)
+        assert f.read(end - start) == data[start:end]
+    f.close()
+    num_requests = len(_block_range_requests(range_server))
+    assert num_requests > 0
+
+    # a new file object (as in another processor run) is served from disk
+    f = CachedRemoteFile(range_server.url("a.nwb"), cache=BlockCache(cache_dir=str(tmp_path), max_size=10**9), block_size=1000)
+    f.seek(1234)
+    assert f.read(5000) == data[1234:6234]
+    f.close()
+    assert len(_block_range_requests(range_server)) == num_requests
+
+
+def test_changed_content_is_not_served_from_cache(range_server, tmp_path):
+    range_server.files["a.nwb"] = _random_bytes(5000, seed=1)
+    cache = BlockCache(cache_dir=str(tmp_path), max_size=10**9)
+    f = CachedRemoteFile(range_server.url("a.nwb"), cache=cache, block_size=1000)
+    f.read(5000)
+    f.close()
+    new_data = _random_bytes(5000, seed=2)
+    range_server.files["a.nwb"] = new_data
+    f = CachedRemoteFile(range_server.url("a.nwb"), cache=cache, block_size=1000)
+    assert f.read(5000) == new_data
+    f.close()
+
+
+def test_lru_eviction_to_the_size_cap(tmp_path):
+    cache = BlockCache(cache_dir=str(tmp_path), max_size=5000)
+    for i in range(5):
+        cache.put(f"block{i}", bytes(1000))
+        # distinct modification times, oldest first
+        os.utime(cache._path_for_key(f"block{i}"), (1000 + i, 1000 + i))
+    assert all(cache.contains(f"block{i}") for i in range(5))
+    # a hit refreshes block0, so block1 becomes the least recently used
+    assert cache.get("block0") == bytes(1000)
+    cache.put("block5", bytes(1000))
+    assert cache._compute_total_size() <= cache.max_size
+    assert not cache.contains("block1")
+    assert cache.contains("block0")
+    assert cache.contains("block5")
+
+
+def test_re_resolves_after_expired_redirect(range_server, tmp_path):
+    data = _random_bytes(4000, seed=3)
+    range_server.files["a.nwb"] = data
+    cache = BlockCache(cache_dir=str(tmp_path), max_size=10**9)
+    f = CachedRemoteFile(range_server.url("a.nwb", redirect=True), cache=cache, block_size=1000)
+    f.seek(0)
+    assert f.read(1000) == data[:1000]
+    # the presigned URL expires
+    range_server.generation += 1
+    f.seek(3000)
+    assert f.read(1000) == data[3000:4000]
+    f.close()
+    assert ("/signed/0/a.nwb", 403) in range_server.statuses
+    assert ("/signed/1/a.nwb", 206) in range_server.statuses
+    # blocks are keyed by the ETag, so the expiry does not invalidate them
+    f = CachedRemoteFile(range_server.url("a.nwb", redirect=True), cache=cache, block_size=1000)
+    num_requests = len(_block_range_requests(range_server))
+    assert f.read(4000) == data
+    f.close()
+    # only the blocks that were never read (1 and 2, one run) are fetched
+    assert len(_block_range_requests(range_server)) == num_requests + 1
+
+
+def test_renews_expired_url_from_callback(range_server, tmp_path):
+    # as with InputFile.get_url, each call returns a new presigned URL
+    data = _random_bytes(4000, seed=4)
+    range_server.files["a.nwb"] = data
+    urls = []
+
+    def get_url():
+        urls.append(range_server.signed_url("a.nwb"))
+        return urls[-1]
+    cache = BlockCache(cache_dir=str(tmp_path), max_size=10**9)
+    f = CachedRemoteFile(get_url, cache=cache, block_size=1000)
+    assert f.read(1000) == data[:1000]
+    # the presigned URL expires
+    range_server.generation += 1
+    f.seek(2000)
+    assert f.read(2000) == data[2000:4000]
+    f.close()
+    # called again once, after the 403
+    assert len(urls) == 2
+    assert ("/signed/0/a.nwb", 403) in range_server.statuses
+    assert ("/signed/1/a.nwb", 206) in range_server.statuses
+
+
+def test_cache_is_shared_by_urls_with_the_same_etag(range_server, tmp_path):
+    # e.g. the per-job URLs of the same file
+    data = _random_bytes(3000, seed=5)
+    range_server.files["a.nwb"] = data
+    range_server.files["b.nwb"] = data
+    cache = BlockCache(cache_dir=str(tmp_path), max_size=10**9)
+    f = CachedRemoteFile(range_server.url("a.nwb"), cache=cache, block_size=1000)
+    assert f.read(3000) == data
+    f.close()
+    num_requests = len(_block_range_requests(range_server))
+    f = CachedRemoteFile(range_server.url("b.nwb"), cache=cache, block_size=1000)
+    assert f.read(3000) == data
+    f.close()
+    assert len(_block_range_requests(range_server)) == num_requests
+    # the blocks of another block size are not shared
+    f = CachedRemoteFile(range_server.url("b.nwb"), cache=cache, block_size=500)
+    assert f.read(3000) == data
+    f.close()
+    assert len(_block_range_requests(range_server)) > num_requests
+
+
+def test_concurrent_prefetch_matches_sequential_reads(range_server, tmp_path):
+    data = _random_bytes(50_000, seed=4)
+    range_server.files["a.nwb"] = data
+    byte_ranges = [(0, 3000), (7500, 4500), (30_000, 500), (49_000, 1000)]
+    f = CachedRemoteFile(
+        range_server.url("a.nwb"), cache=BlockCache(cache_dir=str(tmp_path / "concurrent"), max_size=10**9),
+        block_size=1000, num_concurrent_requests=4, max_blocks_per_request=2
+    )
+    f.prefetch(byte_ranges)
+    num_requests = len(_block_range_requests(range_server))
+    # runs longer than max_blocks_per_request are split
+    assert num_requests == 2 + 3 + 1 + 1
+    for offset, size in byte_ranges:
+        for i in range(offset // 1000, (offset + size - 1) // 1000 + 1):
+            assert f.cache.contains(f._block_key(i))
+    f.seek(7500)
+    concurrent_data = f.read(4500)
+    f.close()
+    # everything was prefetched
+    assert len(_block_range_requests(range_server)) == num_requests
+
+    f = CachedRemoteFile(
+        range_server.url("a.nwb"), cache=BlockCache(cache_dir=str(tmp_path / "sequential"), max_size=10**9),
+        block_size=1000
+    )
+    f.seek(7500)
+    assert f.read(4500) == concurrent_data == data[7500:12_000]
+    for offset, size in byte_ranges:
+        f.seek(offset)
+        sequential = f.read(size)
+        assert sequential == data[offset:offset + size]
+        assert f.cache.get(f._block_key(offset // 1000)) is not None
+    f.close()
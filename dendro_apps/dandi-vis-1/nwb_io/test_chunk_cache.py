@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from .chunk_cache import ChunkCachedDatasetReader
+
+
+@pytest.fixture
+def dataset(h5_file):
+    X = np.random.default_rng(0).integers(-1000, 1000, size=(1050, 10), dtype=np.int16)
+    # the last chunk row and column are partial
+    return h5_file.create_dataset("traces", data=X, chunks=(100, 4), compression="gzip")
+
+
+@pytest.mark.parametrize("channel_indices", [
+    slice(None),
+    slice(2, 9),
+    [7, 1, 2],
+    [3, 3, 9, 0, 3],
+    [],
+])
+def test_reads_match_h5py_slicing(dataset, channel_indices):
+    prefetched = []
+    reader = ChunkCachedDatasetReader(dataset, max_cache_size=10**7, prefetch=prefetched.extend)
+    channels = np.arange(10)[channel_indices] if isinstance(channel_indices, slice) else np.array(channel_indices, dtype=int)
+    for start_frame, end_frame in [
+        (0, 100),  # aligned
+        (150, 420),  # unaligned, partially overlapping the previous read
+        (99, 101),
+        (390, 390),  # empty
+        (1000, 1050),  # up to the partial last chunk
+        (1020, 2000),  # past the end
+        (1100, 1200),  # completely past the end
+    ]:
+        traces = reader.read(start_frame, end_frame, channel_indices)
+        expected = dataset[start_frame:end_frame][:, channels]
+        assert traces.dtype == dataset.dtype
+        np.testing.assert_array_equal(traces, expected)
+    # chunks past the end of the dataset are never looked up for prefetching
+    assert all(size > 0 for _, size in prefetched)
+
+
+def test_reads_with_a_small_cache(dataset):
+    # the cache holds less than one chunk row, so every read goes to the dataset
+    reader = ChunkCachedDatasetReader(dataset, max_cache_size=1000)
+    for start_frame in range(0, 1050, 70):
+        np.testing.assert_array_equal(
+            reader.read(start_frame, start_frame + 130, [5, 0]), dataset[start_frame:start_frame + 130][:, [5, 0]]
+        )
@@ -0,0 +1,21 @@
+import numpy as np
+
+from .read_ahead import ReadAheadTraceReader
+
+
+def test_read_ahead_hits_and_close():
+    X = np.arange(1000 * 3).reshape(1000, 3)
+    reads = []
+
+    def read_traces(start_frame, end_frame, channel_indices):
+        reads.append((start_frame, end_frame))
+        return X[start_frame:end_frame][:, channel_indices]
+
+    reader = ReadAheadTraceReader(read_traces, num_frames=1000, num_chunks_ahead=2)
+    for start_frame in range(0, 1000, 300):
+        end_frame = min(start_frame + 300, 1000)
+        np.testing.assert_array_equal(reader.get_traces(start_frame, end_frame, [2, 0]), X[start_frame:end_frame][:, [2, 0]])
+    assert reader.get_stats() == {"num_hits": 3, "num_misses": 1}
+    reader.close()
+    assert reader._executor._shutdown
+    assert len(reader._pending) == 0
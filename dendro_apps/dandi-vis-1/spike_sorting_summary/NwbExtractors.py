@@ -70,8 +70,9 @@ def retrieve_electrical_series(nwbfile: NWBFile, electrical_series_name: Optiona
 
 def read_nwbfile(
     file_path: str | Path,
-    stream_mode: Literal["ffspec", "ros3"] | None = None,
+    stream_mode: Literal["ffspec", "ros3", "cached"] | None = None,
     stream_cache_path: str | Path | None = None,
+    stream_concurrency: int = 1,
 ) -> NWBFile:
     """
     Read an NWB file and return the NWBFile object.
@@ -80,10 +81,13 @@ def read_nwbfile(
     ----------
     file_path : Path, str
         The path to the NWB file.
-    stream_mode : "fsspec" or "ros3" or None, default: None
+    stream_mode : "fsspec" or "ros3" or "cached" or None, default: None
         The streaming mode to use. If None it assumes the file is on the local disk.
+        "cached" reads through the persistent block cache shared by all dandi-vis-1 processors.
     stream_cache_path : str or None, default: None
         The path to the cache storage
+    stream_concurrency : int, default: 1
+        For "cached", the number of range requests issued concurrently for large reads
 
     Returns
     -------
@@ -97,7 +101,7 @@ def read_nwbfile(
 
     Notes
     -----
-    This function can stream data from either the "fsspec" or "ros3" protocols.
+    This function can stream data from either the "fsspec", "ros3" or "cached" protocols.
 
 
     Examples
@@ -129,6 +133,12 @@ def read_nwbfile(
         assert "ros3" in drivers, assertion_msg
         io = NWBHDF5IO(path=file_path, mode="r", load_namespaces=True, driver="ros3")
 
+    elif stream_mode == "cached":
+        from nwb_io.block_cache import open_cached_remote_file
+
+        remote_file = open_cached_remote_file(str(file_path), num_concurrent_requests=stream_concurrency)
+        return _read_nwbfile_from_fileobj(remote_file)
+
     else:
         file_path = str(Path(file_path).absolute())
         io = NWBHDF5IO(path=file_path, mode="r", load_namespaces=True)
@@ -137,6 +147,15 @@ def read_nwbfile(
     return nwbfile
 
 
+def _read_nwbfile_from_fileobj(fileobj) -> NWBFile:
+    import h5py
+    from pynwb import NWBHDF5IO
+
+    file = h5py.File(fileobj, "r")
+    io = NWBHDF5IO(file=file, mode="r", load_namespaces=True)
+    return io.read()
+
+
 class NwbRecordingExtractor(BaseRecording):
     """Load an NWBFile as a RecordingExtractor.
 
@@ -152,9 +171,21 @@ class NwbRecordingExtractor(BaseRecording):
         The number of timestamp samples to use to estimate the rate.
         Used if "rate" is not specified in the ElectricalSeries.
     stream_mode: str or None, default: None
-        Specify the stream mode: "fsspec" or "ros3".
+        Specify the stream mode: "fsspec" or "ros3" or "cached".
     stream_cache_path: str or Path or None, default: None
         Local path for caching. If None it uses cwd
+    chunk_cache_size: int, default: 128 * 1024**2
+        Maximum size in bytes of decoded HDF5 chunks kept in memory by get_traces. Reads of a chunked
+        ElectricalSeries are expanded to chunk boundaries so that no chunk is fetched and decoded twice
+        by consecutive or overlapping requests. Use 0 to read exactly the requested window instead.
+    read_ahead_num_chunks: int, default: 0
+        If > 0, a background thread prefetches this many subsequent windows (of the size of the last
+        request) while the caller processes the current one. Useful for front-to-back readers of a
+        streamed recording in a single process. See get_read_ahead_stats.
+    stream_concurrency: int, default: 8
+        For stream_mode="cached", the number of HTTP range requests issued concurrently over pooled
+        keep-alive connections. Large reads are split into several requests, and all the HDF5 chunks
+        missing for a get_traces call are downloaded concurrently before they are decoded.
 
     Returns
     -------
@@ -193,12 +224,14 @@ class NwbRecordingExtractor(BaseRecording):
         electrical_series_name: str = None,
         load_time_vector: bool = False,
         samples_for_rate_estimation: int = 100000,
-        stream_mode: Optional[Literal["fsspec", "ros3"]] = None,
+        stream_mode: Optional[Literal["fsspec", "ros3", "cached"]] = None,
         stream_cache_path: str | Path | None = None,
+        chunk_cache_size: int = 128 * 1024**2,
+        read_ahead_num_chunks: int = 0,
+        stream_concurrency: int = 8,
     ):
         try:
             from pynwb import NWBHDF5IO, NWBFile
-            from pynwb.ecephys import ElectrodeGroup
         except ImportError:
             raise ImportError(self.installation_mesg)
 
@@ -207,7 +240,17 @@ class NwbRecordingExtractor(BaseRecording):
         self._electrical_series_name = electrical_series_name
 
         self.file_path = file_path
-        self._nwbfile = read_nwbfile(file_path=file_path, stream_mode=stream_mode, stream_cache_path=stream_cache_path)
+        self._remote_file = None
+        if stream_mode == "cached":
+            from nwb_io.block_cache import open_cached_remote_file
+
+            # keep a handle on the remote file so the segment can prefetch chunks through it
+            self._remote_file = open_cached_remote_file(str(file_path), num_concurrent_requests=stream_concurrency)
+            self._nwbfile = _read_nwbfile_from_fileobj(self._remote_file)
+        else:
+            self._nwbfile = read_nwbfile(
+                file_path=file_path, stream_mode=stream_mode, stream_cache_path=stream_cache_path
+            )
         electrical_series = retrieve_electrical_series(self._nwbfile, electrical_series_name)
         # The indices in the electrode table corresponding to this electrical series
         electrodes_indices = electrical_series.electrodes.data[:]
@@ -246,18 +289,11 @@ class NwbRecordingExtractor(BaseRecording):
         else:
             times_kwargs = dict(sampling_frequency=sampling_frequency, t_start=t_start)
 
-        # Extractors channel groups must be integers, but Nwb electrodes group_name can be strings
-        if "group_name" in electrodes_table.colnames:
-            unique_electrode_group_names = list(np.unique(electrodes_table["group_name"][:]))
-
-        # Fill channel properties dictionary from electrodes table
+        # Channel ids from the electrodes table
         if "channel_name" in electrodes_table.colnames:
-            channel_ids = [
-                electrical_series.electrodes["channel_name"][electrodes_index]
-                for electrodes_index in electrodes_indices
-            ]
+            channel_ids = list(_read_electrodes_column(electrodes_table, "channel_name")[electrodes_indices])
         else:
-            channel_ids = [electrical_series.electrodes.table.id[x] for x in electrodes_indices]
+            channel_ids = list(np.asarray(electrodes_table.id[:])[electrodes_indices])
 
         dtype = electrical_series.data.dtype
         BaseRecording.__init__(self, channel_ids=channel_ids, sampling_frequency=sampling_frequency, dtype=dtype)
@@ -267,6 +303,9 @@ class NwbRecordingExtractor(BaseRecording):
             electrical_series_name=electrical_series_name,
             num_frames=num_frames,
             times_kwargs=times_kwargs,
+            chunk_cache_size=chunk_cache_size,
+            read_ahead_num_chunks=read_ahead_num_chunks,
+            prefetch=self._remote_file.prefetch if self._remote_file is not None and stream_concurrency > 1 else None,
         )
         self.add_recording_segment(recording_segment)
 
@@ -285,7 +324,7 @@ class NwbRecordingExtractor(BaseRecording):
         # Set offsets
         offset = electrical_series.offset if hasattr(electrical_series, "offset") else 0
         if offset == 0 and "offset" in electrodes_table:
-            offset = electrodes_table["offset"].data[electrodes_indices]
+            offset = _read_electrodes_column(electrodes_table, "offset")[electrodes_indices]
 
         self.set_channel_offsets(offset * 1e6)
 
@@ -293,57 +332,9 @@ class NwbRecordingExtractor(BaseRecording):
         # Extract and re-name properties from nwbfile TODO: Should be a function
         ########
 
-        properties = dict()
-        # Extract rel_x, rel_y and rel_z and assign to location
-
-        # TODO: Refactor ALL of this and add tests. This is difficult to read.
-        if "rel_x" in electrodes_table:
-            ndim = 3 if "rel_z" in electrodes_table else 2
-            properties["location"] = np.zeros((self.get_num_channels(), ndim), dtype=float)
-
-        for electrical_series_index, (channel_id, electrode_table_index) in enumerate(
-            zip(channel_ids, electrodes_indices)
-        ):
-            if "rel_x" in electrodes_table:
-                properties["location"][electrical_series_index, 0] = electrodes_table["rel_x"][electrode_table_index]
-                if "rel_y" in electrodes_table:
-                    properties["location"][electrical_series_index, 1] = electrodes_table["rel_y"][
-                        electrode_table_index
-                    ]
-                if "rel_z" in electrodes_table:
-                    properties["location"][electrical_series_index, 2] = electrodes_table["rel_z"][
-                        electrode_table_index
-                    ]
-
-        # Extract all the other properties
-        for electrical_series_index, (channel_id, electrode_table_index) in enumerate(
-            zip(channel_ids, electrodes_indices)
-        ):
-            for column in electrodes_table.colnames:
-                if isinstance(electrodes_table[column][electrode_table_index], ElectrodeGroup):
-                    continue
-                elif column == "group_name":
-                    group = unique_electrode_group_names.index(electrodes_table[column][electrode_table_index])
-                    if "group" not in properties:
-                        properties["group"] = np.zeros(self.get_num_channels(), dtype=type(group))
-                    properties["group"][electrical_series_index] = group
-                elif column == "location":
-                    brain_area = electrodes_table[column][electrode_table_index]
-                    if "brain_area" not in properties:
-                        properties["brain_area"] = np.zeros(self.get_num_channels(), dtype=type(brain_area))
-                    properties["brain_area"][electrical_series_index] = brain_area
-                elif column == "offset":
-                    offset = electrodes_table[column][electrode_table_index]
-                    if "offset" not in properties:
-                        properties["offset"] = np.zeros(self.get_num_channels(), dtype=type(offset))
-                    properties["offset"][electrical_series_index] = offset
-                elif column in ["x", "y", "z", "rel_x", "rel_y", "rel_z"]:
-                    continue
-                else:
-                    val = electrodes_table[column][electrode_table_index]
-                    if column not in properties:
-                        properties[column] = np.zeros(self.get_num_channels(), dtype=type(val))
-                    properties[column][electrical_series_index] = val
+        # Each column of the electrodes table is read once, as a whole, and
+        # then indexed by electrodes_indices, rather than element by element
+        properties = _extract_channel_properties(electrodes_table, electrodes_indices)
 
         # Set the properties in the recorder
         for property_name, values in properties.items():
@@ -358,7 +349,7 @@ class NwbRecordingExtractor(BaseRecording):
             else:
                 self.set_property(property_name, values)
 
-        if stream_mode not in ["fsspec", "ros3"]:
+        if stream_mode not in ["fsspec", "ros3", "cached"]:
             file_path = str(Path(file_path).absolute())
         if stream_mode == "fsspec":
             # only add stream_cache_path to kwargs if it was passed as an argument
@@ -374,16 +365,102 @@ class NwbRecordingExtractor(BaseRecording):
             "samples_for_rate_estimation": samples_for_rate_estimation,
             "stream_mode": stream_mode,
             "stream_cache_path": stream_cache_path,
+            "chunk_cache_size": chunk_cache_size,
+            "read_ahead_num_chunks": read_ahead_num_chunks,
+            "stream_concurrency": stream_concurrency,
         }
 
+    def get_read_ahead_stats(self) -> dict:
+        """
+        Number of get_traces calls served from (num_hits) or missed by
+        (num_misses) the read-ahead prefetcher, summed over segments
+        """
+        stats = {"num_hits": 0, "num_misses": 0}
+        for segment in self._recording_segments:
+            if segment._read_ahead is not None:
+                for k, v in segment._read_ahead.get_stats().items():
+                    stats[k] += v
+        return stats
+
+    def close(self):
+        """
+        Stop the read-ahead threads of the segments. The extractor can still
+        be read afterwards, without read-ahead.
+        """
+        for segment in self._recording_segments:
+            segment.close()
+
+
+def _read_electrodes_column(electrodes_table, column: str) -> np.ndarray:
+    values = electrodes_table[column][:]
+    if not isinstance(values, np.ndarray):
+        values = np.array(values)
+    if values.dtype.kind == "S" or (values.dtype.kind == "O" and len(values) > 0 and isinstance(values[0], str)):
+        values = values.astype(str)
+    return values
+
+
+def _extract_channel_properties(electrodes_table, electrodes_indices: np.ndarray) -> dict:
+    """
+    Channel properties from the electrodes table, renamed for SpikeInterface:
+    rel_x/rel_y/rel_z -> location, group_name -> group (integer index into
+    the sorted unique group names), location -> brain_area. ElectrodeGroup
+    references and x/y/z are skipped.
+    """
+    from pynwb.ecephys import ElectrodeGroup
+
+    properties = dict()
+    colnames = list(electrodes_table.colnames)
+    if "rel_x" in colnames:
+        location_columns = [c for c in ["rel_x", "rel_y", "rel_z"] if c in colnames]
+        ndim = 3 if "rel_z" in colnames else 2
+        properties["location"] = np.zeros((len(electrodes_indices), ndim), dtype=float)
+        for j, c in enumerate(location_columns):
+            properties["location"][:, j] = _read_electrodes_column(electrodes_table, c)[electrodes_indices]
+
+    for column in colnames:
+        # the required "group" column holds ElectrodeGroup references; skip it
+        # without resolving every reference
+        if column in ["group", "x", "y", "z", "rel_x", "rel_y", "rel_z"]:
+            continue
+        values = _read_electrodes_column(electrodes_table, column)
+        if len(values) > 0 and isinstance(values[0], ElectrodeGroup):
+            continue
+        values = values[electrodes_indices]
+        if column == "group_name":
+            # Extractors channel groups must be integers, but Nwb electrodes group_name can be strings
+            unique_electrode_group_names = np.unique(_read_electrodes_column(electrodes_table, "group_name"))
+            properties["group"] = np.searchsorted(unique_electrode_group_names, values)
+        elif column == "location":
+            properties["brain_area"] = values
+        else:
+            properties[column] = values
+    return properties
+
 
 class NwbRecordingSegment(BaseRecordingSegment):
-    def __init__(self, nwbfile, electrical_series_name, num_frames, times_kwargs):
+    def __init__(
+        self, nwbfile, electrical_series_name, num_frames, times_kwargs, chunk_cache_size: int = 0,
+        read_ahead_num_chunks: int = 0, prefetch=None
+    ):
         BaseRecordingSegment.__init__(self, **times_kwargs)
         self._nwbfile = nwbfile
         self._electrical_series_name = electrical_series_name
         self.electrical_series = retrieve_electrical_series(self._nwbfile, self._electrical_series_name)
         self._num_samples = num_frames
+        self._chunk_reader = None
+        data = self.electrical_series.data
+        if chunk_cache_size > 0 and getattr(data, "chunks", None) is not None and len(data.shape) == 2:
+            from nwb_io.chunk_cache import ChunkCachedDatasetReader
+
+            self._chunk_reader = ChunkCachedDatasetReader(data, max_cache_size=chunk_cache_size, prefetch=prefetch)
+        self._read_ahead = None
+        if read_ahead_num_chunks > 0:
+            from nwb_io.read_ahead import ReadAheadTraceReader
+
+            self._read_ahead = ReadAheadTraceReader(
+                self._read_traces, num_frames=num_frames, num_chunks_ahead=read_ahead_num_chunks
+            )
 
     def get_num_samples(self):
         """Returns the number of samples in this signal block
@@ -398,19 +475,34 @@ class NwbRecordingSegment(BaseRecordingSegment):
             start_frame = 0
         if end_frame is None:
             end_frame = self.get_num_samples()
+        if channel_indices is None:
+            channel_indices = slice(None)
+
+        if self._read_ahead is not None:
+            return self._read_ahead.get_traces(start_frame, end_frame, channel_indices)
+        return self._read_traces(start_frame, end_frame, channel_indices)
+
+    def close(self):
+        if self._read_ahead is not None:
+            self._read_ahead.close()
+            self._read_ahead = None
+
+    def _read_traces(self, start_frame, end_frame, channel_indices):
+        if self._chunk_reader is not None:
+            return self._chunk_reader.read(start_frame, end_frame, channel_indices)
 
         electrical_series_data = self.electrical_series.data
         if isinstance(channel_indices, slice):
             traces = electrical_series_data[start_frame:end_frame, channel_indices]
         else:
             # channel_indices is np.ndarray
-            if np.array(channel_indices).size > 1 and np.any(np.diff(channel_indices) < 0):
+            channel_indices = np.asarray(channel_indices)
+            if channel_indices.size > 1 and np.any(np.diff(channel_indices) <= 0):
                 # get around h5py constraint that it does not allow datasets
-                # to be indexed out of order
-                sorted_channel_indices = np.sort(channel_indices)
-                resorted_indices = np.array([list(sorted_channel_indices).index(ch) for ch in channel_indices])
-                recordings = electrical_series_data[start_frame:end_frame, sorted_channel_indices]
-                traces = recordings[:, resorted_indices]
+                # to be indexed out of order (or with repeated indices)
+                unique_channel_indices, inverse = np.unique(channel_indices, return_inverse=True)
+                recordings = electrical_series_data[start_frame:end_frame, unique_channel_indices]
+                traces = recordings[:, inverse]
             else:
                 traces = electrical_series_data[start_frame:end_frame, channel_indices]
 
@@ -432,10 +524,24 @@ class NwbSortingExtractor(BaseSorting):
         The number of timestamp samples to use to estimate the rate.
         Used if "rate" is not specified in the ElectricalSeries.
     stream_mode: str or None, default: None
-        Specify the stream mode: "fsspec" or "ros3" or "remfile".
+        Specify the stream mode: "fsspec" or "ros3" or "remfile" or "cached". "cached" reads through the
+        persistent block cache shared by all dandi-vis-1 processors.
     stream_cache_path: str or Path or None, default: None
         Local path for caching. If None it uses cwd
     units_path: str or None, default: None
+        Path to the units table within the NWB file, e.g. "/units".
+    cache_spike_times: bool, default: True
+        If True, the spike times of all units are read into memory on first access. If False, only the
+        spike times within the requested frame window are read, which avoids downloading the whole
+        spike_times dataset when streaming and only a few windows are needed. In that case the spike
+        times of each unit are assumed to be sorted, as recommended by NWB.
+    include_properties: list of str or None, default: None
+        The units table columns to expose as unit properties. If None, all columns (except spike_times)
+        are exposed. In either case a column is only read from the file on its first get_property call.
+    use_pynwb: bool, default: True
+        If False, the file is read directly with h5py (see nwb_io.h5_nwb_reader) instead of building the
+        full pynwb object graph with NWBHDF5IO.read(), which is much faster for large remote files.
+        Not supported with stream_mode="fsspec".
 
     Returns
     -------
@@ -456,19 +562,68 @@ class NwbSortingExtractor(BaseSorting):
         samples_for_rate_estimation: int = 100000,
         stream_mode: str | None = None,
         stream_cache_path: str | Path | None = None,
-        units_path: str | None = None
+        units_path: str | None = None,
+        cache_spike_times: bool = True,
+        include_properties: List[str] | None = None,
+        use_pynwb: bool = True,
     ):
+        self.stream_mode = stream_mode
+        self.stream_cache_path = stream_cache_path
+        self._electrical_series_name = electrical_series_name
+        self._use_pynwb = use_pynwb
+
+        self.file_path = file_path
+        if use_pynwb:
+            units_ids, sampling_frequency, timestamps, spike_times, spike_times_index, colnames = self._open_with_pynwb(
+                file_path, stream_mode, stream_cache_path, units_path, sampling_frequency, samples_for_rate_estimation
+            )
+        else:
+            units_ids, sampling_frequency, timestamps, spike_times, spike_times_index, colnames = self._open_with_h5py(
+                file_path, stream_mode, units_path, sampling_frequency, samples_for_rate_estimation
+            )
+
+        assert sampling_frequency is not None, (
+            "Couldn't load sampling frequency. Please provide it with the " "'sampling_frequency' argument"
+        )
+
+        BaseSorting.__init__(self, sampling_frequency=sampling_frequency, unit_ids=units_ids)
+        sorting_segment = NwbSortingSegment(
+            spike_times=spike_times, spike_times_index=spike_times_index, unit_ids=units_ids,
+            sampling_frequency=sampling_frequency, timestamps=timestamps, cache_spike_times=cache_spike_times
+        )
+        self.add_sorting_segment(sorting_segment)
+
+        # Units properties are read lazily, on the first get_property call, so
+        # that large columns (e.g. waveforms) are not downloaded unless needed
+        self._lazy_property_columns = [
+            column for column in colnames
+            if column != "spike_times" and (include_properties is None or column in include_properties)
+        ]
+
+        if stream_mode not in ["fsspec", "ros3", "remfile", "cached"]:
+            file_path = str(Path(file_path).absolute())
+        if stream_mode == "fsspec":
+            stream_cache_path = str(Path(self.stream_cache_path).absolute())
+        self._kwargs = {
+            "file_path": file_path,
+            "electrical_series_name": self._electrical_series_name,
+            "sampling_frequency": sampling_frequency,
+            "samples_for_rate_estimation": samples_for_rate_estimation,
+            "stream_mode": stream_mode,
+            "stream_cache_path": stream_cache_path,
+            "units_path": units_path,
+            "cache_spike_times": cache_spike_times,
+            "include_properties": include_properties,
+            "use_pynwb": use_pynwb,
+        }
+
+    def _open_with_pynwb(self, file_path, stream_mode, stream_cache_path, units_path, sampling_frequency, samples_for_rate_estimation):
         try:
             from pynwb import NWBHDF5IO, NWBFile
             from pynwb.ecephys import ElectrodeGroup
         except ImportError:
             raise ImportError(self.installation_mesg)
 
-        self.stream_mode = stream_mode
-        self.stream_cache_path = stream_cache_path
-        self._electrical_series_name = electrical_series_name
-
-        self.file_path = file_path
         if stream_mode == "fsspec":
             import fsspec
             from fsspec.implementations.cached import CachingFileSystem
@@ -489,6 +644,12 @@ class NwbSortingExtractor(BaseSorting):
             remf = remfile.File(file_path)
             file = h5py.File(remf, 'r')
             self.io = NWBHDF5IO(file=file, mode="r", load_namespaces=True)
+        elif stream_mode == "cached":
+            import h5py
+            from nwb_io.block_cache import open_cached_remote_file
+
+            file = h5py.File(open_cached_remote_file(str(file_path)), 'r')
+            self.io = NWBHDF5IO(file=file, mode="r", load_namespaces=True)
 
         elif stream_mode == "ros3":
             self.io = NWBHDF5IO(file_path, mode="r", load_namespaces=True, driver="ros3")
@@ -497,7 +658,8 @@ class NwbSortingExtractor(BaseSorting):
             self.io = NWBHDF5IO(file_path_, mode="r", load_namespaces=True)
 
         self._nwbfile = self.io.read()
-        units_object = load_nwb_object(self._nwbfile, units_path)
+        units_object = load_nwb_object(self._nwbfile, units_path if units_path is not None else "/units")
+        self._units_object = units_object
         units_ids = list(units_object.id[:])
 
         timestamps = None
@@ -512,65 +674,146 @@ class NwbSortingExtractor(BaseSorting):
                 if hasattr(self.electrical_series, "timestamps"):
                     if self.electrical_series.timestamps is not None:
                         timestamps = self.electrical_series.timestamps
-                        sampling_frequency = 1 / np.median(np.diff(timestamps[samples_for_rate_estimation]))
+                        sampling_frequency = 1 / np.median(np.diff(timestamps[:samples_for_rate_estimation]))
 
-        assert sampling_frequency is not None, (
-            "Couldn't load sampling frequency. Please provide it with the " "'sampling_frequency' argument"
-        )
+        spike_times_index_column = units_object["spike_times"]
+        spike_times = spike_times_index_column.target.data
+        spike_times_index = spike_times_index_column.data
+        return units_ids, sampling_frequency, timestamps, spike_times, spike_times_index, list(units_object.colnames)
 
-        # get all units ids
+    def _open_with_h5py(self, file_path, stream_mode, units_path, sampling_frequency, samples_for_rate_estimation):
+        from nwb_io.h5_nwb_reader import open_nwb_h5, get_h5_object, get_table_colnames, get_table_ids, find_electrical_series
 
-        # store units properties and spike features to dictionaries
-        properties = dict()
+        self._h5file = open_nwb_h5(file_path, stream_mode=stream_mode)
+        units_group = get_h5_object(self._h5file, units_path if units_path is not None else "/units")
+        self._units_group = units_group
+        units_ids = list(get_table_ids(units_group))
 
-        for column in list(units_object.colnames):
-            if column == "spike_times":
-                continue
-            # if it is unit_property
-            property_values = units_object[column][:]
+        timestamps = None
+        if sampling_frequency is None:
+            electrical_series = find_electrical_series(self._h5file, self._electrical_series_name)
+            if "starting_time" in electrical_series and "rate" in electrical_series["starting_time"].attrs:
+                sampling_frequency = float(electrical_series["starting_time"].attrs["rate"])
+            elif "timestamps" in electrical_series:
+                timestamps = electrical_series["timestamps"]
+                sampling_frequency = 1 / np.median(np.diff(timestamps[:samples_for_rate_estimation]))
+
+        spike_times = units_group["spike_times"]
+        spike_times_index = units_group["spike_times_index"]
+        return units_ids, sampling_frequency, timestamps, spike_times, spike_times_index, get_table_colnames(units_group)
+
+    def get_property_keys(self):
+        return list(self._properties.keys()) + [
+            column for column in self._lazy_property_columns if column not in self._properties
+        ]
 
-            # only load columns with same shape for all units
-            if np.all(p.shape == property_values[0].shape for p in property_values):
-                properties[column] = property_values
-            else:
-                print(f"Skipping {column} because of unequal shapes across units")
+    def get_property(self, key, ids=None):
+        if key in self._lazy_property_columns:
+            self._load_property(key)
+        return BaseSorting.get_property(self, key, ids=ids)
 
-        BaseSorting.__init__(self, sampling_frequency=sampling_frequency, unit_ids=units_ids)
-        sorting_segment = NwbSortingSegment(
-            nwbfile=self._nwbfile, sampling_frequency=sampling_frequency, timestamps=timestamps,
-            units_path=units_path
+    def set_property(self, key, values, ids=None, missing_value=None):
+        if key in self._lazy_property_columns:
+            if ids is None:
+                # replaced as a whole, no need to read it
+                self._lazy_property_columns.remove(key)
+            else:
+                # a partial update applies to the values from the file
+                self._load_property(key)
+        BaseSorting.set_property(self, key, values, ids=ids, missing_value=missing_value)
+
+    def delete_property(self, key):
+        if key in self._lazy_property_columns and key not in self._properties:
+            self._lazy_property_columns.remove(key)
+            return
+        BaseSorting.delete_property(self, key)
+
+    # The following read self._properties directly, so the remaining lazy
+    # columns are loaded first. Otherwise derived sortings (select_units,
+    # clone, ...) and serialized sortings would lose them.
+
+    def copy_metadata(self, other, only_main=False, ids=None, skip_properties=None):
+        if not only_main:
+            self._load_lazy_properties()
+        BaseSorting.copy_metadata(self, other, only_main=only_main, ids=ids, skip_properties=skip_properties)
+
+    def to_dict(
+        self, include_annotations=False, include_properties=False, relative_to=None, folder_metadata=None, recursive=False
+    ):
+        if include_properties:
+            self._load_lazy_properties()
+        return BaseSorting.to_dict(
+            self,
+            include_annotations=include_annotations,
+            include_properties=include_properties,
+            relative_to=relative_to,
+            folder_metadata=folder_metadata,
+            recursive=recursive,
         )
-        self.add_sorting_segment(sorting_segment)
 
-        for prop_name, values in properties.items():
-            # jfm: added try/catch because there was a problem with IBL example
-            # ValueError: setting an array element with a sequence. The requested array has an inhomogeneous shape after 1 dimensions. The detected shape was (264,) + inhomogeneous part.
-            try:
-                self.set_property(prop_name, np.array(values))
-            except Exception:
-                print(f"WARNING: Problem setting property in NwbSortingExtractor: {prop_name}")
+    def _load_lazy_properties(self):
+        for column in list(self._lazy_property_columns):
+            self._load_property(column)
 
-        if stream_mode not in ["fsspec", "ros3"]:
-            file_path = str(Path(file_path).absolute())
-        if stream_mode == "fsspec":
-            stream_cache_path = str(Path(self.stream_cache_path).absolute())
-        self._kwargs = {
-            "file_path": file_path,
-            "electrical_series_name": self._electrical_series_name,
-            "sampling_frequency": sampling_frequency,
-            "samples_for_rate_estimation": samples_for_rate_estimation,
-            "stream_mode": stream_mode,
-            "stream_cache_path": stream_cache_path,
-        }
+    def _load_property(self, column: str):
+        self._lazy_property_columns.remove(column)
+        if self._use_pynwb:
+            property_values = self._units_object[column][:]
+        else:
+            from nwb_io.h5_nwb_reader import read_table_column
+            property_values = read_table_column(self._units_group, column)
+
+        # only load columns with same shape for all units
+        if not all(np.shape(p) == np.shape(property_values[0]) for p in property_values):
+            print(f"Skipping {column} because of unequal shapes across units")
+            return
+        # jfm: added try/catch because there was a problem with IBL example
+        # ValueError: setting an array element with a sequence. The requested array has an inhomogeneous shape after 1 dimensions. The detected shape was (264,) + inhomogeneous part.
+        try:
+            self.set_property(column, np.array(property_values))
+        except Exception:
+            print(f"WARNING: Problem setting property in NwbSortingExtractor: {column}")
 
 
 class NwbSortingSegment(BaseSortingSegment):
-    def __init__(self, nwbfile, sampling_frequency, timestamps, units_path: Optional[str] = None):
+    def __init__(
+        self, spike_times, spike_times_index, unit_ids, sampling_frequency, timestamps, cache_spike_times: bool = True
+    ):
+        """
+        spike_times and spike_times_index are the (not yet loaded) datasets
+        of the ragged spike_times column of the units table.
+        """
         BaseSortingSegment.__init__(self)
-        self._nwbfile = nwbfile
+        self._spike_times_dataset = spike_times
+        self._spike_times_index_dataset = spike_times_index
+        self._unit_ids = unit_ids
         self._sampling_frequency = sampling_frequency
         self._timestamps = timestamps
-        self._units_path = units_path
+        self._cache_spike_times = cache_spike_times
+        # spike times of all units, concatenated (in memory, or the dataset
+        # itself if not cached), and unit id -> (start, end) into it
+        self._spike_times = None
+        self._unit_id_to_range: Optional[Dict] = None
+
+    def _load_spike_times(self):
+        # read the ragged spike_times column once rather than once per unit
+        spike_times_index = np.asarray(self._spike_times_index_dataset[:], dtype=np.int64)
+        starts = np.concatenate([[0], spike_times_index[:-1]])
+        self._unit_id_to_range = {
+            unit_id: (int(start), int(end)) for unit_id, start, end in zip(self._unit_ids, starts, spike_times_index)
+        }
+        if self._cache_spike_times:
+            spike_times = np.array(self._spike_times_dataset[:])
+            # windowed queries rely on the spike times being sorted within each unit
+            decreasing = np.nonzero(np.diff(spike_times) < 0)[0] + 1
+            unit_inds = np.searchsorted(starts, decreasing, side="right") - 1
+            for k in np.unique(unit_inds[starts[unit_inds] != decreasing]):
+                spike_times[starts[k]:spike_times_index[k]] = np.sort(spike_times[starts[k]:spike_times_index[k]])
+            self._spike_times = spike_times
+        else:
+            self._spike_times = self._spike_times_dataset
+        if self._timestamps is not None:
+            self._timestamps = np.asarray(self._timestamps[:])
 
     def get_unit_spike_train(
         self,
@@ -579,18 +822,67 @@ class NwbSortingSegment(BaseSortingSegment):
         end_frame: Union[int, None] = None,
     ) -> np.ndarray:
         # must be implemented in subclass
-        if start_frame is None:
-            start_frame = 0
-        if end_frame is None:
-            end_frame = np.inf
-        units_object = load_nwb_object(self._nwbfile, self._units_path)
-        times = units_object["spike_times"][list(units_object.id[:]).index(unit_id)][:]
+        if self._unit_id_to_range is None:
+            self._load_spike_times()
+        assert self._spike_times is not None and self._unit_id_to_range is not None
+        i1, i2 = self._unit_id_to_range[unit_id]
+
+        # Narrow [i1, i2) with a binary search on the sorted times so that only
+        # the spikes in (a slightly padded version of) the window are read and
+        # converted to frames. The exact window is applied after conversion.
+        t_min, t_max = self._get_time_bounds(start_frame, end_frame)
+        if t_min is not None:
+            i1 = _searchsorted_range(self._spike_times, i1, i2, t_min, side="left")
+        if t_max is not None:
+            i2 = _searchsorted_range(self._spike_times, i1, i2, t_max, side="right")
+        times = np.asarray(self._spike_times[i1:i2])
 
         if self._timestamps is not None:
-            frames = np.searchsorted(times, self.timestamps).astype("int64")
+            frames = np.searchsorted(self._timestamps, times).astype("int64")
         else:
             frames = np.round(times * self._sampling_frequency).astype("int64")
-        return frames[(frames >= start_frame) & (frames < end_frame)]
+        if start_frame is not None:
+            frames = frames[frames >= start_frame]
+        if end_frame is not None:
+            frames = frames[frames < end_frame]
+        return frames
+
+    def _get_time_bounds(self, start_frame: Union[int, None], end_frame: Union[int, None]):
+        # times outside [t_min, t_max] are guaranteed to map to frames outside the window
+        t_min = None
+        t_max = None
+        if self._timestamps is not None:
+            # frame = number of timestamps strictly below the spike time
+            if start_frame is not None and start_frame > 0:
+                t_min = self._timestamps[min(start_frame, len(self._timestamps)) - 1]
+            if end_frame is not None and end_frame <= len(self._timestamps):
+                t_max = self._timestamps[end_frame - 1] if end_frame > 0 else -np.inf
+        else:
+            # frame = round(time * sampling_frequency), padded by one frame
+            if start_frame is not None:
+                t_min = (start_frame - 1) / self._sampling_frequency
+            if end_frame is not None:
+                t_max = (end_frame + 1) / self._sampling_frequency
+        return t_min, t_max
+
+
+def _searchsorted_range(values, i1: int, i2: int, value, side: str):
+    """
+    np.searchsorted restricted to values[i1:i2], returning an absolute index.
+    values may be an in-memory array or an h5py dataset, in which case the
+    bisection only reads O(log n) individual elements.
+    """
+    if isinstance(values, np.ndarray):
+        return i1 + int(np.searchsorted(values[i1:i2], value, side=side))
+    lo, hi = i1, i2
+    while lo < hi:
+        mid = (lo + hi) // 2
+        v = values[mid]
+        if v < value or (side == "right" and v == value):
+            lo = mid + 1
+        else:
+            hi = mid
+    return lo
 
 
 read_nwb_recording = define_function_from_class(source_class=NwbRecordingExtractor, name="read_nwb_recording")
@@ -633,8 +925,14 @@ def read_nwb(file_path, load_recording=True, load_sorting=False, electrical_seri
 
 def load_nwb_object(nwbfile, path: str):
     """
-    Load an object from an NWB file given its path.
+    Load an object from an NWB file given its path. nwbfile may also be an
+    h5py.File, in which case the h5py group or dataset is returned.
     """
+    import h5py
+
+    if isinstance(nwbfile, h5py.Group):
+        from nwb_io.h5_nwb_reader import get_h5_object
+        return get_h5_object(nwbfile, path)
     path_parts = [p for p in path.split("/") if p]
     obj = nwbfile
     for i, part in enumerate(path_parts):
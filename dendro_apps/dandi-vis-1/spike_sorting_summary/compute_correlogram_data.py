@@ -2,62 +2,304 @@ from typing import Union
 import spikeinterface as si
 import numpy as np
 
+# maximum number of (spike, spike) pairs materialized at once; each pair
+# takes about 10 int64 temporaries (80 bytes) in
+# compute_crosscorrelogram_matrix_data, so about 80 MB per block
+_MAX_PAIRS_PER_BLOCK = 1_000_000
+
+
 def compute_correlogram_data(*, sorting: si.BaseSorting, unit_id1: int, unit_id2: Union[int, None]=None, window_size_msec: float, bin_size_msec: float):
     times1 = sorting.get_unit_spike_train(unit_id=unit_id1, segment_index=0)
-    num_bins = int(window_size_msec / bin_size_msec)
-    if num_bins % 2 == 0: num_bins = num_bins - 1 # odd number of bins
-    num_bins_half = int((num_bins + 1) / 2)
-    bin_edges_msec = np.array((np.arange(num_bins + 1) - num_bins / 2) * bin_size_msec, dtype=np.float32)
-    bin_counts = np.zeros((num_bins,), dtype=np.int32)
     if unit_id2 is None or unit_id1 == unit_id2:
-        # autocorrelogram
-        offset = 1
-        while True:
-            if offset >= len(times1): break
-            deltas_msec = (times1[offset:] - times1[:-offset]) / sorting.get_sampling_frequency() * 1000
-            deltas_msec = deltas_msec[deltas_msec <= bin_edges_msec[-1]]
-            if len(deltas_msec) == 0: break
-            for i in range(num_bins_half):
-                start_msec = bin_edges_msec[num_bins_half - 1 + i]
-                end_msec = bin_edges_msec[num_bins_half + i]
-                ct = len(deltas_msec[(start_msec <= deltas_msec) & (deltas_msec < end_msec)])
-                bin_counts[num_bins_half - 1 + i] += ct
-                bin_counts[num_bins_half - 1 - i] += ct
-            offset = offset + 1
+        times2 = None
     else:
-        # cross-correlogram
         times2 = sorting.get_unit_spike_train(segment_index=0, unit_id=unit_id2)
-        all_times = np.concatenate((times1, times2))
-        all_labels = np.concatenate((1 * np.ones(times1.shape), 2 * np.ones(times2.shape)))
-        sort_inds = np.argsort(all_times)
-        all_times = all_times[sort_inds]
-        all_labels = all_labels[sort_inds]
-        offset = 1
-        while True:
-            if offset >= len(all_times): break
-            deltas_msec = (all_times[offset:] - all_times[:-offset]) / sorting.get_sampling_frequency() * 1000
-
-            deltas12_msec = deltas_msec[(all_labels[offset:] == 2) & (all_labels[:-offset] == 1)]
-            deltas21_msec = deltas_msec[(all_labels[offset:] == 1) & (all_labels[:-offset] == 2)]
-            deltas11_msec = deltas_msec[(all_labels[offset:] == 1) & (all_labels[:-offset] == 1)]
-            deltas22_msec = deltas_msec[(all_labels[offset:] == 2) & (all_labels[:-offset] == 2)]
-
-            deltas12_msec = deltas12_msec[deltas12_msec <= bin_edges_msec[-1]]
-            deltas21_msec = deltas21_msec[deltas21_msec <= bin_edges_msec[-1]]
-            deltas11_msec = deltas11_msec[deltas11_msec <= bin_edges_msec[-1]]
-            deltas22_msec = deltas22_msec[deltas22_msec <= bin_edges_msec[-1]]
-
-            if (len(deltas12_msec) + len(deltas21_msec) + len(deltas11_msec) + len(deltas22_msec)) == 0: break
-            
-            for i in range(num_bins_half):
-                start_msec = bin_edges_msec[num_bins_half - 1 + i]
-                end_msec = bin_edges_msec[num_bins_half + i]
-                ct12 = len(deltas12_msec[(start_msec <= deltas12_msec) & (deltas12_msec < end_msec)])
-                ct21 = len(deltas21_msec[(start_msec <= deltas21_msec) & (deltas21_msec < end_msec)])
-                bin_counts[num_bins_half - 1 + i] += ct12
-                bin_counts[num_bins_half - 1 - i] += ct21
-            offset = offset + 1
+    return compute_correlogram_data_from_times(
+        times1=times1,
+        times2=times2,
+        sampling_frequency=sorting.get_sampling_frequency(),
+        window_size_msec=window_size_msec,
+        bin_size_msec=bin_size_msec
+    )
+
+
+def compute_correlogram_data_from_times(*, times1: np.ndarray, times2: Union[np.ndarray, None]=None, sampling_frequency: float, window_size_msec: float, bin_size_msec: float):
+    """
+    Same as compute_correlogram_data, but operating directly on sorted spike
+    frames. If times2 is None, the autocorrelogram of times1 is computed.
+
+    For every spike in times1, the range of partner spikes within the window
+    is found with searchsorted and the lags (in frames) are accumulated with a
+    single bincount, so the cost is O(N log N + number of pairs in the window)
+    rather than a scan of all spikes for every lag offset.
+    """
+    bin_edges_msec = get_correlogram_bin_edges_msec(window_size_msec=window_size_msec, bin_size_msec=bin_size_msec)
+    num_bins = len(bin_edges_msec) - 1
+    num_bins_half = int((num_bins + 1) / 2)
+    max_lag_frames = _get_max_lag_frames(bin_edges_msec, sampling_frequency)
+    bin_counts = np.zeros((num_bins,), dtype=np.int64)
+    if times2 is None:
+        # autocorrelogram: every pair (i < j) contributes symmetrically
+        ct = _lag_histogram_to_half_bin_counts(
+            compute_lag_histogram(times1, None, max_lag_frames=max_lag_frames),
+            bin_edges_msec=bin_edges_msec,
+            sampling_frequency=sampling_frequency
+        )
+        bin_counts[num_bins_half - 1:] += ct
+        bin_counts[num_bins_half - 1::-1] += ct
+    else:
+        # cross-correlogram: positive lags are spikes of unit 2 after unit 1
+        bin_counts[num_bins_half - 1:] += _lag_histogram_to_half_bin_counts(
+            compute_lag_histogram(times1, times2, max_lag_frames=max_lag_frames),
+            bin_edges_msec=bin_edges_msec,
+            sampling_frequency=sampling_frequency
+        )
+        bin_counts[num_bins_half - 1::-1] += _lag_histogram_to_half_bin_counts(
+            compute_lag_histogram(times2, times1, max_lag_frames=max_lag_frames, include_zero_lag=False),
+            bin_edges_msec=bin_edges_msec,
+            sampling_frequency=sampling_frequency
+        )
+    return {
+        'bin_edges_sec': (bin_edges_msec / 1000).astype(np.float32),
+        'bin_counts': bin_counts.astype(np.int32)
+    }
+
+
+def compute_multiresolution_autocorrelogram_data(*, times: np.ndarray, sampling_frequency: float, resolutions: list):
+    """
+    Compute autocorrelograms of one spike train at several resolutions.
+
+    The lags are enumerated once, over the largest window, into a histogram
+    with one bin per frame. Each requested resolution is then obtained by
+    rebinning that histogram, which gives the same result as calling
+    compute_correlogram_data_from_times separately for each resolution.
+
+    Parameters
+    ----------
+    times : np.ndarray
+        Sorted spike frames
+    sampling_frequency : float
+        Sampling frequency of the spike frames
+    resolutions : list of (window_size_msec, bin_size_msec)
+        The requested resolutions
+
+    Returns
+    -------
+    list of dicts with bin_edges_sec and bin_counts, one per resolution
+    """
+    bin_edges_msec_list = [
+        get_correlogram_bin_edges_msec(window_size_msec=window_size_msec, bin_size_msec=bin_size_msec)
+        for window_size_msec, bin_size_msec in resolutions
+    ]
+    max_lag_frames_list = [_get_max_lag_frames(bin_edges_msec, sampling_frequency) for bin_edges_msec in bin_edges_msec_list]
+    lag_hist = compute_lag_histogram(times, None, max_lag_frames=max(max_lag_frames_list))
+    ret = []
+    for bin_edges_msec, max_lag_frames in zip(bin_edges_msec_list, max_lag_frames_list):
+        num_bins = len(bin_edges_msec) - 1
+        num_bins_half = int((num_bins + 1) / 2)
+        ct = _lag_histogram_to_half_bin_counts(
+            lag_hist[:max_lag_frames + 1],
+            bin_edges_msec=bin_edges_msec,
+            sampling_frequency=sampling_frequency
+        )
+        bin_counts = np.zeros((num_bins,), dtype=np.int64)
+        bin_counts[num_bins_half - 1:] += ct
+        bin_counts[num_bins_half - 1::-1] += ct
+        ret.append({
+            'bin_edges_sec': (bin_edges_msec / 1000).astype(np.float32),
+            'bin_counts': bin_counts.astype(np.int32)
+        })
+    return ret
+
+
+def compute_crosscorrelogram_matrix_data(*, spike_trains: list, sampling_frequency: float, window_size_msec: float, bin_size_msec: float, max_num_pairs: Union[int, None]=None):
+    """
+    Compute the cross-correlograms of all pairs of distinct units in one pass
+    over the merged, sorted spike vector.
+
+    Parameters
+    ----------
+    spike_trains : list of np.ndarray
+        Sorted spike frames, one array per unit
+    sampling_frequency : float
+        Sampling frequency of the spike frames
+    window_size_msec : float
+        Total width of the correlogram window
+    bin_size_msec : float
+        Width of each bin
+    max_num_pairs : int or None
+        If given, only the pairs with the largest number of spike pairs
+        within the window are kept, bounding the size of the output
+
+    Returns
+    -------
+    dict with
+        bin_edges_sec: (num_bins + 1,) float32
+        unit_index_pairs: (K, 2) int32, with unit_index_pairs[k, 0] < unit_index_pairs[k, 1]
+        bin_counts: (K, num_bins) int32, positive lags meaning the second unit fires after the first
+    """
+    bin_edges_msec = get_correlogram_bin_edges_msec(window_size_msec=window_size_msec, bin_size_msec=bin_size_msec)
+    num_bins = len(bin_edges_msec) - 1
+    num_bins_half = int((num_bins + 1) / 2)
+    max_lag_frames = _get_max_lag_frames(bin_edges_msec, sampling_frequency)
+    lag_to_half_bin = _get_lag_to_half_bin(max_lag_frames=max_lag_frames, bin_edges_msec=bin_edges_msec, sampling_frequency=sampling_frequency)
+    num_units = len(spike_trains)
+    empty_result = {
+        'bin_edges_sec': (bin_edges_msec / 1000).astype(np.float32),
+        'unit_index_pairs': np.zeros((0, 2), dtype=np.int32),
+        'bin_counts': np.zeros((0, num_bins), dtype=np.int32)
+    }
+    if num_units < 2:
+        return empty_result
+
+    # merged spike vector, sorted by time
+    times = np.concatenate([np.asarray(st, dtype=np.int64) for st in spike_trains])
+    labels = np.concatenate([np.full((len(st),), i, dtype=np.int64) for i, st in enumerate(spike_trains)])
+    sort_inds = np.argsort(times, kind='stable')
+    times = times[sort_inds]
+    labels = labels[sort_inds]
+
+    # Pairs (a, b) with a < b are indexed in the upper triangle. The row
+    # offsets give the index of pair (a, a + 1).
+    num_pairs_total = num_units * (num_units - 1) // 2
+    row_offsets = np.cumsum(np.concatenate([[0], np.arange(num_units - 1, 0, -1)]))
+
+    def iter_blocks():
+        for lags, inds1, inds2 in iter_pair_lags(times, None, max_lag_frames=max_lag_frames, return_indices=True):
+            labels1 = labels[inds1]
+            labels2 = labels[inds2]
+            half_bins = lag_to_half_bin[lags]
+            keep = (labels1 != labels2) & (half_bins < num_bins_half)
+            labels1 = labels1[keep]
+            labels2 = labels2[keep]
+            half_bins = half_bins[keep]
+            unit_a = np.minimum(labels1, labels2)
+            unit_b = np.maximum(labels1, labels2)
+            pair_keys = row_offsets[unit_a] + (unit_b - unit_a - 1)
+            # the later spike belongs to the second unit of the pair for positive lags
+            bins = np.where(labels1 == unit_a, num_bins_half - 1 + half_bins, num_bins_half - 1 - half_bins)
+            yield pair_keys, bins
+
+    if max_num_pairs is not None:
+        # first pass: number of spike pairs within the window for each unit pair
+        pair_totals = np.zeros((num_pairs_total,), dtype=np.int64)
+        for pair_keys, _ in iter_blocks():
+            pair_totals += np.bincount(pair_keys, minlength=num_pairs_total)
+        candidates = np.nonzero(pair_totals)[0]
+        if len(candidates) > max_num_pairs:
+            order = np.argsort(-pair_totals[candidates], kind='stable')
+            candidates = np.sort(candidates[order[:max_num_pairs]])
+        selected_keys = candidates
+    else:
+        selected_keys = np.arange(num_pairs_total)
+    if len(selected_keys) == 0:
+        return empty_result
+
+    # second pass: histogram of the selected unit pairs
+    key_to_row = np.full((num_pairs_total,), -1, dtype=np.int64)
+    key_to_row[selected_keys] = np.arange(len(selected_keys))
+    bin_counts = np.zeros((len(selected_keys) * num_bins,), dtype=np.int64)
+    for pair_keys, bins in iter_blocks():
+        rows = key_to_row[pair_keys]
+        keep = rows >= 0
+        bin_counts += np.bincount(rows[keep] * num_bins + bins[keep], minlength=len(bin_counts))
+    bin_counts = bin_counts.reshape((len(selected_keys), num_bins))
+
+    unit_a = np.searchsorted(row_offsets, selected_keys, side='right') - 1
+    unit_b = selected_keys - row_offsets[unit_a] + unit_a + 1
     return {
         'bin_edges_sec': (bin_edges_msec / 1000).astype(np.float32),
+        'unit_index_pairs': np.stack([unit_a, unit_b], axis=1).astype(np.int32),
         'bin_counts': bin_counts.astype(np.int32)
-    }
\ No newline at end of file
+    }
+
+
+def get_correlogram_bin_edges_msec(*, window_size_msec: float, bin_size_msec: float):
+    num_bins = int(window_size_msec / bin_size_msec)
+    if num_bins % 2 == 0: num_bins = num_bins - 1 # odd number of bins
+    return np.array((np.arange(num_bins + 1) - num_bins / 2) * bin_size_msec, dtype=np.float32)
+
+
+def compute_lag_histogram(times_a: np.ndarray, times_b: Union[np.ndarray, None], *, max_lag_frames: int, include_zero_lag: bool=True):
+    """
+    Histogram of non-negative lags times_b[j] - times_a[i] (in frames) up to
+    and including max_lag_frames. If times_b is None, the lags are taken
+    within times_a over the pairs i < j.
+    """
+    hist = np.zeros((max_lag_frames + 1,), dtype=np.int64)
+    for lags in iter_pair_lags(times_a, times_b, max_lag_frames=max_lag_frames, include_zero_lag=include_zero_lag):
+        hist += np.bincount(lags, minlength=max_lag_frames + 1)
+    return hist
+
+
+def iter_pair_lags(times_a: np.ndarray, times_b: Union[np.ndarray, None], *, max_lag_frames: int, include_zero_lag: bool=True, return_indices: bool=False):
+    """
+    Yield blocks of non-negative lags times_b[j] - times_a[i] (in frames) for
+    all pairs with a lag of at most max_lag_frames. If times_b is None, the
+    pairs are taken within times_a with i < j. Otherwise times_b is always
+    treated as a separate train, even if it is the same array as times_a.
+    If return_indices, yield (lags, i, j) tuples instead.
+    """
+    within = times_b is None
+    times_a = np.asarray(times_a)
+    times_b = times_a if times_b is None else np.asarray(times_b)
+    if len(times_a) == 0 or len(times_b) == 0:
+        return
+    if within:
+        lower = np.arange(1, len(times_a) + 1)
+    elif include_zero_lag:
+        lower = np.searchsorted(times_b, times_a, side='left')
+    else:
+        lower = np.searchsorted(times_b, times_a, side='right')
+    upper = np.searchsorted(times_b, times_a + max_lag_frames, side='right')
+    counts = np.maximum(upper - lower, 0)
+    cumulative_counts = np.cumsum(counts)
+    i1 = 0
+    while i1 < len(times_a):
+        # choose a block of reference spikes with a bounded number of pairs
+        offset = cumulative_counts[i1 - 1] if i1 > 0 else 0
+        i2 = int(np.searchsorted(cumulative_counts, offset + _MAX_PAIRS_PER_BLOCK, side='right'))
+        i2 = min(max(i2, i1 + 1), len(times_a))
+        block_counts = counts[i1:i2]
+        num_pairs = int(cumulative_counts[i2 - 1] - offset)
+        if num_pairs > 0:
+            inds_a = np.repeat(np.arange(i1, i2), block_counts)
+            # position of each pair within the range of its reference spike
+            starts = np.cumsum(block_counts) - block_counts
+            inds_b = np.arange(num_pairs) - np.repeat(starts - lower[i1:i2], block_counts)
+            lags = times_b[inds_b] - times_a[inds_a]
+            if return_indices:
+                yield lags, inds_a, inds_b
+            else:
+                yield lags
+        i1 = i2
+
+
+def _get_max_lag_frames(bin_edges_msec: np.ndarray, sampling_frequency: float):
+    # largest integer lag whose value in msec is within the window
+    max_lag_frames = int(np.floor(float(bin_edges_msec[-1]) / 1000 * sampling_frequency)) + 1
+    while max_lag_frames > 0 and max_lag_frames / sampling_frequency * 1000 > bin_edges_msec[-1]:
+        max_lag_frames -= 1
+    return max_lag_frames
+
+
+def _get_lag_to_half_bin(*, max_lag_frames: int, bin_edges_msec: np.ndarray, sampling_frequency: float):
+    # Map each integer lag to its bin on the non-negative half of the
+    # correlogram (num_bins_half if outside the window). The lag is converted
+    # to msec in float64 and compared with the float32 edges, so that lags
+    # exactly on a boundary are binned consistently with the edges reported
+    # in bin_edges_sec.
+    num_bins = len(bin_edges_msec) - 1
+    num_bins_half = int((num_bins + 1) / 2)
+    half_edges_msec = bin_edges_msec[num_bins_half - 1:]
+    lags_msec = np.arange(max_lag_frames + 1) / sampling_frequency * 1000
+    inds = np.searchsorted(half_edges_msec, lags_msec, side='right') - 1
+    return np.minimum(inds, num_bins_half)
+
+
+def _lag_histogram_to_half_bin_counts(lag_hist: np.ndarray, *, bin_edges_msec: np.ndarray, sampling_frequency: float):
+    num_bins = len(bin_edges_msec) - 1
+    num_bins_half = int((num_bins + 1) / 2)
+    inds = _get_lag_to_half_bin(max_lag_frames=len(lag_hist) - 1, bin_edges_msec=bin_edges_msec, sampling_frequency=sampling_frequency)
+    valid = inds < num_bins_half
+    return np.bincount(inds[valid], weights=lag_hist[valid], minlength=num_bins_half).astype(np.int64)
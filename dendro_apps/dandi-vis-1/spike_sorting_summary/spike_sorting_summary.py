@@ -21,6 +21,27 @@ class SpikeSortingSummaryContext(BaseModel):
     sampling_frequency: Optional[float] = Field(
         default=None, description="Override the sampling frequency of the recording"
     )
+    n_jobs: int = Field(
+        default=1, description="Number of worker processes to use for computing correlograms"
+    )
+    compute_crosscorrelograms: bool = Field(
+        default=False, description="Include the cross-correlograms of unit pairs (see max_num_crosscorrelograms)"
+    )
+    max_num_crosscorrelograms: Optional[int] = Field(
+        default=1000, description="Maximum number of unit pairs (those with the most spike pairs within the window) to include in the cross-correlograms, or None for all pairs"
+    )
+    spike_trains_chunking: str = Field(
+        default="fixed", description="How to place the spike_trains chunk boundaries: 'fixed' (equal durations chosen from the average firing rate) or 'balanced' (at quantiles of the spike times, so that chunks hold similar numbers of spikes)"
+    )
+    max_spikes_per_chunk: int = Field(
+        default=500000, description="Maximum number of spikes per spike_trains chunk, for 'balanced' chunking"
+    )
+    max_chunk_duration_sec: float = Field(
+        default=10000, description="Maximum duration of a spike_trains chunk in seconds, for 'balanced' chunking"
+    )
+    spike_trains_format_version: int = Field(
+        default=1, description="Encoding of spike_trains: 1 (float32 seconds relative to the chunk start) or 2 (per-unit integer frame deltas in 1, 2 or 4 bytes each, with the deltas that do not fit stored separately)"
+    )
 
 
 class SpikeSortingSummaryProcessor(ProcessorBase):
@@ -44,7 +65,7 @@ class SpikeSortingSummaryProcessor(ProcessorBase):
             stream_mode = None
         else:
             file_path = context.input.get_url()
-            stream_mode = "remfile"
+            stream_mode = "cached"
         assert file_path is not None
 
         units_path = context.units_path
@@ -56,21 +77,19 @@ class SpikeSortingSummaryProcessor(ProcessorBase):
             stream_mode=stream_mode,
             units_path=units_path,
             sampling_frequency=sampling_frequency,
+            # only the spike times are needed
+            include_properties=[],
+            use_pynwb=False,
         )
 
         if sampling_frequency is None:
             sampling_frequency = sorting.get_sampling_frequency()
 
         unit_ids = [unit_id for unit_id in sorting.get_unit_ids()]
-        total_num_spikes = 0
-        max_time = -np.inf
-        spike_counts = []
-        for unit_id in unit_ids:
-            st = sorting.get_unit_spike_train(unit_id)
-            spike_counts.append(len(st))
-            total_num_spikes += len(st)
-            if len(st) > 0:
-                max_time = max(max_time, np.max(st) / sorting.get_sampling_frequency())
+        spike_frames, spike_unit_indices = _get_spike_vector(sorting, unit_ids)
+        spike_counts = [int(c) for c in np.bincount(spike_unit_indices, minlength=len(unit_ids))]
+        total_num_spikes = len(spike_frames)
+        max_time = np.max(spike_frames) / sorting.get_sampling_frequency() if total_num_spikes > 0 else -np.inf
         total_duration_sec: float = max_time  # type: ignore # we assume the start time is 0
 
         output_h5_fname = "output.h5"
@@ -83,34 +102,160 @@ class SpikeSortingSummaryProcessor(ProcessorBase):
             f.attrs["total_num_spikes"] = total_num_spikes
             _create_spike_trains(
                 f=f,
-                sorting=sorting,
+                spike_frames=spike_frames,
+                spike_unit_indices=spike_unit_indices,
+                sampling_frequency=sorting.get_sampling_frequency(),
                 total_num_spikes=total_num_spikes,
                 total_duration_sec=total_duration_sec,
                 unit_ids=unit_ids,
                 spike_counts=spike_counts,
+                chunking=context.spike_trains_chunking,
+                max_spikes_per_chunk=context.max_spikes_per_chunk,
+                max_chunk_duration_sec=context.max_chunk_duration_sec,
+                format_version=context.spike_trains_format_version,
             )
             _create_autocrorrelograms(
                 f=f,
                 sorting=sorting,
                 unit_ids=unit_ids,
-                window_size_msec=100,
-                bin_size_msec=1,
+                resolutions=[(100, 1), (1000, 10)],
+                n_jobs=context.n_jobs,
             )
+            if context.compute_crosscorrelograms:
+                _create_crosscorrelograms(
+                    f=f,
+                    sorting=sorting,
+                    unit_ids=unit_ids,
+                    window_size_msec=100,
+                    bin_size_msec=1,
+                    max_num_pairs=context.max_num_crosscorrelograms,
+                )
         output_nh5_fname = "output.nh5"
         h5_to_nh5(output_h5_fname, output_nh5_fname)
         context.output.upload(output_nh5_fname)
 
 
+def _get_spike_vector(sorting: "si.BaseSorting", unit_ids: list):
+    """
+    Read every spike train once and return (spike_frames,
+    spike_unit_indices), ordered by unit (in the order of unit_ids) and by
+    time within each unit.
+    """
+    spike_trains = [np.sort(sorting.get_unit_spike_train(unit_id, segment_index=0)) for unit_id in unit_ids]
+    if len(spike_trains) == 0:
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+    spike_frames = np.concatenate(spike_trains).astype(np.int64)
+    spike_unit_indices = np.repeat(np.arange(len(unit_ids)), [len(st) for st in spike_trains])
+    return spike_frames, spike_unit_indices
+
+
 def _create_spike_trains(
     f: "h5py.File",
-    sorting: "si.BaseSorting",
+    spike_frames: np.ndarray,
+    spike_unit_indices: np.ndarray,
+    sampling_frequency: float,
     total_num_spikes: int,
     total_duration_sec: float,
     unit_ids: list,
     spike_counts: list,
+    chunking: str = "fixed",
+    max_spikes_per_chunk: int = 500000,
+    max_chunk_duration_sec: float = 10000,
+    format_version: int = 1,
 ):
-    sampling_frequency = sorting.get_sampling_frequency()
+    """
+    Create the spike_trains group. spike_frames and spike_unit_indices are
+    ordered by unit and by time within each unit (see _get_spike_vector).
+    chunking is "fixed" or "balanced" (see _get_fixed_chunk_times and
+    _get_balanced_chunk_times).
+
+    With format_version 1, each chunk has spike_times (float32 seconds
+    relative to the chunk start). With format_version 2, each chunk instead
+    has spike_frame_deltas and a start_frame attribute (see
+    spike_trains_encoding.py, which also has the reference decoder), plus
+    spike_frame_delta_overflows (uint32) for the deltas that do not fit.
+    The dtype of spike_frame_deltas varies from chunk to chunk (uint8,
+    uint16 or uint32, whichever gives the smallest total size), so readers
+    must take it from each dataset.
+    """
+    from .spike_trains_encoding import encode_spike_trains_chunk
+
+    assert format_version in [1, 2], f"Unsupported spike_trains format version: {format_version}"
+    if chunking == "fixed":
+        chunk_start_times, chunk_end_times = _get_fixed_chunk_times(
+            total_num_spikes=total_num_spikes,
+            total_duration_sec=total_duration_sec,
+        )
+    elif chunking == "balanced":
+        chunk_start_times, chunk_end_times = _get_balanced_chunk_times(
+            spike_frames=spike_frames,
+            sampling_frequency=sampling_frequency,
+            total_duration_sec=total_duration_sec,
+            max_spikes_per_chunk=max_spikes_per_chunk,
+            max_chunk_duration_sec=max_chunk_duration_sec,
+        )
+    else:
+        raise ValueError(f"Unsupported spike_trains chunking: {chunking}")
+    spike_trains_group = f.create_group("spike_trains")
+    spike_trains_group.attrs["type"] = "spike_trains"
+    spike_trains_group.attrs["unit_ids"] = unit_ids
+    spike_trains_group.attrs["chunk_start_times"] = chunk_start_times
+    spike_trains_group.attrs["chunk_end_times"] = chunk_end_times
+    spike_trains_group.attrs["sampling_frequency"] = sampling_frequency
+    spike_trains_group.attrs["total_duration_sec"] = total_duration_sec
+    spike_trains_group.attrs["total_num_spikes"] = total_num_spikes
+    spike_trains_group.attrs["spike_counts"] = spike_counts
+    spike_trains_group.attrs["format_version"] = format_version
+    # Assign each spike to a chunk. Chunk i holds the frames from
+    # chunk_start_times[i] * sampling_frequency up to that of the next
+    # chunk; the last chunk holds everything up to the last spike.
+    num_units = len(unit_ids)
+    chunk_start_frames = np.round(np.array(chunk_start_times) * sampling_frequency).astype(np.int64)
+    spike_chunk_indices = np.searchsorted(chunk_start_frames, spike_frames, side="right") - 1
+    in_range = spike_chunk_indices >= 0
+    # a stable sort by chunk keeps the unit-major, time-sorted order
+    # within each chunk
+    order = np.argsort(spike_chunk_indices[in_range], kind="stable")
+    sorted_frames = spike_frames[in_range][order]
+    sorted_chunk_indices = spike_chunk_indices[in_range][order]
+    sorted_unit_indices = spike_unit_indices[in_range][order]
+    chunk_offsets = np.searchsorted(sorted_chunk_indices, np.arange(len(chunk_start_times) + 1), side="left")
+    num_bytes = 0
+    for i in range(len(chunk_start_times)):
+        start_time = chunk_start_times[i]
+        i1, i2 = chunk_offsets[i], chunk_offsets[i + 1]
+        unit_counts = np.bincount(sorted_unit_indices[i1:i2], minlength=num_units)
+        spike_times_index = np.cumsum(unit_counts).astype(np.int32)
+        if format_version == 1:
+            spike_times = (sorted_frames[i1:i2] / sampling_frequency - start_time).astype(np.float32)
+            ds = spike_trains_group.create_dataset(f"chunk_{i}/spike_times", data=spike_times)
+        else:
+            spike_frame_deltas, spike_frame_delta_overflows = encode_spike_trains_chunk(
+                spike_frames=sorted_frames[i1:i2],
+                spike_times_index=spike_times_index,
+                chunk_start_frame=int(chunk_start_frames[i]),
+            )
+            ds = spike_trains_group.create_dataset(f"chunk_{i}/spike_frame_deltas", data=spike_frame_deltas)
+            ds_overflows = spike_trains_group.create_dataset(
+                f"chunk_{i}/spike_frame_delta_overflows", data=spike_frame_delta_overflows
+            )
+            num_bytes += ds_overflows.nbytes
+            spike_trains_group[f"chunk_{i}"].attrs["start_frame"] = int(chunk_start_frames[i])
+        spike_trains_group.create_dataset(
+            f"chunk_{i}/spike_times_index", data=spike_times_index
+        )
+        num_bytes += ds.nbytes
+    if format_version == 2:
+        # format version 1 stores 4 bytes per spike
+        print(f"Spike frame deltas take {num_bytes} bytes ({4 * len(sorted_frames)} bytes with format version 1)")
+
 
+def _get_fixed_chunk_times(total_num_spikes: int, total_duration_sec: float):
+    # chunks of equal duration, chosen from a fixed list based on the
+    # average number of spikes per second
+    if total_num_spikes == 0:
+        # a single empty chunk (total_duration_sec is -inf without spikes)
+        return [0], [0]
     avg_num_spikes_per_chunk = 500000
     approx_num_chunks = int(np.ceil(total_num_spikes / avg_num_spikes_per_chunk))
 
@@ -133,7 +278,8 @@ def _create_spike_trains(
         if approx_duration_per_chunk_sec < dd:
             duration_per_chunk_sec = dd
             break
-    num_chunks = int(np.ceil(total_duration_sec / duration_per_chunk_sec))
+    # at least one chunk, also when every spike is at time 0
+    num_chunks = max(1, int(np.ceil(total_duration_sec / duration_per_chunk_sec)))
     print(f"Using {num_chunks} chunks of duration {duration_per_chunk_sec} sec")
     chunk_start_times = []
     chunk_end_times = []
@@ -142,76 +288,206 @@ def _create_spike_trains(
         end_time = min((i + 1) * duration_per_chunk_sec, total_duration_sec)
         chunk_start_times.append(start_time)
         chunk_end_times.append(end_time)
-    spike_trains_group = f.create_group("spike_trains")
-    spike_trains_group.attrs["type"] = "spike_trains"
-    spike_trains_group.attrs["unit_ids"] = unit_ids
-    spike_trains_group.attrs["chunk_start_times"] = chunk_start_times
-    spike_trains_group.attrs["chunk_end_times"] = chunk_end_times
-    spike_trains_group.attrs["sampling_frequency"] = sorting.get_sampling_frequency()
-    spike_trains_group.attrs["total_duration_sec"] = total_duration_sec
-    spike_trains_group.attrs["total_num_spikes"] = total_num_spikes
-    spike_trains_group.attrs["spike_counts"] = spike_counts
-    for i in range(len(chunk_start_times)):
-        start_time = chunk_start_times[i]
-        end_time = chunk_end_times[i]
-        start_frame = int(start_time * sampling_frequency)
-        end_frame = int(end_time * sampling_frequency)
-        chunk_spike_trains = [
-            (
-                sorting.get_unit_spike_train(
-                    unit_id, start_frame=start_frame, end_frame=end_frame
-                ) / sorting.get_sampling_frequency() - start_time
-            ).astype(np.float32)
-            for unit_id in unit_ids
-        ]
-        if len(chunk_spike_trains) > 0:
-            spike_times = np.concatenate(chunk_spike_trains)
-        else:
-            spike_times = np.array([], dtype=np.float32)
-        spike_times_index = []
-        ind = 0
-        for jj in range(len(chunk_spike_trains)):
-            ind += len(chunk_spike_trains[jj])
-            spike_times_index.append(ind)
-        spike_times_index = np.array(spike_times_index, dtype=np.int32)
-        spike_trains_group.create_dataset(f"chunk_{i}/spike_times", data=spike_times)
-        spike_trains_group.create_dataset(
-            f"chunk_{i}/spike_times_index", data=spike_times_index
-        )
+    return chunk_start_times, chunk_end_times
+
+
+def _get_balanced_chunk_times(
+    spike_frames: np.ndarray,
+    sampling_frequency: float,
+    total_duration_sec: float,
+    max_spikes_per_chunk: int,
+    max_chunk_duration_sec: float,
+):
+    """
+    Place the chunk boundaries at quantiles of the merged spike times, so
+    that each chunk holds about the same number of spikes (at most
+    max_spikes_per_chunk, except for spikes sharing a frame). Chunks longer
+    than max_chunk_duration_sec are then split into equal parts. The
+    boundaries are on whole frames.
+    """
+    num_spikes = len(spike_frames)
+    if num_spikes == 0:
+        # a single empty chunk (total_duration_sec is -inf without spikes)
+        return [0], [0]
+    num_chunks = max(1, int(np.ceil(num_spikes / max_spikes_per_chunk)))
+    sorted_frames = np.sort(spike_frames)
+    quantile_indices = (np.arange(1, num_chunks) * num_spikes) // num_chunks
+    end_frame = int(np.ceil(total_duration_sec * sampling_frequency))
+    boundary_frames = np.unique(np.concatenate([[0], sorted_frames[quantile_indices], [end_frame]]))
+    # e.g. when every spike is at frame 0
+    if len(boundary_frames) < 2:
+        boundary_frames = np.array([0, max(end_frame, 1)])
+    max_chunk_duration_frames = max(1, int(max_chunk_duration_sec * sampling_frequency))
+    chunk_start_times = []
+    chunk_end_times = []
+    for start_frame, end_frame in zip(boundary_frames[:-1], boundary_frames[1:]):
+        num_parts = int(np.ceil((end_frame - start_frame) / max_chunk_duration_frames))
+        part_frames = np.linspace(start_frame, end_frame, num_parts + 1).astype(np.int64)
+        for f1, f2 in zip(part_frames[:-1], part_frames[1:]):
+            chunk_start_times.append(float(f1 / sampling_frequency))
+            chunk_end_times.append(float(f2 / sampling_frequency))
+    chunk_end_times[-1] = total_duration_sec
+    print(f"Using {len(chunk_start_times)} chunks with up to {max_spikes_per_chunk} spikes and {max_chunk_duration_sec} sec each")
+    return chunk_start_times, chunk_end_times
 
 
 def _create_autocrorrelograms(
     f: "h5py.File",
     sorting: "si.BaseSorting",
     unit_ids: list,
-    window_size_msec: int = 100,
-    bin_size_msec: int = 1,
+    resolutions: Optional[list] = None,
+    n_jobs: int = 1,
 ):
-    from .compute_correlogram_data import compute_correlogram_data
-
-    bin_counts_list = []
-    bin_edges_sec_list = []
-    for unit_id in unit_ids:
-        a = compute_correlogram_data(
-            sorting=sorting,
-            unit_id1=unit_id,
-            window_size_msec=window_size_msec,
-            bin_size_msec=bin_size_msec,
+    """
+    Create the autocorrelograms group. resolutions is a list of
+    (window_size_msec, bin_size_msec). The first resolution is written to
+    bin_edges_sec/bin_counts as before, and every resolution is also written
+    to bin_edges_sec_<name>/bin_counts_<name> (see _format_resolution_name).
+    Defaults to [(100, 1)].
+    """
+    from .compute_correlogram_data import compute_multiresolution_autocorrelogram_data
+
+    if resolutions is None:
+        resolutions = [(100, 1)]
+    assert len(resolutions) > 0
+    spike_trains = [sorting.get_unit_spike_train(unit_id, segment_index=0) for unit_id in unit_ids]
+    sampling_frequency = sorting.get_sampling_frequency()
+    if n_jobs > 1 and len(unit_ids) > 1:
+        results = _compute_autocorrelograms_parallel(
+            spike_trains=spike_trains,
+            sampling_frequency=sampling_frequency,
+            resolutions=resolutions,
+            n_jobs=n_jobs,
         )
-        bin_edges_sec = a["bin_edges_sec"]
-        bin_counts = a["bin_counts"]
-        bin_counts_list.append(bin_counts)
-        bin_edges_sec_list.append(bin_edges_sec)
-    assert len(bin_edges_sec_list) > 0
-    bin_edges_sec = bin_edges_sec_list[0]
-    num_bins = len(bin_edges_sec) - 1
-    all_bin_counts = np.zeros((len(unit_ids), num_bins), dtype=np.int32)
-    for i in range(len(unit_ids)):
-        all_bin_counts[i, :] = bin_counts_list[i]
+    else:
+        results = [
+            compute_multiresolution_autocorrelogram_data(
+                times=st,
+                sampling_frequency=sampling_frequency,
+                resolutions=resolutions,
+            )
+            for st in spike_trains
+        ]
+    assert len(results) > 0
     autocorrelograms_group = f.create_group("autocorrelograms")
     autocorrelograms_group.attrs["type"] = "autocorrelograms"
     autocorrelograms_group.attrs["unit_ids"] = unit_ids
-    autocorrelograms_group.create_dataset("bin_edges_sec", data=np.array(bin_edges_sec).astype(
-        np.float32
-    ))
-    autocorrelograms_group.create_dataset("bin_counts", data=all_bin_counts)
+    autocorrelograms_group.attrs["resolution_names"] = [_format_resolution_name(w, b) for w, b in resolutions]
+    autocorrelograms_group.attrs["window_sizes_msec"] = [float(w) for w, b in resolutions]
+    autocorrelograms_group.attrs["bin_sizes_msec"] = [float(b) for w, b in resolutions]
+    for j, (window_size_msec, bin_size_msec) in enumerate(resolutions):
+        bin_edges_sec = results[0][j]["bin_edges_sec"]
+        num_bins = len(bin_edges_sec) - 1
+        all_bin_counts = np.zeros((len(unit_ids), num_bins), dtype=np.int32)
+        for i in range(len(unit_ids)):
+            all_bin_counts[i, :] = results[i][j]["bin_counts"]
+        bin_edges_sec = np.array(bin_edges_sec).astype(np.float32)
+        name = _format_resolution_name(window_size_msec, bin_size_msec)
+        if j == 0:
+            autocorrelograms_group.create_dataset("bin_edges_sec", data=bin_edges_sec)
+            autocorrelograms_group.create_dataset("bin_counts", data=all_bin_counts)
+        autocorrelograms_group.create_dataset(f"bin_edges_sec_{name}", data=bin_edges_sec)
+        autocorrelograms_group.create_dataset(f"bin_counts_{name}", data=all_bin_counts)
+
+
+def _format_resolution_name(window_size_msec: float, bin_size_msec: float):
+    # e.g. w100ms_b1ms
+    return f"w{window_size_msec:g}ms_b{bin_size_msec:g}ms"
+
+
+def _compute_autocorrelograms_parallel(
+    spike_trains: list,
+    sampling_frequency: float,
+    resolutions: list,
+    n_jobs: int,
+):
+    # The spike trains are concatenated into a single shared-memory array so
+    # that the workers can slice them without pickling a copy per task.
+    from concurrent.futures import ProcessPoolExecutor
+    import multiprocessing
+    from multiprocessing import shared_memory
+
+    offsets = np.concatenate([[0], np.cumsum([len(st) for st in spike_trains])]).astype(np.int64)
+    num_spikes = int(offsets[-1])
+    shm = shared_memory.SharedMemory(create=True, size=max(num_spikes, 1) * 8)
+    try:
+        all_times = np.ndarray((num_spikes,), dtype=np.int64, buffer=shm.buf)
+        for i, st in enumerate(spike_trains):
+            all_times[offsets[i]:offsets[i + 1]] = st
+        del all_times
+        # largest units first so that the slowest tasks don't start last
+        order = np.argsort(-np.diff(offsets), kind="stable")
+        results: list = [None] * len(spike_trains)
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [
+                executor.submit(
+                    _autocorrelogram_worker,
+                    shm.name,
+                    num_spikes,
+                    int(offsets[i]),
+                    int(offsets[i + 1]),
+                    sampling_frequency,
+                    resolutions,
+                )
+                for i in order
+            ]
+            # results are assigned by unit index, independent of completion order
+            for i, future in zip(order, futures):
+                results[i] = future.result()
+    finally:
+        shm.close()
+        shm.unlink()
+    return results
+
+
+def _autocorrelogram_worker(
+    shm_name: str,
+    num_spikes: int,
+    i1: int,
+    i2: int,
+    sampling_frequency: float,
+    resolutions: list,
+):
+    from multiprocessing import shared_memory
+    from .compute_correlogram_data import compute_multiresolution_autocorrelogram_data
+
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        all_times = np.ndarray((num_spikes,), dtype=np.int64, buffer=shm.buf)
+        a = compute_multiresolution_autocorrelogram_data(
+            times=all_times[i1:i2],
+            sampling_frequency=sampling_frequency,
+            resolutions=resolutions,
+        )
+        del all_times
+    finally:
+        shm.close()
+    return a
+
+
+def _create_crosscorrelograms(
+    f: "h5py.File",
+    sorting: "si.BaseSorting",
+    unit_ids: list,
+    window_size_msec: int = 100,
+    bin_size_msec: int = 1,
+    max_num_pairs: Optional[int] = None,
+):
+    from .compute_correlogram_data import compute_crosscorrelogram_matrix_data
+
+    spike_trains = [sorting.get_unit_spike_train(unit_id, segment_index=0) for unit_id in unit_ids]
+    a = compute_crosscorrelogram_matrix_data(
+        spike_trains=spike_trains,
+        sampling_frequency=sorting.get_sampling_frequency(),
+        window_size_msec=window_size_msec,
+        bin_size_msec=bin_size_msec,
+        max_num_pairs=max_num_pairs,
+    )
+    print(f"Computed {len(a['unit_index_pairs'])} cross-correlograms")
+    crosscorrelograms_group = f.create_group("crosscorrelograms")
+    crosscorrelograms_group.attrs["type"] = "crosscorrelograms"
+    crosscorrelograms_group.attrs["unit_ids"] = unit_ids
+    # rows of bin_counts correspond to rows of unit_index_pairs, which index into unit_ids
+    crosscorrelograms_group.create_dataset("bin_edges_sec", data=a["bin_edges_sec"])
+    crosscorrelograms_group.create_dataset("unit_index_pairs", data=a["unit_index_pairs"])
+    crosscorrelograms_group.create_dataset("bin_counts", data=a["bin_counts"])
@@ -0,0 +1,70 @@
+import numpy as np
+
+# unsigned integer types supported by nh5, smallest first
+_DELTA_DTYPES = [np.uint8, np.uint16, np.uint32]
+
+
+def encode_spike_trains_chunk(*, spike_frames: np.ndarray, spike_times_index: np.ndarray, chunk_start_frame: int):
+    """
+    Encode the spike frames of one spike_trains chunk (format version 2).
+
+    spike_frames holds the spikes of the chunk grouped by unit and sorted in
+    time within each unit; spike_times_index[j] is the end of unit j's spikes
+    (as in format version 1). For each unit, the first spike is stored as
+    its offset from chunk_start_frame and each following spike as its offset
+    from the previous spike of the same unit.
+
+    Returns (spike_frame_deltas, spike_frame_delta_overflows). The deltas
+    are stored in an unsigned integer type whose maximum value marks an
+    overflow: that delta is instead the next entry of the uint32 overflows
+    array. The type (uint8, uint16 or uint32) is the one that minimizes the
+    total size, so a few long gaps (e.g. of a slowly firing unit) do not
+    force 4 bytes per spike on the whole chunk.
+    """
+    spike_frames = np.asarray(spike_frames, dtype=np.int64)
+    deltas = np.diff(spike_frames, prepend=chunk_start_frame)
+    unit_starts = np.concatenate([[0], spike_times_index[:-1]]).astype(np.int64)
+    # units without spikes in the chunk have no first spike
+    unit_starts = unit_starts[unit_starts < len(spike_frames)]
+    deltas[unit_starts] = spike_frames[unit_starts] - chunk_start_frame
+    assert len(deltas) == 0 or np.min(deltas) >= 0, "Spike frames must be sorted within each unit and not precede the chunk start"
+    if len(deltas) > 0 and np.max(deltas) >= np.iinfo(np.uint32).max:
+        raise ValueError(f"Spike frame delta is too large to encode: {np.max(deltas)}")
+    best = None
+    for dtype in _DELTA_DTYPES:
+        escape = np.iinfo(dtype).max
+        overflow = deltas >= escape
+        num_bytes = len(deltas) * np.dtype(dtype).itemsize + int(np.count_nonzero(overflow)) * 4
+        if best is None or num_bytes < best[0]:
+            best = (num_bytes, dtype, overflow)
+    _, dtype, overflow = best
+    spike_frame_deltas = np.where(overflow, np.iinfo(dtype).max, deltas).astype(dtype)
+    spike_frame_delta_overflows = deltas[overflow].astype(np.uint32)
+    return spike_frame_deltas, spike_frame_delta_overflows
+
+
+def decode_spike_trains_chunk(
+    *,
+    spike_frame_deltas: np.ndarray,
+    spike_frame_delta_overflows: np.ndarray,
+    spike_times_index: np.ndarray,
+    chunk_start_frame: int,
+    chunk_start_time: float,
+    sampling_frequency: float
+):
+    """
+    Reference decoder for format version 2 chunks. Returns the spike times
+    in seconds relative to chunk_start_time as float32, i.e. the
+    spike_times dataset of format version 1.
+    """
+    deltas = np.asarray(spike_frame_deltas).astype(np.int64)
+    overflow = spike_frame_deltas == np.iinfo(spike_frame_deltas.dtype).max
+    assert np.count_nonzero(overflow) == len(spike_frame_delta_overflows), "Number of overflows does not match"
+    deltas[overflow] = spike_frame_delta_overflows
+    # cumulative[i] is the sum of the deltas before spike i
+    cumulative = np.concatenate([[0], np.cumsum(deltas)])
+    counts = np.diff(np.concatenate([[0], spike_times_index])).astype(np.int64)
+    unit_starts = np.concatenate([[0], spike_times_index[:-1]]).astype(np.int64)
+    # subtract the sum of the deltas of the preceding units
+    spike_frames = chunk_start_frame + cumulative[1:] - np.repeat(cumulative[unit_starts], counts)
+    return (spike_frames / sampling_frequency - chunk_start_time).astype(np.float32)
@@ -0,0 +1,157 @@
+import numpy as np
+import pytest
+
+from . import compute_correlogram_data
+from .compute_correlogram_data import (
+    compute_correlogram_data_from_times,
+    compute_crosscorrelogram_matrix_data,
+    compute_multiresolution_autocorrelogram_data,
+    compute_lag_histogram,
+)
+
+
+def _baseline_correlogram(times1, times2, sampling_frequency, window_size_msec, bin_size_msec):
+    # the original implementation (one pass over the spikes per lag offset)
+    num_bins = int(window_size_msec / bin_size_msec)
+    if num_bins % 2 == 0: num_bins = num_bins - 1 # odd number of bins
+    num_bins_half = int((num_bins + 1) / 2)
+    bin_edges_msec = np.array((np.arange(num_bins + 1) - num_bins / 2) * bin_size_msec, dtype=np.float32)
+    bin_counts = np.zeros((num_bins,), dtype=np.int32)
+    if times2 is None:
+        offset = 1
+        while True:
+            if offset >= len(times1): break
+            deltas_msec = (times1[offset:] - times1[:-offset]) / sampling_frequency * 1000
+            deltas_msec = deltas_msec[deltas_msec <= bin_edges_msec[-1]]
+            if len(deltas_msec) == 0: break
+            for i in range(num_bins_half):
+                start_msec = bin_edges_msec[num_bins_half - 1 + i]
+                end_msec = bin_edges_msec[num_bins_half + i]
+                ct = len(deltas_msec[(start_msec <= deltas_msec) & (deltas_msec < end_msec)])
+                bin_counts[num_bins_half - 1 + i] += ct
+                bin_counts[num_bins_half - 1 - i] += ct
+            offset = offset + 1
+    else:
+        all_times = np.concatenate((times1, times2))
+        all_labels = np.concatenate((1 * np.ones(times1.shape), 2 * np.ones(times2.shape)))
+        sort_inds = np.argsort(all_times, kind='stable')
+        all_times = all_times[sort_inds]
+        all_labels = all_labels[sort_inds]
+        offset = 1
+        while True:
+            if offset >= len(all_times): break
+            deltas_msec = (all_times[offset:] - all_times[:-offset]) / sampling_frequency * 1000
+            deltas12_msec = deltas_msec[(all_labels[offset:] == 2) & (all_labels[:-offset] == 1)]
+            deltas21_msec = deltas_msec[(all_labels[offset:] == 1) & (all_labels[:-offset] == 2)]
+            if np.min(deltas_msec) > bin_edges_msec[-1]: break
+            deltas12_msec = deltas12_msec[deltas12_msec <= bin_edges_msec[-1]]
+            deltas21_msec = deltas21_msec[deltas21_msec <= bin_edges_msec[-1]]
+            for i in range(num_bins_half):
+                start_msec = bin_edges_msec[num_bins_half - 1 + i]
+                end_msec = bin_edges_msec[num_bins_half + i]
+                bin_counts[num_bins_half - 1 + i] += len(deltas12_msec[(start_msec <= deltas12_msec) & (deltas12_msec < end_msec)])
+                bin_counts[num_bins_half - 1 - i] += len(deltas21_msec[(start_msec <= deltas21_msec) & (deltas21_msec < end_msec)])
+            offset = offset + 1
+    return {'bin_edges_sec': (bin_edges_msec / 1000).astype(np.float32), 'bin_counts': bin_counts}
+
+
+def _random_train(rng, num_spikes, num_frames):
+    return np.sort(rng.integers(0, num_frames, size=num_spikes)).astype(np.int64)
+
+
+@pytest.mark.parametrize("window_size_msec,bin_size_msec", [(100, 1), (50, 2), (1000, 10)])
+def test_autocorrelogram_matches_baseline(window_size_msec, bin_size_msec):
+    rng = np.random.default_rng(0)
+    times = _random_train(rng, 2000, 30000 * 20)
+    a = compute_correlogram_data_from_times(times1=times, sampling_frequency=30000, window_size_msec=window_size_msec, bin_size_msec=bin_size_msec)
+    b = _baseline_correlogram(times, None, 30000, window_size_msec, bin_size_msec)
+    np.testing.assert_array_equal(a['bin_edges_sec'], b['bin_edges_sec'])
+    np.testing.assert_array_equal(a['bin_counts'], b['bin_counts'])
+
+
+def test_crosscorrelogram_matches_baseline():
+    rng = np.random.default_rng(1)
+    times1 = _random_train(rng, 1500, 30000 * 20)
+    times2 = _random_train(rng, 1000, 30000 * 20)
+    a = compute_correlogram_data_from_times(times1=times1, times2=times2, sampling_frequency=30000, window_size_msec=100, bin_size_msec=1)
+    b = _baseline_correlogram(times1, times2, 30000, 100, 1)
+    np.testing.assert_array_equal(a['bin_counts'], b['bin_counts'])
+
+
+def test_multiresolution_matches_single_resolution():
+    rng = np.random.default_rng(2)
+    times = _random_train(rng, 3000, 30000 * 30)
+    resolutions = [(100, 1), (1000, 10)]
+    results = compute_multiresolution_autocorrelogram_data(times=times, sampling_frequency=30000, resolutions=resolutions)
+    for (window_size_msec, bin_size_msec), r in zip(resolutions, results):
+        a = compute_correlogram_data_from_times(times1=times, sampling_frequency=30000, window_size_msec=window_size_msec, bin_size_msec=bin_size_msec)
+        np.testing.assert_array_equal(r['bin_counts'], a['bin_counts'])
+
+
+def test_same_array_as_times2_is_a_separate_train():
+    times = np.array([0, 10, 20, 1000], dtype=np.int64)
+    within = compute_lag_histogram(times, None, max_lag_frames=20)
+    separate = compute_lag_histogram(times, times, max_lag_frames=20)
+    # pairs i < j only
+    assert within[0] == 0 and within.sum() == 3
+    # all pairs with a non-negative lag, including each spike with itself
+    assert separate[0] == len(times) and separate.sum() == 3 + len(times)
+
+
+def _random_trains(seed=0):
+    # units with different rates, some correlated with unit 0 at a fixed lag
+    rng = np.random.default_rng(seed)
+    num_frames = 30000 * 20
+    trains = [_random_train(rng, n, num_frames) for n in [3000, 50, 800, 0, 1500, 10]]
+    trains.append(np.sort(np.concatenate([trains[0][::3] + 90, _random_train(rng, 200, num_frames)])))
+    trains.append(np.sort(np.maximum(trains[2] - 300, 0)))
+    return trains
+
+
+def test_crosscorrelogram_matrix_matches_pairwise():
+    trains = _random_trains()
+    result = compute_crosscorrelogram_matrix_data(
+        spike_trains=trains, sampling_frequency=30000, window_size_msec=100, bin_size_msec=1
+    )
+    num_units = len(trains)
+    assert len(result['unit_index_pairs']) == num_units * (num_units - 1) // 2
+    for (a, b), bin_counts in zip(result['unit_index_pairs'], result['bin_counts']):
+        assert a < b
+        expected = compute_correlogram_data_from_times(
+            times1=trains[a], times2=trains[b], sampling_frequency=30000, window_size_msec=100, bin_size_msec=1
+        )
+        np.testing.assert_array_equal(bin_counts, expected['bin_counts'])
+        np.testing.assert_array_equal(result['bin_edges_sec'], expected['bin_edges_sec'])
+    # unit 6 fires 3 ms after unit 0: positive lags mean the second unit fires later
+    k = [tuple(p) for p in result['unit_index_pairs']].index((0, 6))
+    num_bins_half = (result['bin_counts'].shape[1] + 1) // 2
+    assert np.argmax(result['bin_counts'][k]) == num_bins_half - 1 + 3
+    # unit 7 fires 10 ms before unit 2
+    k = [tuple(p) for p in result['unit_index_pairs']].index((2, 7))
+    assert np.argmax(result['bin_counts'][k]) == num_bins_half - 1 - 10
+
+
+def test_crosscorrelogram_matrix_keeps_the_pairs_with_most_counts():
+    trains = _random_trains(seed=1)
+    kwargs = dict(spike_trains=trains, sampling_frequency=30000, window_size_msec=100, bin_size_msec=1)
+    full = compute_crosscorrelogram_matrix_data(**kwargs)
+    totals = {tuple(p): int(c.sum()) for p, c in zip(full['unit_index_pairs'], full['bin_counts'])}
+    rows = {tuple(p): c for p, c in zip(full['unit_index_pairs'], full['bin_counts'])}
+    result = compute_crosscorrelogram_matrix_data(**kwargs, max_num_pairs=5)
+    kept = [tuple(p) for p in result['unit_index_pairs']]
+    assert len(kept) == 5
+    assert kept == sorted(kept)
+    dropped = [p for p in totals if p not in kept]
+    assert min(totals[p] for p in kept) >= max(totals[p] for p in dropped)
+    for p, c in zip(kept, result['bin_counts']):
+        np.testing.assert_array_equal(c, rows[p])
+
+
+def test_crosscorrelogram_matrix_with_tiny_blocks(monkeypatch):
+    trains = _random_trains(seed=2)
+    kwargs = dict(spike_trains=trains, sampling_frequency=30000, window_size_msec=100, bin_size_msec=1, max_num_pairs=10)
+    expected = compute_crosscorrelogram_matrix_data(**kwargs)
+    monkeypatch.setattr(compute_correlogram_data, "_MAX_PAIRS_PER_BLOCK", 7)
+    result = compute_crosscorrelogram_matrix_data(**kwargs)
+    for key in ['bin_edges_sec', 'unit_index_pairs', 'bin_counts']:
+        np.testing.assert_array_equal(result[key], expected[key])
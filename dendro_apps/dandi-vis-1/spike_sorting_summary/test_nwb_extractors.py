@@ -0,0 +1,188 @@
+import sys
+
+import numpy as np
+import pytest
+
+from .NwbExtractors import NwbRecordingExtractor, NwbSortingExtractor
+
+
+@pytest.fixture
+def units_nwb(synthetic_nwb):
+    return synthetic_nwb(
+        spike_times=[[0.1, 0.2, 0.3], [0.5], [1.0, 2.0]],
+        unit_columns={"quality": np.array(["good", "mua", "good"]), "amp": np.array([1.0, 2.0, 3.0])},
+    )
+
+
+@pytest.mark.parametrize("use_pynwb", [True, False])
+def test_lazy_properties_are_kept_by_derived_sortings(units_nwb, use_pynwb, monkeypatch):
+    # spikeinterface 0.99.1 only loads an extractor from a dict (clone) if its
+    # top-level package has a __version__
+    monkeypatch.setattr(sys.modules[__package__], "__version__", "0.0.0", raising=False)
+    sorting = NwbSortingExtractor(units_nwb, sampling_frequency=30000.0, use_pynwb=use_pynwb)
+    assert sorted(sorting.get_property_keys()) == ["amp", "quality"]
+    # nothing is read before it is needed
+    assert len(sorting._properties) == 0
+
+    selected = sorting.select_units([2, 0])
+    assert sorted(selected.get_property_keys()) == ["amp", "quality"]
+    assert selected.get_property("quality").tolist() == ["good", "good"]
+    assert selected.get_property("amp").tolist() == [3.0, 1.0]
+
+    sorting = NwbSortingExtractor(units_nwb, sampling_frequency=30000.0, use_pynwb=use_pynwb)
+    assert sorted(sorting.to_dict(include_properties=True)["properties"].keys()) == ["amp", "quality"]
+    clone = sorting.clone()
+    assert clone.get_property("amp").tolist() == [1.0, 2.0, 3.0]
+
+
+def test_partial_set_property_updates_the_values_from_the_file(units_nwb):
+    sorting = NwbSortingExtractor(units_nwb, sampling_frequency=30000.0, use_pynwb=False)
+    sorting.set_property("amp", [10.0], ids=[1])
+    assert sorting.get_property("amp").tolist() == [1.0, 10.0, 3.0]
+    sorting.set_property("quality", ["a", "b", "c"])
+    assert sorting.get_property("quality").tolist() == ["a", "b", "c"]
+    sorting.delete_property("quality")
+    assert sorting.get_property_keys() == ["amp"]
+
+
+def test_include_properties(units_nwb):
+    sorting = NwbSortingExtractor(units_nwb, sampling_frequency=30000.0, include_properties=["amp"], use_pynwb=False)
+    assert sorting.select_units([0]).get_property_keys() == ["amp"]
+
+
+# (start_frame, end_frame) windows, including empty ones and ones that
+# extend beyond the recording
+_WINDOWS = [
+    (None, None), (0, None), (None, 500), (100, 101), (250, 250), (300, 0),
+    (1, 999), (400, 700), (990, 2000), (1500, None), (None, 0),
+]
+
+
+def _spike_times_and_frames(rng, time_base):
+    """
+    Spike times of 3 units (one empty) over about 1000 frames, the
+    timestamps of the ElectricalSeries (or None for a rate of 1 kHz) and the
+    frame of each spike. The first unit also has spikes at and around each
+    boundary of _WINDOWS.
+    """
+    boundaries = np.unique([b for window in _WINDOWS for b in window if b is not None and 0 < b < 1000])
+    if time_base == "rate":
+        timestamps = None
+        edge_times = np.concatenate([(boundaries + d) / 1000 for d in [-1, -0.5, -0.25, 0, 0.25, 0.5, 1]])
+        spike_times = [
+            np.sort(np.concatenate([rng.uniform(-0.01, 1.01, size=200), edge_times])),
+            np.array([]),
+            np.sort(rng.uniform(0, 1, size=30)),
+        ]
+        spike_frames = [np.round(st * 1000).astype(np.int64) for st in spike_times]
+    else:
+        timestamps = 5 + np.cumsum(rng.uniform(0.5e-3, 1.5e-3, size=1000))
+        # equal to the timestamps on either side of each boundary, and between them
+        edge_times = np.concatenate([
+            timestamps[boundaries - 1], timestamps[boundaries], (timestamps[boundaries - 1] + timestamps[boundaries]) / 2
+        ])
+        spike_times = [
+            np.sort(np.concatenate([rng.uniform(timestamps[0] - 0.01, timestamps[-1] + 0.01, size=200), edge_times])),
+            np.array([]),
+            np.sort(rng.uniform(timestamps[0], timestamps[-1], size=30)),
+        ]
+        # frame = number of timestamps strictly below the spike time
+        spike_frames = [np.searchsorted(timestamps, st).astype(np.int64) for st in spike_times]
+    return spike_times, timestamps, spike_frames
+
+
+def _select_frames(frames, start_frame, end_frame):
+    if start_frame is not None:
+        frames = frames[frames >= start_frame]
+    if end_frame is not None:
+        frames = frames[frames < end_frame]
+    return frames
+
+
+@pytest.mark.parametrize("use_pynwb", [True, False])
+@pytest.mark.parametrize("cache_spike_times", [True, False])
+@pytest.mark.parametrize("time_base", ["rate", "timestamps"])
+def test_windowed_spike_trains(synthetic_nwb, use_pynwb, cache_spike_times, time_base):
+    spike_times, timestamps, spike_frames = _spike_times_and_frames(np.random.default_rng(5), time_base)
+    path = synthetic_nwb(
+        spike_times=spike_times, traces=np.zeros((1000, 2), dtype=np.int16), sampling_frequency=1000.0,
+        timestamps=timestamps
+    )
+    sorting = NwbSortingExtractor(path, cache_spike_times=cache_spike_times, use_pynwb=use_pynwb)
+    assert list(sorting.get_unit_ids()) == [0, 1, 2]
+    if time_base == "rate":
+        assert sorting.get_sampling_frequency() == 1000.0
+    for unit_index, unit_id in enumerate(sorting.get_unit_ids()):
+        for start_frame, end_frame in _WINDOWS:
+            # without use_cache, BaseSorting would read the whole spike train
+            # and apply the window itself
+            frames = sorting.get_unit_spike_train(
+                unit_id, start_frame=start_frame, end_frame=end_frame, use_cache=False
+            )
+            expected = _select_frames(spike_frames[unit_index], start_frame, end_frame)
+            np.testing.assert_array_equal(frames, expected, err_msg=f"unit {unit_id} {start_frame}:{end_frame}")
+
+
+@pytest.mark.parametrize("use_pynwb", [True, False])
+def test_unsorted_spike_times_are_sorted_when_cached(synthetic_nwb, use_pynwb):
+    rng = np.random.default_rng(6)
+    # the units before and after the unsorted one are sorted
+    spike_times = [np.sort(rng.uniform(0, 1, size=50)), rng.uniform(0, 1, size=50), np.sort(rng.uniform(0, 1, size=50))]
+    path = synthetic_nwb(spike_times=spike_times, traces=np.zeros((1000, 2), dtype=np.int16), sampling_frequency=1000.0)
+    sorting = NwbSortingExtractor(path, use_pynwb=use_pynwb)
+    for unit_index, unit_id in enumerate(sorting.get_unit_ids()):
+        spike_frames = np.round(np.sort(spike_times[unit_index]) * 1000).astype(np.int64)
+        for start_frame, end_frame in _WINDOWS:
+            frames = sorting.get_unit_spike_train(
+                unit_id, start_frame=start_frame, end_frame=end_frame, use_cache=False
+            )
+            np.testing.assert_array_equal(frames, _select_frames(spike_frames, start_frame, end_frame))
+
+
+def test_h5py_reader_matches_pynwb(units_nwb):
+    sorting1 = NwbSortingExtractor(units_nwb, use_pynwb=True)
+    sorting2 = NwbSortingExtractor(units_nwb, use_pynwb=False)
+    assert list(sorting1.get_unit_ids()) == list(sorting2.get_unit_ids())
+    assert sorting1.get_sampling_frequency() == sorting2.get_sampling_frequency()
+    assert sorting1.get_property_keys() == sorting2.get_property_keys()
+    for key in sorting1.get_property_keys():
+        assert sorting1.get_property(key).tolist() == sorting2.get_property(key).tolist()
+    for unit_id in sorting1.get_unit_ids():
+        np.testing.assert_array_equal(sorting1.get_unit_spike_train(unit_id), sorting2.get_unit_spike_train(unit_id))
+
+
+@pytest.mark.parametrize("with_offset", [True, False])
+@pytest.mark.parametrize("with_group_name", [True, False])
+def test_channel_properties(synthetic_nwb, with_offset, with_group_name):
+    electrode_columns = {
+        "rel_x": np.array([0.0, 1.0, 2.0]),
+        "rel_y": np.array([5.0, 6.0, 7.0]),
+        "x": np.array([10.0, 11.0, 12.0]),
+        "impedance": np.array([1.5, 2.5, 3.5]),
+        "channel_name": np.array(["c0", "c1", "c2"]),
+    }
+    if with_offset:
+        # in volts
+        electrode_columns["offset"] = np.array([1e-3, 2e-3, 3e-3])
+    path = synthetic_nwb(
+        spike_times=[], traces=np.zeros((100, 3), dtype=np.int16), electrode_columns=electrode_columns,
+        group_names=["b", "a", "b"], write_group_name=with_group_name
+    )
+    recording = NwbRecordingExtractor(path)
+    assert list(recording.get_channel_ids()) == ["c0", "c1", "c2"]
+    np.testing.assert_array_equal(recording.get_channel_locations(), [[0.0, 5.0], [1.0, 6.0], [2.0, 7.0]])
+    assert recording.get_property("brain_area").tolist() == ["CA1"] * 3
+    assert recording.get_property("impedance").tolist() == [1.5, 2.5, 3.5]
+    # the ElectrodeGroup references and x/y/z are not properties
+    assert "x" not in recording.get_property_keys()
+    np.testing.assert_array_equal(recording.get_channel_gains(), [1.0, 1.0, 1.0])
+    if with_offset:
+        np.testing.assert_allclose(recording.get_channel_offsets(), [1000.0, 2000.0, 3000.0])
+    else:
+        np.testing.assert_array_equal(recording.get_channel_offsets(), [0.0, 0.0, 0.0])
+    if with_group_name:
+        # indices into the sorted group names
+        assert recording.get_channel_groups().tolist() == [1, 0, 1]
+    else:
+        # the channels all get the default group of the dummy probe
+        assert recording.get_channel_groups().tolist() == [0, 0, 0]
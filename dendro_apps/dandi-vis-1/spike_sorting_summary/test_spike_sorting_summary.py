@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from .compute_correlogram_data import compute_multiresolution_autocorrelogram_data
+from .spike_sorting_summary import (
+    _compute_autocorrelograms_parallel,
+    _create_spike_trains,
+    _get_balanced_chunk_times,
+    _get_fixed_chunk_times,
+)
+
+
+def test_chunk_times_without_spikes():
+    assert _get_fixed_chunk_times(total_num_spikes=0, total_duration_sec=-np.inf) == ([0], [0])
+    assert _get_balanced_chunk_times(
+        spike_frames=np.array([], dtype=np.int64),
+        sampling_frequency=30000,
+        total_duration_sec=-np.inf,
+        max_spikes_per_chunk=1000,
+        max_chunk_duration_sec=100,
+    ) == ([0], [0])
+
+
+def test_fixed_chunk_times_with_all_spikes_at_time_zero():
+    assert _get_fixed_chunk_times(total_num_spikes=3, total_duration_sec=0) == ([0], [0])
+
+
+@pytest.mark.parametrize("chunking", ["fixed", "balanced"])
+@pytest.mark.parametrize("format_version", [1, 2])
+def test_create_spike_trains_without_spikes(h5_file, chunking, format_version):
+    _create_spike_trains(
+        f=h5_file,
+        spike_frames=np.array([], dtype=np.int64),
+        spike_unit_indices=np.array([], dtype=np.int64),
+        sampling_frequency=30000,
+        total_num_spikes=0,
+        total_duration_sec=-np.inf,
+        unit_ids=[1, 2],
+        spike_counts=[0, 0],
+        chunking=chunking,
+        format_version=format_version,
+    )
+    group = h5_file["spike_trains"]
+    assert list(group.attrs["chunk_start_times"]) == [0]
+    assert list(group.attrs["chunk_end_times"]) == [0]
+    assert group["chunk_0/spike_times_index"][()].tolist() == [0, 0]
+    data_name = "spike_times" if format_version == 1 else "spike_frame_deltas"
+    assert group[f"chunk_0/{data_name}"].shape == (0,)
+
+
+def test_autocorrelograms_parallel_matches_serial(monkeypatch):
+    import spikeinterface as si
+    from multiprocessing import shared_memory
+
+    rng = np.random.default_rng(4)
+    sampling_frequency = 30000
+    # units of different sizes, one of them without spikes
+    units_dict = {
+        unit_id: np.sort(rng.integers(0, 60 * sampling_frequency, size=num_spikes))
+        for unit_id, num_spikes in zip([1, 2, 3, 4, 5], [3000, 10, 0, 800, 1])
+    }
+    sorting = si.NumpySorting.from_unit_dict(units_dict, sampling_frequency=sampling_frequency)
+    spike_trains = [sorting.get_unit_spike_train(unit_id) for unit_id in sorting.get_unit_ids()]
+    resolutions = [(100, 1), (1000, 10)]
+
+    shm_names = []
+    SharedMemory = shared_memory.SharedMemory
+
+    def create_shared_memory(*args, **kwargs):
+        shm = SharedMemory(*args, **kwargs)
+        shm_names.append(shm.name)
+        return shm
+
+    monkeypatch.setattr(shared_memory, "SharedMemory", create_shared_memory)
+
+    expected = [
+        compute_multiresolution_autocorrelogram_data(
+            times=st, sampling_frequency=sampling_frequency, resolutions=resolutions
+        )
+        for st in spike_trains
+    ]
+    for n_jobs in [1, 2]:
+        results = _compute_autocorrelograms_parallel(
+            spike_trains=spike_trains,
+            sampling_frequency=sampling_frequency,
+            resolutions=resolutions,
+            n_jobs=n_jobs,
+        )
+        assert len(results) == len(expected)
+        for a, b in zip(results, expected):
+            assert len(a) == len(resolutions)
+            for a_res, b_res in zip(a, b):
+                np.testing.assert_array_equal(a_res["bin_edges_sec"], b_res["bin_edges_sec"])
+                np.testing.assert_array_equal(a_res["bin_counts"], b_res["bin_counts"])
+    # the shared memory is unlinked once the results are collected
+    assert len(shm_names) == 2
+    for name in shm_names:
+        with pytest.raises(FileNotFoundError):
+            SharedMemory(name=name)
@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from .spike_trains_encoding import decode_spike_trains_chunk, encode_spike_trains_chunk
+
+
+def _make_chunk(unit_counts, chunk_start_frame, max_gap, seed=0):
+    # spike frames grouped by unit and sorted within each unit
+    rng = np.random.default_rng(seed)
+    spike_frames = np.concatenate([
+        chunk_start_frame + np.cumsum(rng.integers(0, max_gap, size=count)) for count in unit_counts
+    ] + [np.array([], dtype=np.int64)]).astype(np.int64)
+    spike_times_index = np.cumsum(unit_counts).astype(np.int32)
+    return spike_frames, spike_times_index
+
+
+def _decode(spike_frame_deltas, spike_frame_delta_overflows, spike_times_index, chunk_start_frame, sampling_frequency):
+    return decode_spike_trains_chunk(
+        spike_frame_deltas=spike_frame_deltas,
+        spike_frame_delta_overflows=spike_frame_delta_overflows,
+        spike_times_index=spike_times_index,
+        chunk_start_frame=chunk_start_frame,
+        chunk_start_time=chunk_start_frame / sampling_frequency,
+        sampling_frequency=sampling_frequency,
+    )
+
+
+@pytest.mark.parametrize("max_gap,expected_dtype", [
+    (200, np.uint8),
+    (60000, np.uint16),
+    # about a third of the deltas overflow uint16, which is still smaller than uint32
+    (100000, np.uint16),
+    (2**31, np.uint32),
+])
+def test_round_trip_matches_format_version_1(max_gap, expected_dtype):
+    sampling_frequency = 30000.0
+    chunk_start_frame = 123456789
+    # including units without spikes at the start, middle and end
+    spike_frames, spike_times_index = _make_chunk([0, 50, 1, 0, 300, 0], chunk_start_frame, max_gap)
+    spike_frame_deltas, spike_frame_delta_overflows = encode_spike_trains_chunk(
+        spike_frames=spike_frames, spike_times_index=spike_times_index, chunk_start_frame=chunk_start_frame
+    )
+    assert spike_frame_deltas.dtype == expected_dtype
+    assert spike_frame_delta_overflows.dtype == np.uint32
+    decoded = _decode(spike_frame_deltas, spike_frame_delta_overflows, spike_times_index, chunk_start_frame, sampling_frequency)
+    # the spike_times dataset of format version 1
+    expected = (spike_frames / sampling_frequency - chunk_start_frame / sampling_frequency).astype(np.float32)
+    assert decoded.dtype == np.float32
+    np.testing.assert_array_equal(decoded, expected)
+
+
+def test_empty_chunk():
+    spike_times_index = np.zeros((3,), dtype=np.int32)
+    spike_frame_deltas, spike_frame_delta_overflows = encode_spike_trains_chunk(
+        spike_frames=np.array([], dtype=np.int64), spike_times_index=spike_times_index, chunk_start_frame=100
+    )
+    assert spike_frame_deltas.shape == (0,)
+    assert spike_frame_delta_overflows.shape == (0,)
+    decoded = _decode(spike_frame_deltas, spike_frame_delta_overflows, spike_times_index, 100, 30000.0)
+    assert decoded.shape == (0,)
+
+
+def test_unsorted_spikes_are_rejected():
+    with pytest.raises(AssertionError):
+        encode_spike_trains_chunk(
+            spike_frames=np.array([10, 5]), spike_times_index=np.array([2], dtype=np.int32), chunk_start_frame=0
+        )
+
+
+@pytest.mark.parametrize("median_rate_hz,max_bytes_per_spike", [(3, 2.2), (20, 2.05)])
+def test_size_at_typical_firing_rates(median_rate_hz, max_bytes_per_spike):
+    # Poisson units with log-normal rates in a 1000 s chunk at 30 kHz,
+    # including slowly firing units with gaps of many seconds
+    sampling_frequency = 30000.0
+    num_frames = int(1000 * sampling_frequency)
+    rng = np.random.default_rng(0)
+    rates = np.exp(rng.normal(np.log(median_rate_hz), 1, size=100))
+    trains = [np.sort(rng.integers(0, num_frames, size=rng.poisson(r * 1000))) for r in rates]
+    spike_frames = np.concatenate(trains).astype(np.int64)
+    spike_times_index = np.cumsum([len(t) for t in trains]).astype(np.int32)
+    spike_frame_deltas, spike_frame_delta_overflows = encode_spike_trains_chunk(
+        spike_frames=spike_frames, spike_times_index=spike_times_index, chunk_start_frame=0
+    )
+    num_bytes = spike_frame_deltas.nbytes + spike_frame_delta_overflows.nbytes
+    # format version 1 takes 4 bytes per spike
+    assert num_bytes <= max_bytes_per_spike * len(spike_frames)
+    decoded = _decode(spike_frame_deltas, spike_frame_delta_overflows, spike_times_index, 0, sampling_frequency)
+    np.testing.assert_array_equal(decoded, (spike_frames / sampling_frequency).astype(np.float32))
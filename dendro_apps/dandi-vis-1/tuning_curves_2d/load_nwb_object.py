@@ -1,10 +1,16 @@
+from typing import Union
+import h5py
 import pynwb
 
 
-def load_nwb_object(nwbfile: pynwb.NWBFile, path: str):
+def load_nwb_object(nwbfile: Union[pynwb.NWBFile, h5py.File], path: str):
     """
-    Load an object from an NWB file given its path.
+    Load an object from an NWB file given its path. nwbfile may also be an
+    h5py.File, in which case the h5py group or dataset is returned.
     """
+    if isinstance(nwbfile, h5py.Group):
+        from nwb_io.h5_nwb_reader import get_h5_object
+        return get_h5_object(nwbfile, path)
     path_parts = [p for p in path.split("/") if p]
     obj = nwbfile
     for i, part in enumerate(path_parts):
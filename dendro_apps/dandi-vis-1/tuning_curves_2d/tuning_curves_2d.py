@@ -29,31 +29,37 @@ class TuningCurves2DProcessor(ProcessorBase):
     @staticmethod
     def run(context: TuningCurves2DContext):
         import numpy as np
-        import pynwb
         import pynapple as nap
         import h5py
         from nh5 import h5_to_nh5
+        from nwb_io.h5_nwb_reader import open_nwb_h5, read_table_column, read_timeseries_timestamps
         from .load_nwb_object import load_nwb_object
 
-        input_file = context.input.get_file()
-        input_nwb = pynwb.NWBHDF5IO(file=h5py.File(input_file, "r"), mode="r").read()
+        # Only raw arrays are needed, so read the file directly with h5py
+        # rather than building the pynwb object graph
+        if context.input.is_local():
+            input_h5 = open_nwb_h5(context.input.get_local_file_name())
+        else:
+            # read through the block cache shared with the other processors;
+            # get_url is called again for a new URL if the current one expires
+            input_h5 = open_nwb_h5(context.input.get_url, stream_mode="cached")
 
         num_bins = context.num_bins
         spatial_series_path = context.spatial_series_path
         units_path = context.units_path
 
         # Load the spatial series into a pynapple TsdFrame
-        spatial_series = load_nwb_object(input_nwb, spatial_series_path)
+        spatial_series = load_nwb_object(input_h5, spatial_series_path)
         position_over_time = nap.TsdFrame(
-            d=spatial_series.data[:],
-            t=spatial_series.timestamps[:],
+            d=spatial_series["data"][:],
+            t=read_timeseries_timestamps(spatial_series),
             columns=["x", "y"],
         )
 
         # Load the unit spike times into a pynapple TsGroup
-        units = load_nwb_object(input_nwb, units_path)
-        unit_names = units["unit_name"][:]
-        unit_spike_times = units["spike_times"][:]
+        units = load_nwb_object(input_h5, units_path)
+        unit_names = read_table_column(units, "unit_name")
+        unit_spike_times = read_table_column(units, "spike_times")
         spike_times_group = nap.TsGroup(
             {i: unit_spike_times[i] for i in range(len(unit_names))}
         )